@@ -0,0 +1,492 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import typing
+from pathlib import Path
+
+import numpy as np
+from qgis.core import Qgis, QgsFeature, QgsField, QgsGeometry, QgsVectorLayer
+from PyQt5.QtCore import QVariant
+
+import our_qgis as script
+
+# synthetic inputs and benchmark outputs are kept here
+BENCHMARK_DIRECTORY = script.QGIS_PROJECT_FILE_DIRECTORY / "benchmark"
+# every benchmark run is appended here as a JSON line
+BENCHMARK_RESULTS_PATH = BENCHMARK_DIRECTORY / "benchmark_results.jsonl"
+
+# (listings, ZCTAs) of each preset scale
+BENCHMARK_SCALES = {
+    "small": (1_000, 1_000),
+    "medium": (100_000, 10_000),
+    "large": (1_000_000, 33_000),
+    "xlarge": (10_000_000, 33_000),
+}
+
+# how often each heating type is listed, in the order of the housing csv columns
+HEATING_TYPE_RATES = {
+    "Electricity": 0.35,
+    "Natural Gas": 0.45,
+    "Propane": 0.08,
+    "Diesel/Heating Oil": 0.05,
+    "Wood/Pellet": 0.04,
+    "Solar Heating": 0.01,
+    "Heat Pump": 0.12,
+    "Baseboard": 0.06,
+    "Furnace": 0.4,
+    "Boiler": 0.05,
+    "Radiator": 0.03,
+    "Radiant Floor": 0.02,
+}
+# housing csv columns in the order the scraper writes them
+HOUSING_CSV_HEADERS = [
+    "ADDRESS",
+    "CITY",
+    "STATE OR PROVINCE",
+    "YEAR BUILT",
+    "ZIP OR POSTAL CODE",
+    "PRICE",
+    "SQUARE FEET",
+    "LATITUDE",
+    "LONGITUDE",
+] + list(HEATING_TYPE_RATES)
+
+# bounding box the synthetic ZCTA grid covers, roughly the contiguous US
+ZCTA_GRID_EXTENT = (-125.0, 25.0, -67.0, 49.0)
+# share of ZCTAs that have a row in each census table
+CENSUS_COVERAGE = 0.95
+# share of census cells written as the negative sentinels the census uses for missing values
+CENSUS_MISSING_RATE = 0.02
+
+
+def get_zcta(index: int) -> str:
+    # every other zip code, so that the ZCTAs are not one contiguous range
+    return f"{10001 + index * 2:05d}"
+
+
+def get_zcta_cell(index: int, zcta_count: int) -> tuple[float, float, float, float]:
+    """Get the grid cell a synthetic ZCTA covers
+
+    Args:
+        index (int): index of the ZCTA
+        zcta_count (int): number of ZCTAs in the grid
+
+    Returns:
+        tuple[float, float, float, float]: x min, y min, x max, y max
+    """
+    x_min, y_min, x_max, y_max = ZCTA_GRID_EXTENT
+    columns = math.ceil(math.sqrt(zcta_count * (x_max - x_min) / (y_max - y_min)))
+    rows = math.ceil(zcta_count / columns)
+    cell_width = (x_max - x_min) / columns
+    cell_height = (y_max - y_min) / rows
+    row, column = divmod(index, columns)
+    cell_x = x_min + column * cell_width
+    cell_y = y_min + row * cell_height
+    return (cell_x, cell_y, cell_x + cell_width, cell_y + cell_height)
+
+
+def generate_housing_csvs(
+    metro_directory: Path,
+    listing_count: int,
+    zcta_count: int,
+    metro_count: int,
+    rng: np.random.Generator,
+):
+    """Write one housing csv per zip code, spread over metro folders
+
+    Args:
+        metro_directory (Path): directory to create the metro folders in
+        listing_count (int): total number of listings
+        zcta_count (int): number of zip codes, one csv each
+        metro_count (int): number of metro folders
+        rng (np.random.Generator): random generator
+    """
+    # listings per zip code vary like they do between dense and rural zip codes
+    weights = rng.lognormal(0, 1, zcta_count)
+    listings_per_zcta = rng.multinomial(listing_count, weights / weights.sum())
+    heating_rates = np.array(list(HEATING_TYPE_RATES.values()))
+    for zcta_index, zcta_listing_count in enumerate(listings_per_zcta):
+        zcta = get_zcta(zcta_index)
+        zcta_directory = metro_directory / f"metro_{zcta_index % metro_count:03d}"
+        zcta_directory.mkdir(parents=True, exist_ok=True)
+        x_min, y_min, x_max, y_max = get_zcta_cell(zcta_index, zcta_count)
+        longitudes = rng.uniform(x_min, x_max, zcta_listing_count)
+        latitudes = rng.uniform(y_min, y_max, zcta_listing_count)
+        prices = rng.integers(50_000, 2_000_000, zcta_listing_count)
+        square_feet = rng.integers(400, 6_000, zcta_listing_count)
+        years_built = rng.integers(1900, 2024, zcta_listing_count)
+        heating_types = (
+            rng.random((zcta_listing_count, len(heating_rates))) < heating_rates
+        )
+        with open(
+            zcta_directory / f"{zcta}.csv", "w", encoding="utf-8", newline=""
+        ) as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(HOUSING_CSV_HEADERS)
+            for i in range(zcta_listing_count):
+                writer.writerow(
+                    [
+                        f"{i + 1} Synthetic St",
+                        f"City {zcta}",
+                        "ZZ",
+                        years_built[i],
+                        zcta,
+                        prices[i],
+                        square_feet[i],
+                        f"{latitudes[i]:.6f}",
+                        f"{longitudes[i]:.6f}",
+                    ]
+                    + ["true" if value else "false" for value in heating_types[i]]
+                )
+
+
+def generate_census_csvs(
+    census_directory: Path, zcta_count: int, rng: np.random.Generator
+):
+    """Write a DP05, S1501 and S1901 table with the columns of their allow lists
+
+    Args:
+        census_directory (Path): directory to write the tables to
+        zcta_count (int): number of ZCTAs
+        rng (np.random.Generator): random generator
+    """
+    census_directory.mkdir(parents=True, exist_ok=True)
+    for table_type, (allow_list, _) in script.CENSUS_TABLE_LISTS.items():
+        headers = ["ZCTA"] + [column for column in allow_list if column != "ZCTA"]
+        covered_zctas = np.flatnonzero(rng.random(zcta_count) < CENSUS_COVERAGE)
+        values = rng.gamma(2.0, 500.0, (len(covered_zctas), len(headers) - 1))
+        missing = rng.random(values.shape) < CENSUS_MISSING_RATE
+        file_path = census_directory / f"acs5-group-{table_type}-zcta-synthetic.csv"
+        with open(file_path, "w", encoding="utf-8", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(headers)
+            for row_index, zcta_index in enumerate(covered_zctas):
+                writer.writerow(
+                    [get_zcta(zcta_index)]
+                    + [
+                        "-666666666" if is_missing else f"{value:.1f}"
+                        for value, is_missing in zip(
+                            values[row_index], missing[row_index]
+                        )
+                    ]
+                )
+
+
+def generate_base_layer(
+    gpkg_path: Path, zcta_count: int, vertex_count: int, rng: np.random.Generator
+) -> QgsVectorLayer:
+    """Write a ZCTA base layer of jagged polygons on a grid
+
+    Args:
+        gpkg_path (Path): GeoPackage to write the base layer to
+        zcta_count (int): number of ZCTA polygons
+        vertex_count (int): vertices of each polygon, real ZCTAs have hundreds
+        rng (np.random.Generator): random generator
+
+    Returns:
+        QgsVectorLayer: the base layer read from the GeoPackage
+    """
+    base_layer = QgsVectorLayer(
+        "MultiPolygon?crs=EPSG:4326", script.BASE_LAYER_NAME, "memory"
+    )
+    base_layer.dataProvider().addAttributes([QgsField("ZCTA5", QVariant.String)])
+    base_layer.updateFields()
+
+    angles = np.linspace(0, 2 * math.pi, vertex_count, endpoint=False)
+    features = []
+    for zcta_index in range(zcta_count):
+        x_min, y_min, x_max, y_max = get_zcta_cell(zcta_index, zcta_count)
+        radii = rng.uniform(0.35, 0.5, vertex_count)
+        xs = (x_min + x_max) / 2 + np.cos(angles) * radii * (x_max - x_min)
+        ys = (y_min + y_max) / 2 + np.sin(angles) * radii * (y_max - y_min)
+        ring = ", ".join(f"{x:.6f} {y:.6f}" for x, y in zip(xs, ys))
+        feature = QgsFeature(base_layer.fields())
+        feature.setGeometry(
+            QgsGeometry.fromWkt(f"MULTIPOLYGON((({ring}, {xs[0]:.6f} {ys[0]:.6f})))")
+        )
+        feature.setAttributes([get_zcta(zcta_index)])
+        features.append(feature)
+    base_layer.dataProvider().addFeatures(features)
+
+    script.save_layers_to_gpkg(gpkg_path, [base_layer])
+    return QgsVectorLayer(
+        f"{gpkg_path}|layername={script.BASE_LAYER_NAME}", script.BASE_LAYER_NAME, "ogr"
+    )
+
+
+def generate_synthetic_inputs(
+    data_directory: Path,
+    listing_count: int,
+    zcta_count: int,
+    metro_count: int,
+    vertex_count: int,
+    seed: int,
+) -> QgsVectorLayer:
+    """Generate the housing csvs, census tables and base layer of a scale, unless they already exist
+
+    Args:
+        data_directory (Path): directory for the inputs of this scale
+        listing_count (int): total number of listings
+        zcta_count (int): number of ZCTAs
+        metro_count (int): number of metro folders
+        vertex_count (int): vertices of each ZCTA polygon
+        seed (int): random seed, the same seed always generates the same inputs
+
+    Returns:
+        QgsVectorLayer: the base layer
+    """
+    complete_marker = data_directory / "complete"
+    base_layer_gpkg = data_directory / "base_layer.gpkg"
+    if complete_marker.exists():
+        return QgsVectorLayer(
+            f"{base_layer_gpkg}|layername={script.BASE_LAYER_NAME}",
+            script.BASE_LAYER_NAME,
+            "ogr",
+        )
+
+    shutil.rmtree(data_directory, ignore_errors=True)
+    rng = np.random.default_rng(seed)
+    start_time = time.perf_counter()
+    generate_housing_csvs(
+        data_directory / "metros", listing_count, zcta_count, metro_count, rng
+    )
+    generate_census_csvs(data_directory / "census", zcta_count, rng)
+    base_layer = generate_base_layer(base_layer_gpkg, zcta_count, vertex_count, rng)
+    complete_marker.touch()
+    logging.info(
+        f"Generated synthetic inputs in {time.perf_counter() - start_time:.1f}s"
+    )
+    return base_layer
+
+
+def get_git_revision() -> dict:
+    """Get the commit the benchmark ran on
+
+    Returns:
+        dict: commit hash, and whether the working tree had uncommitted changes
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=script.CODE_PROJECT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=script.CODE_PROJECT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def run_benchmarks(
+    data_directory: Path,
+    output_directory: Path,
+    base_layer: QgsVectorLayer,
+    processes: int,
+    warm_cache: bool,
+) -> dict[str, float]:
+    """Time the pipeline functions on the synthetic inputs
+
+    Args:
+        data_directory (Path): directory holding the synthetic inputs
+        output_directory (Path): directory the GeoPackages and caches are written to
+        base_layer (QgsVectorLayer): ZCTA base layer
+        processes (int): number of worker processes to build the census layers in
+        warm_cache (bool): keep the census caches of the previous run instead of parsing the census csvs again
+
+    Returns:
+        dict[str, float]: wall time of each benchmarked function, in seconds
+    """
+    script.LOCATION_HEATMAP_GPKG_OUTPUT = output_directory / "location_heatmap.gpkg"
+    script.CENSUS_DATA_GPKG_OUTPUT = output_directory / "census_data.gpkg"
+    script.CENSUS_STAGING_DIRECTORY = output_directory / "census_staging"
+    script.CENSUS_CACHE_DIRECTORY = output_directory / "census_cache"
+    script.LOCATION_HEATMAP_GPKG_OUTPUT.unlink(missing_ok=True)
+    script.CENSUS_DATA_GPKG_OUTPUT.unlink(missing_ok=True)
+    if not warm_cache:
+        shutil.rmtree(script.CENSUS_CACHE_DIRECTORY, ignore_errors=True)
+
+    qgis_project = script.get_project()
+    qgis_project.removeAllMapLayers()
+    qgis_project.addMapLayer(base_layer)
+
+    script.reset_stage_metrics()
+    timings = {}
+
+    def timed(benchmark_name: str, function, *args):
+        with script.measure_stage(benchmark_name) as metrics:
+            result = function(*args)
+        timings[benchmark_name] = metrics["wall_time"]
+        logging.info(f"{benchmark_name}: {metrics['wall_time']:.2f}s")
+        return result
+
+    (csv_layer, csv_contents, csv_headers, csv_attributes) = timed(
+        "read_housing_data_and_create_temp_location_points_layer",
+        script.read_housing_data_and_create_temp_location_points_layer,
+        data_directory / "metros",
+    )
+    locations_layer = timed(
+        "create_locations_layer_from_csv",
+        script.create_locations_layer_from_csv,
+        csv_contents,
+        csv_headers,
+        csv_layer,
+    )
+    timed(
+        "create_heatmap_layers",
+        script.create_heatmap_layers,
+        locations_layer,
+        csv_attributes,
+    )
+    timed(
+        "read_demographic_data",
+        script.read_demographic_data,
+        data_directory / "census",
+        False,
+        None,
+        processes,
+    )
+    return timings
+
+
+def load_previous_result(results_path: Path, scale: dict) -> typing.Optional[dict]:
+    """Get the last stored result of the same scale
+
+    Args:
+        results_path (Path): JSON lines file of stored results
+        scale (dict): scale of the current run
+
+    Returns:
+        typing.Optional[dict]: the last result of that scale, or None if there is none
+    """
+    if not results_path.exists():
+        return None
+    previous_result = None
+    with open(results_path, encoding="utf-8") as results_file:
+        for line in results_file:
+            result = json.loads(line)
+            if result.get("scale") == scale:
+                previous_result = result
+    return previous_result
+
+
+def print_comparison(result: dict, previous_result: typing.Optional[dict]):
+    previous_timings = (previous_result or {}).get("timings", {})
+    previous_commit = (previous_result or {}).get("git", {}).get("commit")
+    if previous_commit:
+        print(f"compared to {previous_commit[:10]}")
+    for benchmark_name, wall_time in result["timings"].items():
+        line = f"{benchmark_name:<60}{wall_time:>10.2f}s"
+        previous_wall_time = previous_timings.get(benchmark_name)
+        if previous_wall_time:
+            change = (wall_time - previous_wall_time) / previous_wall_time
+            line += f"{change:>+10.1%}"
+        print(line)
+
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic housing and census data"
+    )
+    parser.add_argument(
+        "--scale",
+        choices=BENCHMARK_SCALES,
+        default="small",
+        help="preset number of listings and ZCTAs",
+    )
+    parser.add_argument("--listings", type=int, help="overrides the preset")
+    parser.add_argument("--zctas", type=int, help="overrides the preset, at most 33000")
+    parser.add_argument("--metros", type=int, default=20)
+    parser.add_argument(
+        "--vertices", type=int, default=64, help="vertices of each ZCTA polygon"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="worker processes to build the census layers in",
+    )
+    parser.add_argument(
+        "--warm-cache",
+        action="store_true",
+        help="keep the census caches of the previous run",
+    )
+    parser.add_argument("--directory", type=Path, default=BENCHMARK_DIRECTORY)
+    parser.add_argument("--results", type=Path, default=BENCHMARK_RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    listing_count, zcta_count = BENCHMARK_SCALES[args.scale]
+    listing_count = args.listings or listing_count
+    zcta_count = min(args.zctas or zcta_count, 33_000)
+    scale = {
+        "listings": listing_count,
+        "zctas": zcta_count,
+        "metros": args.metros,
+        "vertices": args.vertices,
+        "seed": args.seed,
+        "processes": args.processes,
+        "warm_cache": args.warm_cache,
+    }
+
+    script.configure_logging()
+    script.init_qgis()
+    try:
+        data_directory = (
+            args.directory
+            / f"synthetic-{listing_count}-{zcta_count}-{args.metros}-{args.vertices}-{args.seed}"
+        )
+        base_layer = generate_synthetic_inputs(
+            data_directory,
+            listing_count,
+            zcta_count,
+            args.metros,
+            args.vertices,
+            args.seed,
+        )
+        output_directory = args.directory / "output"
+        output_directory.mkdir(parents=True, exist_ok=True)
+        timings = run_benchmarks(
+            data_directory,
+            output_directory,
+            base_layer,
+            args.processes,
+            args.warm_cache,
+        )
+        result = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": get_git_revision(),
+            "python": platform.python_version(),
+            "qgis": Qgis.version(),
+            "platform": platform.platform(),
+            "scale": scale,
+            "timings": timings,
+            "stages": script.stage_metrics,
+        }
+    finally:
+        script.exit_qgis()
+
+    previous_result = load_previous_result(args.results, scale)
+    args.results.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as results_file:
+        results_file.write(json.dumps(result) + "\n")
+    print_comparison(result, previous_result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
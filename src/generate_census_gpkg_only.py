@@ -1,4 +1,8 @@
 import our_qgis as script
 
 if __name__ == "__console__":
-    script.read_demographic_data(script.CENSUS_DIRECTORY)
+    script.configure_logging()
+    script.init_qgis()
+    build_manifest = script.load_build_manifest()
+    script.read_demographic_data(script.CENSUS_DIRECTORY, manifest=build_manifest)
+    script.save_build_manifest(build_manifest)
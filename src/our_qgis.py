@@ -12,22 +12,71 @@ from qgis.core import (
     QgsLayerTreeGroup,
     QgsMapLayer,
     QgsField,
+    QgsFields,
     QgsCoordinateReferenceSystem,
     QgsReadWriteContext,
     QgsFillSymbol,
     QgsStyle,
     QgsGraduatedSymbolRenderer,
     QgsLayerTreeLayer,
+    QgsFeatureRequest,
+    QgsWkbTypes,
+    QgsExpression,
+    QgsRendererRange,
+    QgsClassificationQuantile,
+    QgsClassificationJenks,
+    QgsClassificationEqualInterval,
+    QgsColorRamp,
+    QgsRasterLayer,
+    QgsRasterShader,
+    QgsColorRampShader,
+    QgsSingleBandPseudoColorRenderer,
+    QgsRasterMinMaxOrigin,
+    QgsVectorTileWriter,
+    QgsDataSourceUri,
+    QgsProviderRegistry,
+    QgsCoordinateTransform,
+    QgsRectangle,
+    QgsSpatialIndex,
+    Qgis,
+    QgsCoordinateTransformContext,
 )
 from PyQt5.QtCore import QVariant
 from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtXml import QDomDocument
+from osgeo import gdal, ogr, osr
+import abc
+import argparse
+import collections
+import contextlib
 import logging
+import math
 import csv
+import hashlib
+import json
+import types
 import typing
 import itertools
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from sys import exit
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 # Keep in mind that this program will be running with python 3.9
 
@@ -53,6 +102,21 @@ CENSUS_DIRECTORY = (
 
 LOCATION_HEATMAP_GPKG_OUTPUT = QGIS_PROJECT_FILE_DIRECTORY / "location_heatmap.gpkg"
 CENSUS_DATA_GPKG_OUTPUT = QGIS_PROJECT_FILE_DIRECTORY / "census_data.gpkg"
+# census layers built by worker processes are staged here before being merged into CENSUS_DATA_GPKG_OUTPUT
+CENSUS_STAGING_DIRECTORY = QGIS_PROJECT_FILE_DIRECTORY / "census_staging"
+# parsed census tables, stored as numpy columns so later runs can memory-map them instead of parsing the csv
+CENSUS_CACHE_DIRECTORY = QGIS_PROJECT_FILE_DIRECTORY / "census_cache"
+# precomputed density rasters of the heatmaps, one GeoTIFF per heating type
+HEATMAP_RASTER_DIRECTORY = QGIS_PROJECT_FILE_DIRECTORY / "heatmap_rasters"
+# vector tiles of the locations and census layers, written by the tiles stage
+VECTOR_TILES_OUTPUT = QGIS_PROJECT_FILE_DIRECTORY / "electrification_tracker.mbtiles"
+# copies of the built layers in other formats, one directory per format, written by the export stage
+EXPORT_DIRECTORY = QGIS_PROJECT_FILE_DIRECTORY / "exports"
+# fingerprints of the inputs each output was built from, used to skip unchanged work on a rerun
+BUILD_MANIFEST_PATH = QGIS_PROJECT_FILE_DIRECTORY / "build_manifest.json"
+
+# project layer holding the ZCTA polygons that census data is joined onto
+BASE_LAYER_NAME = "BaseLayerDB — Zips_in_Metros"
 
 # Attributes are what you want the layer to color with. allow list is ZCTA and the accompanying columns to the attributes
 #! TODO make sure these are ordered the way they appear in the csv file
@@ -202,649 +266,4745 @@ S1901_ATTRIBUTES = [
     "ESTHouseholdsMedianIncome(dollars)",
     "ESTHouseholdsMeanIncome(dollars)",
 ]
-# Set up project log file
-LOG_FILE_PATH = CODE_PARENT_DIRECTORY / "qgisdebug.log"
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
 
-# Initialize QGIS
-QgsApplication.setPrefixPath("~/QGIS 3.34.0", True)
-qgs = QgsApplication([], False)
-qgs.initQgis()
-logging.info("========================================================================")
-logging.debug("Initialized QGIS")
-logging.info("========================================================================")
-logging.info(
-    f"Saving location and heatmap GPKGs to {str(LOCATION_HEATMAP_GPKG_OUTPUT)}"
+# census table type found in the csv file name: (allow list, attributes)
+CENSUS_TABLE_LISTS = {
+    "DP05": (DP05_ALLOW_LIST, DP05_ATTRIBUTES),
+    "S1501": (S1501_ALLOW_LIST, S1501_ATTRIBUTES),
+    "S1901": (S1901_ALLOW_LIST, S1901_ATTRIBUTES),
+}
+# how many allow list columns are grouped together for each census table type
+CENSUS_TABLE_RANGE_TYPES = {"DP05": 4, "S1501": 2, "S1901": 2}
+
+# how census layers are colored: "quantile", "jenks" or "equal_interval"
+CENSUS_CLASSIFICATION_MODE = "quantile"
+CENSUS_CLASS_COUNT = 8
+# like QGIS, jenks breaks are computed on a sample of at most this many values
+JENKS_MAX_SAMPLE_SIZE = 3000
+
+# ZCTAs are 5 digit numbers, so they index a dense array of this size
+ZCTA_INDEX_SIZE = 100000
+# a whole census or base layer value that is a ZCTA, such as "02134", "2134", "2134.0", "8600000US02134" or "ZCTA5 02134".
+# anything else, like "2134.5" or "-1", is not a ZCTA
+ZCTA_PATTERN = re.compile(r"^(?:(?:\d+US|ZCTA5 )(\d{5})|(\d{1,5})(?:\.0+)?)$")
+
+# Threads reading housing csvs, and how many csvs they may read ahead of the layer being built
+HOUSING_CSV_READ_THREADS = 8
+HOUSING_CSV_PREFETCH_FILES = 64
+
+# Columns identifying a listing. Copies of a zip code csv in several metro folders repeat the same listings, so rows with the same values are only added once
+LISTING_DEDUP_COLUMNS = ("ADDRESS", "LATITUDE", "LONGITUDE")
+# Decimal places coordinates are rounded to when comparing listings, about a meter
+LISTING_DEDUP_COORDINATE_DIGITS = 5
+
+# Simplified copies of the census polygons drawn instead of the full ZCTA polygons when zoomed out:
+# (name, simplification tolerance in meters, scale denominator from which on the copy is drawn)
+SIMPLIFIED_CENSUS_GEOMETRY_LEVELS = (
+    ("generalized", 250.0, 1500000),
+    ("national", 2000.0, 8000000),
 )
-logging.info(f"Saving census GPKGs to {str(CENSUS_DATA_GPKG_OUTPUT)}")
-# Create a project
-project = QgsProject.instance()
-project.read()
+# Levels every census layer is also written at. empty unless run_pipeline is asked for SIMPLIFIED_CENSUS_GEOMETRY_LEVELS,
+# since every level is another copy of each census layer
+CENSUS_GEOMETRY_LEVELS: tuple[tuple[str, float, int], ...] = ()
+# Meters per degree, to convert the tolerances for base layers in geographic coordinates
+METERS_PER_DEGREE = 111320.0
 
-# Set up a layer tree
-layer_tree_root = project.instance().layerTreeRoot()
+# Radius of the heatmap kernel on screen, in millimeters
+HEATMAP_RADIUS_MM = 15
+# Size of a screen pixel in millimeters, at 96 dpi
+SCREEN_PIXEL_SIZE_MM = 25.4 / 96
+# Pixel size of the full resolution heatmap rasters in meters, what a screen pixel covers at about 1:190,000
+HEATMAP_RASTER_PIXEL_SIZE = 50.0
+# Each overview of a heatmap raster has pixels this many times larger, and a kernel widened to match, so every zoom level looks like the live heatmap
+HEATMAP_RASTER_OVERVIEW_FACTORS = (2, 4, 8, 16, 32, 64, 128)
+# Width and height of the tiles heatmap rasters are computed and stored in, in pixels
+HEATMAP_RASTER_TILE_SIZE = 512
+# Earth radius of web mercator, EPSG:3857
+WEB_MERCATOR_RADIUS = 6378137.0
 
-# Load all layers
-# demo_layers = []
+# Layer of the census GeoPackage holding the listings of every ZCTA
+LISTING_AGGREGATE_LAYER_NAME = "Listings by ZCTA"
+# Locations field tried first when joining listings to their ZCTA polygon
+LISTING_ZIP_FIELD = "ZIP OR POSTAL CODE"
+# Locations fields whose median is computed for every ZCTA
+LISTING_MEDIAN_FIELDS = ("PRICE", "SQUARE FEET")
+# Listings column the listings layer is styled with, if there are heat pump listings
+LISTING_AGGREGATE_STYLE_COLUMN = "Heat Pump share"
 
+# Deepest zoom level of the vector tiles
+VECTOR_TILE_MAX_ZOOM = 14
+# Scale denominator of zoom level 0 of the web mercator tile grid
+ZOOM_0_SCALE = 559082264.028
+# Locations kept in the vector tiles of each zoom band: (first zoom, last zoom, keep one location in this many)
+LOCATION_TILE_THINNING = (
+    (0, 5, 256),
+    (6, 8, 32),
+    (9, 11, 4),
+    (12, VECTOR_TILE_MAX_ZOOM, 1),
+)
+# Locations columns written to the vector tiles, besides the heating types
+LOCATION_TILE_FIELDS = ("PRICE", "SQUARE FEET", "YEAR BUILT", "ZIP OR POSTAL CODE")
 
-# Read all files in the directory stated and create layers accordingly
-def read_housing_data_and_create_temp_location_points_layer(
-    all_metros_directory: Path
-) -> tuple[QgsVectorLayer, list[typing.Any], list[str], list[str]]:
-    # All data within files in the housing folder will be combined in memory and processed as one
-    # Get list of all zipcode csvs
-    merged_csv_contents = []
-    headers = []
-    zip_code_csv_regex = re.compile(r"[0-9]{3}|[0-9]{4}|[0-9]{5}")
-    csv_files = [
-        path
-        for path in all_metros_directory.rglob("*.csv")
-        if zip_code_csv_regex.match(path.stem) is not None
-    ]
-    first = True
-    for zip_code_file in csv_files:
-        with open(zip_code_file, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            if first:
-                first = False
-                headers = next(reader)
-            else:
-                next(reader)
-            merged_csv_contents.extend(list(reader))
-
-    field_type_map = {
-        "PRICE": QVariant.Type.Int,
-        "SQUARE FEET": QVariant.Type.Int,
-        "Electricity": QVariant.Type.Bool,
-        "Natural Gas": QVariant.Type.Bool,
-        "Propane": QVariant.Type.Bool,
-        "Diesel/Heating Oil": QVariant.Type.Bool,
-        "Wood/Pellet": QVariant.Type.Bool,
-        "Solar Heating": QVariant.Type.Bool,
-        "Heat Pump": QVariant.Type.Bool,
-        "Baseboard": QVariant.Type.Bool,
-        "Furnace": QVariant.Type.Bool,
-        "Boiler": QVariant.Type.Bool,
-        "Radiator": QVariant.Type.Bool,
-        "Radiant Floor": QVariant.Type.Bool,
-        "LATITUDE": QVariant.Type.Double,
-        "LONGITUDE": QVariant.Type.Double,
-        "ADDRESS": QVariant.Type.String,
-        "CITY": QVariant.Type.String,
-        "STATE OR PROVINCE": QVariant.Type.String,
-        "YEAR BUILT": QVariant.Type.Int,
-        "ZIP OR POSTAL CODE": QVariant.Type.Int,
+# Number of features handed to a data provider per addFeatures call
+DEMOGRAPHIC_FEATURE_BATCH_SIZE = 10000
+LOCATION_FEATURE_BATCH_SIZE = 50000
+
+# Number of features handed to QgsVectorFileWriter per addFeatures call
+LAYER_WRITE_BATCH_SIZE = 10000
+
+# GDAL config options set while layers are written to a GeoPackage
+GPKG_WRITE_CONFIG_OPTIONS = types.MappingProxyType(
+    {
+        # later builds reuse the layers, so commits must survive a crash
+        "OGR_SQLITE_SYNCHRONOUS": "NORMAL",
+        # in MB
+        "OGR_SQLITE_CACHE": "256",
+        "OGR_SQLITE_PRAGMA": "temp_store=MEMORY",
     }
-    csv_layer_pre_data = QgsVectorLayer("Point?crs=EPSG:4326", "Locations", "memory")
+)
+# Compression codec of the GeoParquet export
+GEOPARQUET_COMPRESSION = "ZSTD"
+# Formats the export stage writes when none are named, from EXPORT_FORMAT_WRITERS
+DEFAULT_EXPORT_FORMATS = ("flatgeobuf", "geoparquet")
+# Number of features per GeoParquet row group
+GEOPARQUET_ROW_GROUP_SIZE = 65536
+# Write features along a Hilbert curve so features that are near on the map are near in the file. set by run_pipeline
+SPATIAL_ORDER_FEATURES = False
+# Bits per axis of the grid the Hilbert curve is drawn on
+SPATIAL_ORDER_CURVE_BITS = 16
 
-    csv_layer_pre_data.dataProvider().addAttributes(
-        [
-            QgsField(header, field_type_map.get(header, QVariant.Type.Invalid))
-            for header in headers
-        ]
-    )
-    csv_layer_pre_data.updateFields()
+# Housing csv columns holding the (x, y) of a listing. csvs without them are skipped
+LOCATION_COORDINATE_COLUMNS = ("LONGITUDE", "LATITUDE")
+# csv values (lowercased) that are read as True for Bool fields
+CSV_TRUE_VALUES = frozenset({"true", "t", "yes", "y", "1"})
 
-    # layer, csv, headers, attributes
-    return (
-        csv_layer_pre_data,
-        merged_csv_contents,
-        headers,
-        list(itertools.dropwhile(lambda x: x != "Electricity", headers)),
+# Field types of the housing csv columns, anything else is left as Invalid
+LOCATION_FIELD_TYPE_MAP = {
+    "PRICE": QVariant.Type.Int,
+    "SQUARE FEET": QVariant.Type.Int,
+    "Electricity": QVariant.Type.Bool,
+    "Natural Gas": QVariant.Type.Bool,
+    "Propane": QVariant.Type.Bool,
+    "Diesel/Heating Oil": QVariant.Type.Bool,
+    "Wood/Pellet": QVariant.Type.Bool,
+    "Solar Heating": QVariant.Type.Bool,
+    "Heat Pump": QVariant.Type.Bool,
+    "Baseboard": QVariant.Type.Bool,
+    "Furnace": QVariant.Type.Bool,
+    "Boiler": QVariant.Type.Bool,
+    "Radiator": QVariant.Type.Bool,
+    "Radiant Floor": QVariant.Type.Bool,
+    "LATITUDE": QVariant.Type.Double,
+    "LONGITUDE": QVariant.Type.Double,
+    "ADDRESS": QVariant.Type.String,
+    "CITY": QVariant.Type.String,
+    "STATE OR PROVINCE": QVariant.Type.String,
+    "YEAR BUILT": QVariant.Type.Int,
+    "ZIP OR POSTAL CODE": QVariant.Type.Int,
+}
+
+# Set up project log file
+LOG_FILE_PATH = CODE_PARENT_DIRECTORY / "qgisdebug.log"
+# QGIS install used when the pipeline runs outside of the QGIS application
+QGIS_PREFIX_PATH = "~/QGIS 3.34.0"
+# where the project stage of the command line pipeline saves the project
+PROJECT_OUTPUT_PATH = QGIS_PROJECT_FILE_DIRECTORY / "electrification_tracker.qgz"
+
+# timings of every measured stage of the last run, see measure_stage
+STAGE_REPORT_PATH = QGIS_PROJECT_FILE_DIRECTORY / "build_report.json"
+# Number of items a timed iterator reads between two measurements
+STAGE_METRICS_BATCH_SIZE = 1000
+
+# stages of the command line pipeline, in the order they run
+PIPELINE_STAGES = (
+    "ingest",
+    "locations",
+    "heatmaps",
+    "census",
+    "listings",
+    "tiles",
+    "export",
+    "project",
+)
+# stages run when none are named. vector tiles and exports are only written on request
+DEFAULT_PIPELINE_STAGES = (
+    "ingest",
+    "locations",
+    "heatmaps",
+    "census",
+    "listings",
+    "project",
+)
+# stages that only read csvs and caches, and never start QGIS
+QGIS_FREE_STAGES = ("ingest",)
+
+# QGIS application and project, only created once a stage needs them. see init_qgis and get_project
+qgs: typing.Optional[QgsApplication] = None
+project: typing.Optional[QgsProject] = None
+
+
+def configure_logging():
+    logging.basicConfig(
+        filename=LOG_FILE_PATH,
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    logging.info(
+        "========================================================================"
     )
+    logging.info(
+        f"Saving location and heatmap GPKGs to {str(LOCATION_HEATMAP_GPKG_OUTPUT)}"
+    )
+    logging.info(f"Saving census GPKGs to {str(CENSUS_DATA_GPKG_OUTPUT)}")
 
 
-# Used to create a point layer from csv data
-def create_locations_layer_from_csv(
-    csv_contents: typing.List[str],
-    csv_headers: typing.List[str],
-    locations_layer: QgsVectorLayer,
-) -> QgsVectorLayer:
-    """For each location in the given csv, add them as a feature to the provided housing layer
+def init_qgis():
+    """Start QGIS, unless it is already running
+
+    Note:
+        Inside the QGIS application, or once this has been called, QGIS is already running and nothing happens.
+    """
+    global qgs
+    if QgsApplication.instance() is not None:
+        return
+    QgsApplication.setPrefixPath(QGIS_PREFIX_PATH, True)
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    logging.debug("Initialized QGIS")
+
+
+def exit_qgis():
+    """Shut QGIS down if init_qgis started it"""
+    global qgs, project
+    if qgs is None:
+        return
+    project = None
+    qgs.exitQgis()
+    qgs = None
+
+
+def get_project(project_file: typing.Optional[Path] = None) -> QgsProject:
+    """Get the QGIS project, starting QGIS and reading the project the first time it is needed
 
     Args:
-        lines (typing.List[str]): csv content. do not include headers
-        headers (typing.List[str]): headers
-        housing_layer (QgsVectorLayer): the housing layer to display
+        project_file (typing.Optional[Path], optional): project to read. Defaults to None, which re-reads the project open in QGIS.
 
     Returns:
-        QgsVectorDataProvider: _description_
+        QgsProject: the project
     """
-    feats = []
-    locations_layer.startEditing()
+    global project
+    if project is None:
+        init_qgis()
+        project = QgsProject.instance()
+        if project_file is None:
+            project.read()
+        elif not project.read(str(project_file)):
+            logging.error(f"Could not read {project_file}: {project.error()}")
+    return project
 
-    for line in csv_contents:
-        feat = QgsFeature(locations_layer.fields())
 
-        feat.setGeometry(
-            QgsGeometry.fromPointXY(
-                QgsPointXY(
-                    float(line[csv_headers.index("LONGITUDE")]),
-                    float(line[csv_headers.index("LATITUDE")]),
-                )
-            )
-        )
+# metrics of every stage measured in this process, by stage name
+stage_metrics: dict[str, dict] = {}
+# how many ZCTA polygons found a row of each census table, see join_census_table
+join_coverage: dict[str, dict] = {}
+# [child wall time, child cpu time] of the stages being measured on each thread, innermost last
+_stage_frames = threading.local()
 
-        for header, csv_value in zip(csv_headers, line):
-            feat[header] = csv_value
 
-        feats.append(feat)
+def get_peak_rss() -> typing.Optional[int]:
+    """Get the peak resident memory of this process
 
-    locations_layer.addFeatures(feats)
-    locations_layer.setRenderer(
-        locations_layer.renderer().defaultRenderer(locations_layer.geometryType())
-    )
-    locations_layer.setCrs(QgsCoordinateReferenceSystem("EPSG:4326"))
-    locations_layer.updateExtents()
-    locations_layer.commitChanges()
-    locations_layer.dataProvider().createSpatialIndex()
+    Returns:
+        typing.Optional[int]: peak resident memory in bytes, or None when it can not be read on this platform
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports KiB, macOS reports bytes
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, "peak_wset", memory_info.rss)
+    return None
 
-    error = save_location_heatmap_gpkg(locations_layer)
 
-    if error[0] == QgsVectorFileWriter.WriterError.NoError:
-        locations_layer_path = (
-            f"{LOCATION_HEATMAP_GPKG_OUTPUT}|layername={locations_layer.name()}"
-        )
-        locations_layer = QgsVectorLayer(locations_layer_path, "Locations", "ogr")
-    else:
-        logging.error(
-            f"Encountered error {error} when writing {locations_layer.name()}"
-        )
+def reset_stage_metrics():
+    stage_metrics.clear()
+    join_coverage.clear()
 
-    return locations_layer
 
+@contextlib.contextmanager
+def measure_stage(stage_name: str) -> typing.Iterator[dict]:
+    """Add the wall time, cpu time and peak memory of a block to the metrics of a stage
 
-# Saves the location and heatmap layers in a database
-def save_location_heatmap_gpkg(layer: QgsVectorLayer):
-    if LOCATION_HEATMAP_GPKG_OUTPUT.exists():
-        # update
-        options = QgsVectorFileWriter.SaveVectorOptions()
-        options.layerName = layer.name()
-        options.fileEncoding = layer.dataProvider().encoding()
-        options.attributes = layer.attributeList()  # just putting for sakes
-        options.actionOnExistingFile = (
-            QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteLayer
-        )
+    Note:
+        A stage can be measured any number of times, and the measurements add up. Stages measured inside another stage are also subtracted from the self times of the outer stage, so streaming work can be split into the stages it interleaves. cpu time is the time of this process.
 
-        error = QgsVectorFileWriter.writeAsVectorFormatV3(
-            layer,
-            str(LOCATION_HEATMAP_GPKG_OUTPUT),
-            project.transformContext(),
-            options,
-        )
-    else:
-        # create
-        options = QgsVectorFileWriter.SaveVectorOptions()
-        options.layerName = layer.name()
-        options.fileEncoding = layer.dataProvider().encoding()
-        options.attributes = layer.attributeList()  # just putting for sakes
+    Args:
+        stage_name (str): stage to add the measurement to
 
-        error = QgsVectorFileWriter.writeAsVectorFormatV3(
-            layer,
-            str(LOCATION_HEATMAP_GPKG_OUTPUT),
-            project.transformContext(),
-            options,
-        )
-    return error
+    Yields:
+        dict: metrics of the stage. add to its "items" to report a throughput
+    """
+    metrics = stage_metrics.setdefault(
+        stage_name,
+        {
+            "wall_time": 0.0,
+            "cpu_time": 0.0,
+            "self_wall_time": 0.0,
+            "self_cpu_time": 0.0,
+            "items": 0,
+            "calls": 0,
+            "peak_rss": None,
+        },
+    )
+    frames = getattr(_stage_frames, "frames", None)
+    if frames is None:
+        frames = _stage_frames.frames = []
+    frame = [0.0, 0.0]
+    frames.append(frame)
+    start_wall_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    try:
+        yield metrics
+    finally:
+        wall_time = time.perf_counter() - start_wall_time
+        cpu_time = time.process_time() - start_cpu_time
+        frames.pop()
+        if frames:
+            frames[-1][0] += wall_time
+            frames[-1][1] += cpu_time
+        metrics["wall_time"] += wall_time
+        metrics["cpu_time"] += cpu_time
+        metrics["self_wall_time"] += wall_time - frame[0]
+        metrics["self_cpu_time"] += cpu_time - frame[1]
+        metrics["calls"] += 1
+        peak_rss = get_peak_rss()
+        if peak_rss is not None:
+            metrics["peak_rss"] = max(metrics["peak_rss"] or 0, peak_rss)
 
 
-# Saves the demographic layers in a database
-def save_census_data_gpkg(layer: QgsVectorLayer):
-    if CENSUS_DATA_GPKG_OUTPUT.exists():
-        # update
-        options = QgsVectorFileWriter.SaveVectorOptions()
-        options.layerName = layer.name()
-        options.fileEncoding = layer.dataProvider().encoding()
-        options.attributes = layer.attributeList()  # just putting for sakes
-        options.actionOnExistingFile = (
-            QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteLayer
-        )
+def timed_iter(
+    iterable: typing.Iterable,
+    stage_name: str,
+    batch_size: int = STAGE_METRICS_BATCH_SIZE,
+) -> typing.Iterator:
+    """Measure the time spent producing the items of an iterable as a stage
 
-        error = QgsVectorFileWriter.writeAsVectorFormatV3(
-            layer,
-            str(CENSUS_DATA_GPKG_OUTPUT),
-            project.transformContext(),
-            options,
-        )
-    else:
-        # create
-        options = QgsVectorFileWriter.SaveVectorOptions()
-        options.layerName = layer.name()
-        options.fileEncoding = layer.dataProvider().encoding()
-        options.attributes = layer.attributeList()
+    Note:
+        Items are read batch_size at a time, so the timers are not read for every item.
 
-        error = QgsVectorFileWriter.writeAsVectorFormatV3(
-            layer,
-            str(CENSUS_DATA_GPKG_OUTPUT),
-            project.transformContext(),
-            options,
-        )
-    return error
+    Args:
+        iterable (typing.Iterable): items to measure
+        stage_name (str): stage to add the measurements to
+        batch_size (int, optional): items read per measurement. Defaults to STAGE_METRICS_BATCH_SIZE.
+
+    Yields:
+        typing.Any: the items of the iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        with measure_stage(stage_name) as metrics:
+            batch = list(itertools.islice(iterator, batch_size))
+            metrics["items"] += len(batch)
+        if not batch:
+            return
+        yield from batch
 
 
-# Used to create heatmap layers from csv heating data
-def create_heatmap_layers(
-    locations_layer: QgsVectorLayer,
-    attributes: typing.List[str],
-) -> list[QgsVectorLayer]:
-    """Generate heat maps for the given attributes. Make sure that when you are rendering that you add all of these to a tree
+def merge_stage_metrics(other_stage_metrics: dict[str, dict]):
+    """Add stage metrics measured in another process, such as a census worker
 
     Args:
-        prov (QgsVectorDataProvider): _description_
-        attributes (typing.List[str]): _description_
+        other_stage_metrics (dict[str, dict]): stage_metrics of the other process
     """
-    logging.info(attributes)
-    heating_layers: list[QgsVectorLayer] = []
-    doc = QDomDocument()
-    read_write_context = QgsReadWriteContext()
-    # Create a heatmap layer for each attribute in heating_attributes
-    for attribute_name in attributes:
-        # Checks if there is already a layer for an attribute, and if not it creates one. eg if there is no diesel in the csv, still make the diesel layer
-        heatmap_layer = None
-        # If group is empty or if layer for attribute doesn't exist, create the layer. else get that layer
-        if not heating_layers:
-            heatmap_layer = QgsVectorLayer(
-                "Point?crs=EPSG:4326", f"Heatmap-{attribute_name}", "memory"
-            )
-        else:
-            for index, temp_layer in enumerate(heating_layers):
-                if temp_layer.name() == f"Heatmap-{attribute_name}":
-                    heatmap_layer = heating_layers[index]
-                    break
-                else:
-                    heatmap_layer = QgsVectorLayer(
-                        "Point?crs=EPSG:4326", f"Heatmap-{attribute_name}", "memory"
-                    )
-        try:
-            assert heatmap_layer is not None
-        except AssertionError:
-            logging.error(
-                f"Heatmap for {attribute_name} was None after trying to process."
+    for stage_name, other_metrics in other_stage_metrics.items():
+        if stage_name not in stage_metrics:
+            stage_metrics[stage_name] = dict(other_metrics)
+            continue
+        metrics = stage_metrics[stage_name]
+        for key in ("wall_time", "cpu_time", "self_wall_time", "self_cpu_time"):
+            metrics[key] += other_metrics[key]
+        metrics["items"] += other_metrics["items"]
+        metrics["calls"] += other_metrics["calls"]
+        if other_metrics["peak_rss"] is not None:
+            metrics["peak_rss"] = max(
+                metrics["peak_rss"] or 0, other_metrics["peak_rss"]
             )
-            exit()
-        new_feats = []
-        heatmap_layer.startEditing()
-        # Determine if a feature is worth putting on current layer
-        for feat in locations_layer.getFeatures():
-            try:
-                # value inside the csv file for wether a house has Electricity, NG, etc
-                if feat[attribute_name] is True:
-                    new_feats.append(QgsFeature(feat))
-            except KeyError:
-                logging.error(
-                    f"Could not find {attribute_name} field in {heatmap_layer.name()}"
-                )
-        heatmap_layer.dataProvider().addFeatures(new_feats)
-        heatmap_layer.updateExtents()
-        heatmap_layer.commitChanges()
 
-        heatmap_layer.startEditing()
-        heatmap_renderer = QgsHeatmapRenderer()
-        heatmap_renderer.setWeightExpression("1")
-        heatmap_renderer.setRadius(15)
-        heatmap_renderer.setColorRamp(
-            QgsGradientColorRamp(QColor(255, 16, 16, 0), QColor(67, 67, 215, 255))
+
+def write_stage_report(report_path: Path = STAGE_REPORT_PATH) -> dict:
+    """Write the metrics of every stage measured in this run as JSON
+
+    Note:
+        Throughput is items per second of the stage's self wall time. Stages run by worker processes add up the time of every worker.
+
+    Args:
+        report_path (Path, optional): where to write the report. Defaults to STAGE_REPORT_PATH.
+
+    Returns:
+        dict: the report
+    """
+    stages = []
+    for stage_name, metrics in stage_metrics.items():
+        self_wall_time = metrics["self_wall_time"]
+        stages.append(
+            {
+                "stage": stage_name,
+                **metrics,
+                "items_per_second": metrics["items"] / self_wall_time
+                if metrics["items"] and self_wall_time > 0
+                else None,
+            }
         )
-        heatmap_layer.setRenderer(heatmap_renderer)
-        heatmap_layer.exportNamedStyle(doc, read_write_context)
-        heatmap_layer.commitChanges()
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "peak_rss": get_peak_rss(),
+        "stages": stages,
+        "join_coverage": join_coverage,
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+    logging.info(f"Wrote stage report to {report_path}")
+    return report
 
-        error = save_location_heatmap_gpkg(heatmap_layer)
 
-        if error[0] == QgsVectorFileWriter.WriterError.NoError:
-            heatmap_layer_path = (
-                f"{LOCATION_HEATMAP_GPKG_OUTPUT}|layername={heatmap_layer.name()}"
-            )
-            heatmap_layer = QgsVectorLayer(
-                heatmap_layer_path, f"Heatmap-{attribute_name}", "ogr"
-            )
-            heatmap_layer.importNamedStyle(doc)
-            heatmap_layer.saveStyleToDatabase(
-                heatmap_layer.name(), f"{heatmap_layer.name()} style", True, ""
-            )
-            heating_layers.append(heatmap_layer)
-        else:
-            logging.error(
-                f"Encountered error {error} when writing {heatmap_layer.name()}"
-            )
+def load_build_manifest() -> dict:
+    """Load the manifest of the previous build, or an empty one if there is none
 
-    return heating_layers
+    Returns:
+        dict: the manifest
+    """
+    if not BUILD_MANIFEST_PATH.exists():
+        return {}
+    try:
+        with open(BUILD_MANIFEST_PATH, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        logging.warning(
+            f"Could not read {BUILD_MANIFEST_PATH}, rebuilding everything: {e}"
+        )
+        return {}
 
 
-def load_filtered_data_from_demo_file(
-    file_path: Path
-):  # -> tuple[dict[str | Any, dict[str, str | Any]] | None, Literal[4, 2] | None]
-    """Filters csv to just be the allowed columns for that census table type
+def save_build_manifest(manifest: dict):
+    BUILD_MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(BUILD_MANIFEST_PATH, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def fingerprint_file(
+    file_path: Path, previous: typing.Optional[dict] = None
+) -> dict[str, typing.Any]:
+    """Get the size, mtime and hash of an input file
 
     Note:
-        organized as:
-        {"zipcode1" : {"ESTPCT...": value,
-                    "ESTPCT2...": value,
-                    ...},
-        "zipcode2" : {},...
-        }
+        The file is only hashed when its size or mtime differ from the previous fingerprint, so unchanged inputs cost a stat call.
 
     Args:
-        csv_headers (list[str]): the headers of the csv file
-        file_path (Path): the path to the census data csv
+        file_path (Path): input file
+        previous (typing.Optional[dict], optional): fingerprint from the previous build. Defaults to None.
 
     Returns:
-        _type_: _description_
+        dict[str, typing.Any]: {"size", "mtime_ns", "sha256"}
     """
-    zip_data_dict = None
-    range_type = None
-    if "S1501" in file_path.stem:
-        with open(file_path, encoding="utf-8") as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            zip_data_dict = {
-                row["ZCTA"]: {attr: row[attr] for attr in S1501_ALLOW_LIST}
-                for row in csv_reader
-            }
-        range_type = 2
-
-    elif "S1901" in file_path.stem:
-        with open(file_path, encoding="utf-8") as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            zip_data_dict = {
-                row["ZCTA"]: {attr: row[attr] for attr in S1901_ALLOW_LIST}
-                for row in csv_reader
-            }
-        range_type = 2
-
-    elif "DP05" in file_path.stem:
-        with open(file_path, encoding="utf-8") as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            zip_data_dict = {
-                row["ZCTA"]: {attr: row[attr] for attr in DP05_ALLOW_LIST}
-                for row in csv_reader
-            }
-        range_type = 4
+    stat = file_path.stat()
+    if (
+        previous is not None
+        and previous.get("size") == stat.st_size
+        and previous.get("mtime_ns") == stat.st_mtime_ns
+    ):
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": previous["sha256"],
+        }
 
-    return (zip_data_dict, range_type)
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
 
 
-# Used to create heatmap layers from csv demographic data
-def create_demographic_layers(
-    file_path: Path
-) -> typing.Union[list[QgsVectorLayer], None]:
-    # (table_name, layers)
-    possible_layers = project.mapLayersByName("BaseLayerDB — Zips_in_Metros")
+def fids_to_ranges(fids: typing.Iterable[int]) -> list[list[int]]:
+    """Compress feature ids into inclusive [first, last] runs"""
+    ranges: list[list[int]] = []
+    for fid in sorted(fids):
+        if ranges and fid == ranges[-1][1] + 1:
+            ranges[-1][1] = fid
+        else:
+            ranges.append([fid, fid])
+    return ranges
 
-    base_layer = None
-    if possible_layers:
-        base_layer = possible_layers[0].clone()
 
-    assert isinstance(base_layer, QgsMapLayer)
+def gpkg_layer_exists(gpkg_path: Path, layer_name: str) -> bool:
+    if not gpkg_path.exists():
+        return False
+    return QgsVectorLayer(
+        f"{gpkg_path}|layername={layer_name}", layer_name, "ogr"
+    ).isValid()
 
-    zip_data_dict, range_type = load_filtered_data_from_demo_file(file_path)
-    # un recognized table
-    assert zip_data_dict is not None
-    assert range_type is not None
 
-    if range_type not in [2, 4]:
-        logging.warning("could not recognize file format.")
-        return None
+def delete_gpkg_layers(gpkg_path: Path, layer_names: set[str]) -> list[str]:
+    """Delete layers of a GeoPackage, along with their saved styles
 
-    demo_layers: list[QgsVectorLayer] = []
-    if "S1901" in file_path.stem:
-        for attribute in S1901_ATTRIBUTES:
-            logging.info(f"Making layer for {attribute =}")
-            demo_layers.append(
-                create_styled_demographics_group_layers(
-                    range_type,
-                    base_layer,
-                    attribute,
-                    S1901_ATTRIBUTES,
-                    S1901_ALLOW_LIST,
-                    zip_data_dict,
-                )
-            )
-        assert len(demo_layers) > 0
-    if "S1501" in file_path.stem:
-        for attribute in S1501_ATTRIBUTES:
-            logging.info(f"Making layer for {attribute =}")
-            demo_layers.append(
-                create_styled_demographics_group_layers(
-                    range_type,
-                    base_layer,
-                    attribute,
-                    S1501_ATTRIBUTES,
-                    S1501_ALLOW_LIST,
-                    zip_data_dict,
-                )
+    Args:
+        gpkg_path (Path): GeoPackage to clean up
+        layer_names (set[str]): layers to delete. names the GeoPackage does not hold are ignored
+
+    Returns:
+        list[str]: names of the deleted layers
+    """
+    if not layer_names or not gpkg_path.exists():
+        return []
+    dataset = ogr.Open(str(gpkg_path), 1)
+    if dataset is None:
+        logging.error(f"Could not open {gpkg_path}: {gdal.GetLastErrorMsg()}")
+        return []
+    has_styles = dataset.GetLayerByName("layer_styles") is not None
+    deleted_layer_names = []
+    # deleting shifts the indices of the later layers, so go from the end
+    for layer_index in reversed(range(dataset.GetLayerCount())):
+        layer_name = dataset.GetLayer(layer_index).GetName()
+        if layer_name not in layer_names:
+            continue
+        dataset.DeleteLayer(layer_index)
+        if has_styles:
+            quoted_layer_name = layer_name.replace("'", "''")
+            dataset.ExecuteSQL(
+                f"DELETE FROM layer_styles WHERE f_table_name = '{quoted_layer_name}'"
             )
-        assert len(demo_layers) > 0
-    if "DP05" in file_path.stem:
-        for attribute in DP05_ATTRIBUTES:
-            logging.info(f"Making layer for {attribute =}")
-            demo_layers.append(
-                create_styled_demographics_group_layers(
-                    range_type,
-                    base_layer,
-                    attribute,
-                    DP05_ATTRIBUTES,
-                    DP05_ALLOW_LIST,
-                    zip_data_dict,
-                ),
-            )
-        assert len(demo_layers) > 0
-    return demo_layers
+        deleted_layer_names.append(layer_name)
+    if deleted_layer_names:
+        logging.info(
+            f"Deleted {len(deleted_layer_names)} stale layers from {gpkg_path}: {deleted_layer_names}"
+        )
+    return deleted_layer_names
 
 
-def get_styled_demo_layer(
-    table_attributes: list, demo_layer: QgsVectorLayer
-) -> QgsVectorLayer:
-    for field_name in demo_layer.fields().names():
-        if field_name not in table_attributes:
-            continue
-        # might help: https://gis.stackexchange.com/a/342412/234305
-        default_style = QgsStyle().defaultStyle()
-        color_ramp = default_style.colorRamp("Blues")
-        renderer = QgsGraduatedSymbolRenderer.createRenderer(
-            demo_layer,
-            field_name,
-            8,
-            QgsGraduatedSymbolRenderer.Mode.Quantile,
-            QgsFillSymbol.createSimple({"color": "#000dfe"}),
-            color_ramp,
-        )
-        renderer.sortByValue()
-        renderer.updateRangeLowerValue(0, 0)
-        demo_layer.setRenderer(renderer)
-
-    demo_layer.dataProvider().createSpatialIndex()
+@contextlib.contextmanager
+def gdal_config_options(options: typing.Mapping[str, str]) -> typing.Iterator[None]:
+    """Set GDAL config options for a block, restoring their previous values after it
 
-    doc = QDomDocument()
-    read_write_context = QgsReadWriteContext()
-    demo_layer.exportNamedStyle(doc, read_write_context)
-    error = save_census_data_gpkg(demo_layer)
+    Args:
+        options (typing.Mapping[str, str]): config options to set
+    """
+    previous_options = {key: gdal.GetConfigOption(key) for key in options}
+    for key, value in options.items():
+        gdal.SetConfigOption(key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous_options.items():
+            gdal.SetConfigOption(key, value)
 
-    if error[0] == QgsVectorFileWriter.WriterError.NoError:
-        demo_layer_path = f"{CENSUS_DATA_GPKG_OUTPUT}|layername={demo_layer.name()}"
-        new_layer = QgsVectorLayer(demo_layer_path, f"{demo_layer.name()}", "ogr")
-        new_layer.importNamedStyle(doc)
-        new_layer.saveStyleToDatabase(
-            new_layer.name(), f"{new_layer.name()} style", True, ""
-        )
-        return new_layer
-    else:
-        logging.error(f"Encountered error {error} when writing {demo_layer.name()}")
-        return demo_layer
 
+def drop_feature_field(
+    features: typing.Iterable[QgsFeature], fields: QgsFields, field_index: int
+) -> typing.Iterator[QgsFeature]:
+    """Copy features without one of their fields
 
-def chunked(it, size):
-    it = iter(it)
-    while True:
-        p = tuple(itertools.islice(it, size))
-        if not p:
-            break
-        yield p
+    Args:
+        features (typing.Iterable[QgsFeature]): features to copy
+        fields (QgsFields): fields of the features
+        field_index (int): field to drop
 
+    Yields:
+        QgsFeature: the feature without the field
+    """
+    kept_fields = QgsFields(fields)
+    kept_fields.remove(field_index)
+    for feature in features:
+        attributes = feature.attributes()
+        del attributes[field_index]
+        kept_feature = QgsFeature(kept_fields, feature.id())
+        kept_feature.setGeometry(feature.geometry())
+        kept_feature.setAttributes(attributes)
+        yield kept_feature
 
-# Creates heatmap layers for csvs that are grouped in twos
-def create_styled_demographics_group_layers(
-    range_type: int,
-    base_layer: QgsVectorLayer,
-    attr_name: str,
-    table_attributes_list: list,
-    table_allow_list: list,
-    zip_data_dict: dict[str, dict[str, str]],
-) -> QgsVectorLayer:
-    """create layer based on census column
+
+def convert_features_to_multi(
+    features: typing.Iterable[QgsFeature]
+) -> typing.Iterator[QgsFeature]:
+    """Turn the single part geometries of features into multipart geometries, for layers of a multi type"""
+    for feature in features:
+        geometry = feature.geometry()
+        if not geometry.isNull() and not geometry.isMultipart():
+            geometry = QgsGeometry(geometry)
+            geometry.convertToMultiType()
+            feature = QgsFeature(feature)
+            feature.setGeometry(geometry)
+        yield feature
 
 
+def get_hilbert_keys(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Get the position of points along a Hilbert curve over their extent
+
     Note:
-        Features are rows in a layer, fields are columns in a layer. attributes are cells.
+        Points are snapped to a grid of 2^SPATIAL_ORDER_CURVE_BITS cells per axis. Points with a NaN coordinate get the largest key.
 
     Args:
-        base_layer (QgsVectorLayer): base layer
-        attr_name (str): census column name you would like a layer created for
-        zip_data_dict (dict[str, dict[str, str]]): dictionary of all zip codes, and each desired column with this columns data. should be 33k long, and each entry should be a dict of length about 40
+        x (np.ndarray): x coordinates
+        y (np.ndarray): y coordinates
+
+    Returns:
+        np.ndarray: uint64 curve position of each point
     """
-    demo_layer = QgsVectorLayer("MultiPolygon?crs=EPSG:3857", f"{attr_name}", "memory")
+    keys = np.full(len(x), np.iinfo(np.uint64).max, dtype=np.uint64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.any():
+        return keys
 
-    # copy base layer information to our demographic layer
-    demo_layer.startEditing()
-    demo_prov = demo_layer.dataProvider()
-    demo_prov.addAttributes([QgsField("ZCTA5", QVariant.Type.String)])
-    demo_layer.updateFields()
-    demo_layer.loadNamedStyle(base_layer.styleURI())
-    demo_layer.styleManager().copyStylesFrom(base_layer.styleManager())
-    demo_layer.commitChanges()
+    grid_size = 1 << SPATIAL_ORDER_CURVE_BITS
+    grid_coordinates = []
+    for values in (x[valid], y[valid]):
+        span = values.max() - values.min()
+        scale = (grid_size - 1) / span if span > 0 else 0.0
+        grid_coordinates.append(
+            ((values - values.min()) * scale).astype(np.int64).clip(0, grid_size - 1)
+        )
+    grid_x, grid_y = grid_coordinates
 
-    # add specific fields that are related to the target census table column
-    desired_census_columns = []
-    for attr_chunk in chunked(table_allow_list, range_type):
-        if len(attr_chunk) != range_type:
-            break
-        if attr_name not in attr_chunk:
-            continue
-        # if we get a table grouping ie (PCT PME; EST, MOE, PCT, PME) that contains the target census table column, add it as an attribute
-        # adding as an attribute to the data provider so that everyone has at least the word "NULL" for the value
-        for i, _ in enumerate(attr_chunk):
-            desired_census_columns.append(attr_chunk[i])
-            demo_layer.startEditing()
-            demo_prov.addAttributes([QgsField(attr_chunk[i], QVariant.Type.Double)])
-            demo_layer.commitChanges()
-        break
-    demo_layer.updateFields()
+    valid_keys = np.zeros(len(grid_x), dtype=np.uint64)
+    cell_size = grid_size // 2
+    while cell_size > 0:
+        rx = (grid_x & cell_size) > 0
+        ry = (grid_y & cell_size) > 0
+        valid_keys += np.uint64(cell_size * cell_size) * (
+            (3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64)
+        )
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        grid_x = np.where(flip, grid_size - 1 - grid_x, grid_x)
+        grid_y = np.where(flip, grid_size - 1 - grid_y, grid_y)
+        grid_x, grid_y = np.where(ry, grid_x, grid_y), np.where(ry, grid_y, grid_x)
+        cell_size //= 2
+    keys[valid] = valid_keys
+    return keys
 
-    for old_feature in base_layer.getFeatures():
-        new_zcta5_feature = QgsFeature()
-        new_zcta5_feature.setFields(demo_layer.fields())
-        # set feature to possible features
-        new_zcta5_feature.setGeometry(old_feature.geometry())
-        new_zcta5_feature.setAttribute(
-            "ZCTA5", old_feature.attributes()[old_feature.fieldNameIndex("ZCTA5")]
-        )
-        # start editing this added feature
-        demo_layer.startEditing()
-        (result, new_features) = demo_prov.addFeatures([new_zcta5_feature])
-        demo_layer.updateFields()  # just for safety
-
-        feature_id = new_features[0].id()
-        target_zip_code_field_index = new_zcta5_feature.fieldNameIndex("ZCTA5")
-        target_zip_code: str = new_zcta5_feature.attributes()[
-            target_zip_code_field_index
-        ]
-        target_zip_code_data_dict = zip_data_dict.get(target_zip_code, "")
-        if isinstance(target_zip_code_data_dict, str):
-            # theres a lot of these, so try not to enable
-            demo_layer.commitChanges()
-            continue
-        # the census_column_dict relies on the fact that desired_census_columns have been added as data provider attributes (fields) to the layer
-        # since values in the raw dict can be erroneous, do not make a color map out of them. filter before you do
-        census_column_dict = {
-            column_name: column_value
-            for column_name, column_value in target_zip_code_data_dict.items()
-            if column_name in desired_census_columns
-        }
 
-        # final values will either be < 0, NULL, or a valid number
-        for key, value in census_column_dict.items():
-            census_field_index = new_zcta5_feature.fieldNameIndex(key)
-            desired_attr_value = {census_field_index: value}
-            demo_prov.changeAttributeValues({feature_id: desired_attr_value})
-        demo_layer.commitChanges()
+def order_features_spatially(features: typing.Iterable[QgsFeature]) -> list[QgsFeature]:
+    """Sort features along a Hilbert curve through the centers of their bounding boxes
 
-    demo_layer.updateExtents()  # because we change the size?
+    Note:
+        All features are held in memory while they are sorted. Features without a geometry go last, in their original order.
 
-    # style
-    new_layer = get_styled_demo_layer(table_attributes_list, demo_layer)
-    return new_layer
+    Args:
+        features (typing.Iterable[QgsFeature]): features to sort
 
+    Returns:
+        list[QgsFeature]: the features, spatially ordered
+    """
+    features = list(features)
+    centers = np.full((len(features), 2), np.nan)
+    for feature_index, feature in enumerate(features):
+        geometry = feature.geometry()
+        if geometry.isNull():
+            continue
+        center = geometry.boundingBox().center()
+        centers[feature_index] = (center.x(), center.y())
+    keys = get_hilbert_keys(centers[:, 0], centers[:, 1])
+    return [
+        features[feature_index] for feature_index in np.argsort(keys, kind="stable")
+    ]
 
-# Used to map a value from one scale to another scale
-def translate(value, fromMin, fromMax, toMin, toMax):
-    fromSpan = fromMax - fromMin
-    toSpan = toMax - toMin
-    valueScaled = float(value - fromMin) / float(fromSpan)
-    return toMin + (valueScaled * toSpan)
 
+class LayerWriter(abc.ABC):
+    """Writes any number of layers with QgsVectorFileWriter
 
-def read_demographic_data(directory: Path) -> list[tuple[str, list[QgsVectorLayer]]]:
-    """Read the census directory and create a list of vector layers for each filtered field in each file found in the dir.
+    Note:
+        Subclasses choose the driver and where each layer is stored. Writing a layer that already exists replaces it, and a layer whose write fails is removed so a later run never reuses a partial layer.
 
     Args:
-        directory (Path): census directory
-
-    Returns:
-        typing.List[typing.List[QgsVectorLayer]]: list of lists, grouped by filename
+        output_path (Path): file or directory to write to
     """
-    demo_groups: list[tuple[str, list[QgsVectorLayer]]] = []
 
-    # All files in the other folders, in the layers folder, will be processed individually
-    for file_path in directory.glob("*.csv"):
-        logging.info(f"Found census table : {file_path.stem}")
-        layers_for_file = create_demographic_layers(file_path)
-        if layers_for_file is None:
-            continue
-        demo_groups.append((file_path.stem, layers_for_file))
+    # OGR driver of the format
+    driver_name = ""
+    # creation options of every layer
+    layer_creation_options: tuple[str, ...] = ()
+    # GDAL config options set while a layer is written
+    config_options: typing.Mapping[str, str] = types.MappingProxyType({})
+    # stage the writes are measured under
+    write_stage = "layer write"
 
-    assert len(demo_groups) > 0
-    return demo_groups
+    def __init__(self, output_path: Path):
+        self.output_path = output_path
 
+    def __enter__(self) -> "LayerWriter":
+        self.open()
+        return self
 
-if __name__ == "__console__":
-    (
-        csv_layer,
-        csv_contents,
-        csv_headers,
-        csv_attributes,
-    ) = read_housing_data_and_create_temp_location_points_layer(METRO_DIRECTORY)
-    location_layer = create_locations_layer_from_csv(
-        csv_contents, csv_headers, csv_layer
-    )
-    heatmap_layers = create_heatmap_layers(location_layer, csv_attributes)
-    demo_groups = read_demographic_data(CENSUS_DIRECTORY)
+    def __exit__(self, *exc_info):
+        self.close()
 
-    heatmap_tree_group = QgsLayerTreeGroup("Heating Types")
-    demo_tree_group = QgsLayerTreeGroup("Demographics")
-    layer_tree_root.insertChildNode(0, heatmap_tree_group)
-    layer_tree_root.insertChildNode(1, demo_tree_group)
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def get_layer_path(self, layer_name: str) -> Path:
+        """Get the file a layer is written to"""
+
+    def get_existing_file_action(
+        self, layer_path: Path
+    ) -> QgsVectorFileWriter.ActionOnExistingFile:
+        return QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteFile
+
+    def finish_layer(self, layer_name: str):
+        pass
+
+    def discard_layer(self, layer_name: str):
+        """Remove a layer whose write failed"""
+        layer_path = self.get_layer_path(layer_name)
+        if layer_path.exists():
+            layer_path.unlink()
+
+    def write_features(
+        self,
+        layer_name: str,
+        fields: QgsFields,
+        wkb_type: QgsWkbTypes.Type,
+        crs: QgsCoordinateReferenceSystem,
+        features: typing.Iterable[QgsFeature],
+        preserve_fids: bool = False,
+        spatial_order: typing.Optional[bool] = None,
+    ) -> tuple[QgsVectorFileWriter.WriterError, str]:
+        """Write features to a new layer
+
+        Note:
+            Features are handed to QgsVectorFileWriter in batches of LAYER_WRITE_BATCH_SIZE, and it writes each layer inside one transaction. Where the format stores fids, features are numbered in the order they are written, unless preserve_fids keeps the "fid" field GeoPackage layers read by QGIS expose. Spatially ordered features are always renumbered.
+
+        Args:
+            layer_name (str): layer name
+            fields (QgsFields): fields of the features
+            wkb_type (QgsWkbTypes.Type): geometry type of the layer
+            crs (QgsCoordinateReferenceSystem): crs of the layer
+            features (typing.Iterable[QgsFeature]): features to write, consumed lazily
+            preserve_fids (bool, optional): keep the "fid" field of the features as their fid. Defaults to False.
+            spatial_order (typing.Optional[bool], optional): sort the features along a Hilbert curve before writing them. Defaults to None, which uses SPATIAL_ORDER_FEATURES.
+
+        Returns:
+            tuple[QgsVectorFileWriter.WriterError, str]: error code and message, like QgsVectorFileWriter.writeAsVectorFormatV3
+        """
+        if spatial_order is None:
+            spatial_order = SPATIAL_ORDER_FEATURES
+        if spatial_order:
+            with measure_stage("spatial ordering") as metrics:
+                features = order_features_spatially(features)
+                metrics["items"] += len(features)
+            preserve_fids = False
+
+        fid_field_index = fields.indexFromName("fid")
+        if not preserve_fids and fid_field_index >= 0:
+            features = drop_feature_field(features, fields, fid_field_index)
+            fields = QgsFields(fields)
+            fields.remove(fid_field_index)
+        if QgsWkbTypes.isMultiType(wkb_type):
+            features = convert_features_to_multi(features)
+
+        layer_path = self.get_layer_path(layer_name)
+        layer_path.parent.mkdir(parents=True, exist_ok=True)
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = self.driver_name
+        options.layerName = layer_name
+        options.fileEncoding = "UTF-8"
+        options.layerOptions = list(self.layer_creation_options)
+        options.actionOnExistingFile = self.get_existing_file_action(layer_path)
+
+        with measure_stage(self.write_stage) as metrics, gdal_config_options(
+            self.config_options
+        ):
+            writer = QgsVectorFileWriter.create(
+                str(layer_path),
+                fields,
+                wkb_type,
+                crs,
+                QgsCoordinateTransformContext(),
+                options,
+            )
+            error = (writer.hasError(), writer.errorMessage())
+            written = False
+            try:
+                if error[0] == QgsVectorFileWriter.WriterError.NoError:
+                    for feature_batch in chunked(features, LAYER_WRITE_BATCH_SIZE):
+                        if not writer.addFeatures(list(feature_batch)):
+                            error = (
+                                QgsVectorFileWriter.WriterError.ErrFeatureWriteFailed,
+                                writer.errorMessage(),
+                            )
+                            break
+                        metrics["items"] += len(feature_batch)
+                written = error[0] == QgsVectorFileWriter.WriterError.NoError
+            finally:
+                # deleting the writer commits its transaction and closes the file
+                del writer
+                if not written:
+                    self.discard_layer(layer_name)
+        if written:
+            self.finish_layer(layer_name)
+        return error
+
+    def write_layer(
+        self, layer: QgsVectorLayer, layer_name: typing.Optional[str] = None
+    ) -> tuple[QgsVectorFileWriter.WriterError, str]:
+        """Write every feature of a layer
+
+        Args:
+            layer (QgsVectorLayer): layer to write
+            layer_name (typing.Optional[str], optional): name of the written layer. Defaults to None, which uses the layer name.
+
+        Returns:
+            tuple[QgsVectorFileWriter.WriterError, str]: error code and message
+        """
+        return self.write_features(
+            layer_name or layer.name(),
+            layer.fields(),
+            layer.wkbType(),
+            layer.crs(),
+            layer.getFeatures(),
+            preserve_fids=layer.providerType() != "memory",
+        )
+
+
+class GeoPackageWriter(LayerWriter):
+    """Writes any number of layers to a GeoPackage
+
+    Note:
+        Layers are written with GPKG_WRITE_CONFIG_OPTIONS, each by its own QgsVectorFileWriter that opens the GeoPackage and commits the layer in a single transaction. Spatial indexes are built for all layers at once when the writer is closed, which opens the GeoPackage one more time. GeoPackage rows are stored in fid order, so spatial ordering renumbers the features.
+
+    Args:
+        gpkg_path (Path): GeoPackage to write to, created if it does not exist
+    """
+
+    driver_name = "GPKG"
+    # the spatial index is built on close, once every feature is in
+    layer_creation_options = ("SPATIAL_INDEX=NO", "FID=fid", "GEOMETRY_NAME=geom")
+    config_options = GPKG_WRITE_CONFIG_OPTIONS
+    write_stage = "gpkg write"
+
+    def __init__(self, gpkg_path: Path):
+        super().__init__(gpkg_path)
+        self.gpkg_path = gpkg_path
+        # layers to index on close
+        self.indexed_layers: list[str] = []
+
+    def get_layer_path(self, layer_name: str) -> Path:
+        return self.gpkg_path
+
+    def get_existing_file_action(
+        self, layer_path: Path
+    ) -> QgsVectorFileWriter.ActionOnExistingFile:
+        if layer_path.exists():
+            return QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteLayer
+        return QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteFile
+
+    def finish_layer(self, layer_name: str):
+        self.indexed_layers.append(layer_name)
+
+    def discard_layer(self, layer_name: str):
+        dataset = ogr.Open(str(self.gpkg_path), 1)
+        if dataset is None:
+            return
+        for layer_index in range(dataset.GetLayerCount()):
+            if dataset.GetLayer(layer_index).GetName() == layer_name:
+                dataset.DeleteLayer(layer_index)
+                logging.warning(f"Removed the partly written {layer_name}")
+                break
+
+    def close(self):
+        if not self.indexed_layers:
+            return
+        with measure_stage(self.write_stage), gdal_config_options(self.config_options):
+            dataset = ogr.Open(str(self.gpkg_path), 1)
+            if dataset is None:
+                logging.error(
+                    f"Could not open {self.gpkg_path} to index it: {gdal.GetLastErrorMsg()}"
+                )
+                return
+            dataset.StartTransaction()
+            for layer_name in self.indexed_layers:
+                ogr_layer = dataset.GetLayerByName(layer_name)
+                if ogr_layer is None or not ogr_layer.GetGeometryColumn():
+                    continue
+                quoted_layer_name = layer_name.replace("'", "''")
+                result = dataset.ExecuteSQL(
+                    f"SELECT CreateSpatialIndex('{quoted_layer_name}', '{ogr_layer.GetGeometryColumn()}')"
+                )
+                if result is not None:
+                    dataset.ReleaseResultSet(result)
+            dataset.CommitTransaction()
+        # dropping the reference closes the GeoPackage
+        dataset = None
+        self.indexed_layers = []
+        logging.info(f"Closed {self.gpkg_path}")
+
+
+def get_layer_file_name(layer_name: str) -> str:
+    """Replace the characters a file name can not hold on Windows"""
+    return re.sub(r'[<>:"/\\|?*]', "_", layer_name)
+
+
+class LayerFileWriter(LayerWriter):
+    """Writes every layer to its own file of a directory, for formats that hold a single layer
+
+    Args:
+        output_directory (Path): directory to write to, created if it does not exist
+    """
+
+    # extension of the written files
+    extension = ""
+
+    def get_layer_path(self, layer_name: str) -> Path:
+        return self.output_path / f"{get_layer_file_name(layer_name)}.{self.extension}"
+
+    def finish_layer(self, layer_name: str):
+        logging.info(f"Wrote {self.get_layer_path(layer_name)}")
+
+
+class FlatGeobufWriter(LayerFileWriter):
+    """Writes every layer to a FlatGeobuf file
+
+    Note:
+        Features are streamed to the file and indexed with a packed Hilbert R-tree, which QGIS reads for the extent on screen only.
+    """
+
+    driver_name = "FlatGeobuf"
+    extension = "fgb"
+    layer_creation_options = ("SPATIAL_INDEX=YES",)
+    write_stage = "flatgeobuf write"
+
+
+class GeoParquetWriter(LayerFileWriter):
+    """Writes every layer to a GeoParquet file
+
+    Note:
+        Columns are compressed separately, which suits the wide census tables, and analytics tools read only the columns they need. Needs a GDAL built with Arrow, as the one bundled with QGIS is.
+    """
+
+    driver_name = "Parquet"
+    extension = "parquet"
+    layer_creation_options = (
+        f"COMPRESSION={GEOPARQUET_COMPRESSION}",
+        f"ROW_GROUP_SIZE={GEOPARQUET_ROW_GROUP_SIZE}",
+        "FID=fid",
+        "GEOMETRY_NAME=geom",
+    )
+    write_stage = "geoparquet write"
+
+
+# Writers of the formats the export stage can write, by the name given on the command line
+EXPORT_FORMAT_WRITERS: dict[str, type[LayerFileWriter]] = {
+    "flatgeobuf": FlatGeobufWriter,
+    "geoparquet": GeoParquetWriter,
+}
+
+
+def save_layers_to_gpkg(
+    gpkg_path: Path, layers: list[QgsVectorLayer]
+) -> list[tuple[QgsVectorFileWriter.WriterError, str]]:
+    """Write layers to a GeoPackage, building their spatial indexes together once all of them are written
+
+    Note:
+        Every layer is written by its own QgsVectorFileWriter, which opens the GeoPackage and commits the layer in one transaction.
+
+    Args:
+        gpkg_path (Path): GeoPackage to write to
+        layers (list[QgsVectorLayer]): layers to write, each to a table named after the layer
+
+    Returns:
+        list[tuple[QgsVectorFileWriter.WriterError, str]]: error of each layer
+    """
+    with GeoPackageWriter(gpkg_path) as writer:
+        return [writer.write_layer(layer) for layer in layers]
+
+
+def layers_written(layers: list[QgsMapLayer]) -> bool:
+    """Whether every layer was read back from its file, rather than left in memory because its write failed"""
+    return all(layer.providerType() != "memory" for layer in layers)
+
+
+def save_styled_layers(
+    gpkg_path: Path, layers: list[QgsVectorLayer]
+) -> list[QgsVectorLayer]:
+    """Write styled layers to a GeoPackage and read them back with their style saved as the default of their table
+
+    Args:
+        gpkg_path (Path): GeoPackage to write to
+        layers (list[QgsVectorLayer]): styled layers to write
+
+    Returns:
+        list[QgsVectorLayer]: the layers read from the GeoPackage. a layer that could not be written is returned as is
+    """
+    read_write_context = QgsReadWriteContext()
+    style_docs = []
+    with measure_stage("styling"):
+        for layer in layers:
+            doc = QDomDocument()
+            layer.exportNamedStyle(doc, read_write_context)
+            style_docs.append(doc)
+
+    errors = save_layers_to_gpkg(gpkg_path, layers)
+
+    saved_layers: list[QgsVectorLayer] = []
+    with measure_stage("styling") as metrics:
+        for layer, doc, error in zip(layers, style_docs, errors):
+            if error[0] != QgsVectorFileWriter.WriterError.NoError:
+                logging.error(f"Encountered error {error} when writing {layer.name()}")
+                saved_layers.append(layer)
+                continue
+            saved_layer = QgsVectorLayer(
+                f"{gpkg_path}|layername={layer.name()}", layer.name(), "ogr"
+            )
+            saved_layer.importNamedStyle(doc)
+            saved_layer.saveStyleToDatabase(
+                saved_layer.name(), f"{saved_layer.name()} style", True, ""
+            )
+            saved_layers.append(saved_layer)
+        metrics["items"] += len(saved_layers)
+    return saved_layers
+
+
+def find_housing_csv_files(all_metros_directory: Path) -> list[Path]:
+    """Get every zip code csv in the metro directory and its sub folders
+
+    Args:
+        all_metros_directory (Path): directory holding a folder per metro
+
+    Returns:
+        list[Path]: zip code csv files, sorted by zip code then path
+    """
+    zip_code_csv_regex = re.compile(r"[0-9]{3}|[0-9]{4}|[0-9]{5}")
+    # sorted so rows, and the feature ids given to them, come in the same order every run,
+    # and so the copies of a zip code found in several metros are read one after another
+    return sorted(
+        (
+            path
+            for path in all_metros_directory.rglob("*.csv")
+            if zip_code_csv_regex.match(path.stem) is not None
+        ),
+        key=lambda path: (path.stem, path),
+    )
+
+
+def read_housing_csv_headers(csv_file: Path) -> list[str]:
+    """Read the header row of a housing csv
+
+    Args:
+        csv_file (Path): zip code csv file
+
+    Returns:
+        list[str]: column names, empty if the file is empty
+    """
+    with open(csv_file, "r", encoding="utf-8", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def find_housing_csv_headers(csv_files: list[Path]) -> list[str]:
+    """Read the header of the first housing csv that has the columns of LOCATION_COORDINATE_COLUMNS
+
+    Note:
+        Empty csvs and csvs without coordinates are logged and skipped. Since every csv is read against these headers, they are then also rejected when their rows are read.
+
+    Args:
+        csv_files (list[Path]): zip code csv files
+
+    Returns:
+        list[str]: column names, empty if no csv has coordinates
+    """
+    for csv_file in csv_files:
+        headers = read_housing_csv_headers(csv_file)
+        if all(column in headers for column in LOCATION_COORDINATE_COLUMNS):
+            return headers
+        logging.warning(
+            f"Skipping {csv_file}, it has no {LOCATION_COORDINATE_COLUMNS} columns"
+        )
+    return []
+
+
+def read_housing_csv_file(
+    csv_file: Path, headers: list[str]
+) -> tuple[list[list[str]], typing.Optional[str]]:
+    """Read every row of a housing csv, in the column order of the given headers
+
+    Note:
+        Files whose header lists the same columns in another order, or extra columns, are remapped to the given headers. Files missing any of the columns are rejected. Rows shorter than the header are padded with empty cells, whatever the column order of the file, and counted in a warning.
+
+    Args:
+        csv_file (Path): zip code csv file
+        headers (list[str]): expected column names, usually the header of the first csv
+
+    Returns:
+        tuple[list[list[str]], typing.Optional[str]]: rows without the header, and an error message if the file was rejected
+    """
+    with open(csv_file, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        file_headers = next(reader, None)
+        if file_headers is None:
+            return [], None
+        missing_headers = [header for header in headers if header not in file_headers]
+        if missing_headers:
+            return [], f"missing columns {missing_headers}"
+        column_indices = [file_headers.index(header) for header in headers]
+        in_header_order = file_headers == headers
+        row_length = max(column_indices, default=-1) + 1
+        rows = []
+        short_row_count = 0
+        for row in reader:
+            if len(row) < row_length:
+                row.extend([""] * (row_length - len(row)))
+                short_row_count += 1
+            rows.append(
+                row
+                if in_header_order
+                else [row[column_index] for column_index in column_indices]
+            )
+    if short_row_count:
+        logging.warning(
+            f"Padded {short_row_count} short rows of housing csv {csv_file} with empty cells"
+        )
+    return rows, None
+
+
+def iter_housing_csv_files(
+    csv_files: list[Path], headers: typing.Optional[list[str]] = None
+) -> typing.Iterator[tuple[Path, list[list[str]]]]:
+    """Read the housing csvs on a thread pool, yielding them in the order given
+
+    Note:
+        Most of the time spent on many small csvs is waiting on opening and reading files, so a few threads overlap that latency. Only HOUSING_CSV_PREFETCH_FILES files are read ahead of the consumer to bound memory. Files whose header does not match are logged and yielded with no rows.
+
+    Args:
+        csv_files (list[Path]): zip code csv files
+        headers (typing.Optional[list[str]], optional): expected column names. Defaults to the header of the first csv with coordinates.
+
+    Yields:
+        tuple[Path, list[list[str]]]: csv file and its rows, without the header
+    """
+    if not csv_files:
+        return
+    if headers is None:
+        headers = find_housing_csv_headers(csv_files)
+    csv_file_iter = iter(csv_files)
+    with ThreadPoolExecutor(max_workers=HOUSING_CSV_READ_THREADS) as executor:
+        pending = collections.deque(
+            (csv_file, executor.submit(read_housing_csv_file, csv_file, headers))
+            for csv_file in itertools.islice(csv_file_iter, HOUSING_CSV_PREFETCH_FILES)
+        )
+        while pending:
+            csv_file, future = pending.popleft()
+            next_file = next(csv_file_iter, None)
+            if next_file is not None:
+                pending.append(
+                    (
+                        next_file,
+                        executor.submit(read_housing_csv_file, next_file, headers),
+                    )
+                )
+            rows, error = future.result()
+            if error is not None:
+                logging.error(f"Skipping housing csv {csv_file}: {error}")
+            yield csv_file, rows
+
+
+def get_listing_key(row: list[str], key_indices: list[int]) -> bytes:
+    """Hash the columns identifying a listing into an 8 byte key
+
+    Note:
+        Addresses are compared ignoring case, punctuation and repeated spaces, and coordinates are compared after rounding to LISTING_DEDUP_COORDINATE_DIGITS places.
+
+    Args:
+        row (list[str]): housing csv row
+        key_indices (list[int]): indices of the LISTING_DEDUP_COLUMNS found in the row
+
+    Returns:
+        bytes: listing key
+    """
+    key_values = []
+    for key_index in key_indices:
+        value = row[key_index] if key_index < len(row) else ""
+        try:
+            key_values.append(f"{float(value):.{LISTING_DEDUP_COORDINATE_DIGITS}f}")
+        except ValueError:
+            key_values.append(
+                " ".join(re.sub(r"[^\w\s]", " ", value).casefold().split())
+            )
+    return hashlib.blake2b(
+        "\x1f".join(key_values).encode("utf-8"), digest_size=8
+    ).digest()
+
+
+def iter_unique_housing_csv_files(
+    csv_file_rows: typing.Iterable[tuple[Path, list[list[str]]]], headers: list[str]
+) -> typing.Iterator[tuple[Path, list[list[str]]]]:
+    """Drop the listings already read from an earlier copy of the same zip code csv
+
+    Note:
+        Zip codes that sit in several metros are scraped into every one of their metro folders. Only the 8 byte keys of the zip code being read are kept, so the files must come grouped by zip code, as find_housing_csv_files orders them. The number of dropped listings is logged per metro once every file was read.
+
+    Args:
+        csv_file_rows (typing.Iterable[tuple[Path, list[list[str]]]]): csv files and their rows, as from iter_housing_csv_files
+        headers (list[str]): column names of the rows
+
+    Yields:
+        tuple[Path, list[list[str]]]: csv file and its rows not seen in an earlier file
+    """
+    key_indices = [
+        headers.index(column) for column in LISTING_DEDUP_COLUMNS if column in headers
+    ]
+    dropped_counts: dict[str, int] = {}
+    zip_code = None
+    seen_keys: set[bytes] = set()
+    for csv_file, rows in csv_file_rows:
+        if not key_indices:
+            yield csv_file, rows
+            continue
+        with measure_stage("listing dedup") as metrics:
+            if csv_file.stem != zip_code:
+                zip_code = csv_file.stem
+                seen_keys = set()
+            unique_rows = []
+            for row in rows:
+                listing_key = get_listing_key(row, key_indices)
+                if listing_key not in seen_keys:
+                    seen_keys.add(listing_key)
+                    unique_rows.append(row)
+            metrics["items"] += len(rows)
+        if len(unique_rows) < len(rows):
+            metro = csv_file.parent.name
+            dropped_counts[metro] = (
+                dropped_counts.get(metro, 0) + len(rows) - len(unique_rows)
+            )
+        yield csv_file, unique_rows
+
+    for metro, dropped_count in sorted(dropped_counts.items()):
+        logging.info(f"Dropped {dropped_count} duplicate listings from metro {metro}")
+    if dropped_counts:
+        logging.info(
+            f"Dropped {sum(dropped_counts.values())} duplicate listings in total"
+        )
+
+
+def iter_housing_csv_rows(
+    csv_files: list[Path],
+    row_counts: typing.Optional[dict[str, int]] = None,
+    headers: typing.Optional[list[str]] = None,
+) -> typing.Iterator[list[str]]:
+    """Lazily read the unique rows of every housing csv, in file order
+
+    Args:
+        csv_files (list[Path]): zip code csv files
+        row_counts (typing.Optional[dict[str, int]], optional): filled with the number of rows kept from each file, in file order. Defaults to None.
+        headers (typing.Optional[list[str]], optional): expected column names. Defaults to the header of the first csv with coordinates.
+
+    Yields:
+        list[str]: csv row, without the header
+    """
+    if not csv_files:
+        return
+    if headers is None:
+        headers = find_housing_csv_headers(csv_files)
+    for csv_file, rows in iter_unique_housing_csv_files(
+        iter_housing_csv_files(csv_files, headers), headers
+    ):
+        if row_counts is not None:
+            row_counts[str(csv_file)] = len(rows)
+        yield from rows
+
+
+# Read all files in the directory stated and create layers accordingly
+def read_housing_data_and_create_temp_location_points_layer(
+    all_metros_directory: Path, csv_files: typing.Optional[list[Path]] = None
+) -> tuple[QgsVectorLayer, typing.Iterator[list[str]], list[str], list[str]]:
+    # All data within files in the housing folder will be streamed and processed as one
+    # Get list of all zipcode csvs
+    if csv_files is None:
+        csv_files = find_housing_csv_files(all_metros_directory)
+    headers = find_housing_csv_headers(csv_files)
+
+    csv_layer_pre_data = QgsVectorLayer("Point?crs=EPSG:4326", "Locations", "memory")
+
+    csv_layer_pre_data.dataProvider().addAttributes(
+        [
+            QgsField(header, LOCATION_FIELD_TYPE_MAP.get(header, QVariant.Type.Invalid))
+            for header in headers
+        ]
+    )
+    csv_layer_pre_data.updateFields()
+
+    # layer, csv, headers, attributes
+    return (
+        csv_layer_pre_data,
+        iter_housing_csv_rows(csv_files, headers=headers),
+        headers,
+        list(itertools.dropwhile(lambda x: x != "Electricity", headers)),
+    )
+
+
+def parse_csv_int(value: str) -> typing.Optional[int]:
+    """Convert a housing csv cell to an int, or None if it is empty or not a number"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def parse_csv_double(value: str) -> typing.Optional[float]:
+    """Convert a housing csv cell to a float, or None if it is empty or not a number"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_csv_bool(value: str) -> typing.Optional[bool]:
+    """Convert a housing csv cell such as "True" or "False" to a bool, or None if it is empty"""
+    value = value.strip().lower()
+    if not value:
+        return None
+    return value in CSV_TRUE_VALUES
+
+
+# converters from a csv string to the python value of a location field type
+LOCATION_FIELD_CONVERTERS: dict[int, typing.Callable[[str], typing.Any]] = {
+    QVariant.Type.Int: parse_csv_int,
+    QVariant.Type.Double: parse_csv_double,
+    QVariant.Type.Bool: parse_csv_bool,
+}
+
+
+class LocationRowPlan(typing.NamedTuple):
+    """Where each housing csv column goes in a locations feature, worked out once from the headers"""
+
+    # fields the point of a feature is read from, after conversion
+    longitude_field: int
+    latitude_field: int
+    field_count: int
+    # (csv column index, field index, converter) for every csv column that has a field
+    columns: list[tuple[int, int, typing.Callable[[str], typing.Any]]]
+    # True when csv column i is field i for every column, so rows can be converted in one pass
+    in_field_order: bool
+
+
+def compile_location_row_plan(
+    csv_headers: list[str], locations_fields: QgsFields
+) -> typing.Optional[LocationRowPlan]:
+    """Build the row plan used to turn housing csv rows into locations feature attributes
+
+    Args:
+        csv_headers (list[str]): headers of the housing csvs
+        locations_fields (QgsFields): fields of the locations layer
+
+    Returns:
+        typing.Optional[LocationRowPlan]: the compiled plan, None if the csvs have no coordinate columns
+    """
+    longitude_column, latitude_column = LOCATION_COORDINATE_COLUMNS
+    if (
+        locations_fields.indexFromName(longitude_column) < 0
+        or locations_fields.indexFromName(latitude_column) < 0
+    ):
+        logging.error(
+            f"Housing csvs have no {LOCATION_COORDINATE_COLUMNS} columns, no locations can be placed"
+        )
+        return None
+
+    columns = []
+    for csv_index, header in enumerate(csv_headers):
+        field_index = locations_fields.indexFromName(header)
+        if field_index < 0:
+            logging.warning(f"Housing csv column {header} has no locations field")
+            continue
+        converter = LOCATION_FIELD_CONVERTERS.get(
+            locations_fields.at(field_index).type(), str
+        )
+        columns.append((csv_index, field_index, converter))
+
+    return LocationRowPlan(
+        longitude_field=locations_fields.indexFromName(longitude_column),
+        latitude_field=locations_fields.indexFromName(latitude_column),
+        field_count=locations_fields.count(),
+        columns=columns,
+        in_field_order=len(columns) == locations_fields.count()
+        and all(csv_index == field_index for csv_index, field_index, _ in columns),
+    )
+
+
+def convert_location_row(row_plan: LocationRowPlan, line: list[str]) -> list:
+    """Convert a housing csv row to a typed attribute list following the row plan
+
+    Note:
+        Fields of columns a short row is missing are NULL.
+
+    Args:
+        row_plan (LocationRowPlan): plan compiled from the csv headers
+        line (list[str]): csv row
+
+    Returns:
+        list: attributes, in field order, always row_plan.field_count long
+    """
+    if row_plan.in_field_order:
+        attributes = [
+            converter(value) for (_, _, converter), value in zip(row_plan.columns, line)
+        ]
+        attributes.extend([None] * (row_plan.field_count - len(attributes)))
+        return attributes
+
+    attributes = [None] * row_plan.field_count
+    for csv_index, field_index, converter in row_plan.columns:
+        if csv_index < len(line):
+            attributes[field_index] = converter(line[csv_index])
+    return attributes
+
+
+def create_location_feature(
+    row_plan: LocationRowPlan, locations_fields: QgsFields, line: list[str]
+) -> QgsFeature:
+    """Create a locations feature from a housing csv row
+
+    Args:
+        row_plan (LocationRowPlan): plan compiled from the csv headers
+        locations_fields (QgsFields): fields of the locations layer
+        line (list[str]): csv row
+
+    Returns:
+        QgsFeature: point feature with typed attributes, without a geometry if the row has no coordinates
+    """
+    attributes = convert_location_row(row_plan, line)
+    feat = QgsFeature(locations_fields)
+    longitude = attributes[row_plan.longitude_field]
+    latitude = attributes[row_plan.latitude_field]
+    if longitude is not None and latitude is not None:
+        feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(longitude, latitude)))
+    feat.setAttributes(attributes)
+    return feat
+
+
+# Used to create a point layer from csv data
+def create_locations_layer_from_csv(
+    csv_contents: typing.Iterable[list[str]],
+    csv_headers: typing.List[str],
+    locations_layer: QgsVectorLayer,
+    row_fids: typing.Optional[list[int]] = None,
+) -> QgsVectorLayer:
+    """For each location in the given csv, add them as a feature to the locations GeoPackage layer
+
+    Note:
+        Rows are converted to features as they are read and written straight to the GeoPackage, so memory use does not grow with the number of listings.
+
+    Args:
+        csv_contents (typing.Iterable[list[str]]): csv rows. do not include headers
+        csv_headers (typing.List[str]): headers
+        locations_layer (QgsVectorLayer): layer holding the fields of the locations layer
+        row_fids (typing.Optional[list[int]], optional): filled with the feature id of every row, in row order, when SPATIAL_ORDER_FEATURES is set. Defaults to None.
+
+    Returns:
+        QgsVectorLayer: the locations layer read from the GeoPackage
+
+    Note:
+        Feature ids are assigned 1, 2, 3... in row order, or in the order of the Hilbert curve when SPATIAL_ORDER_FEATURES is set, in which case every feature is held in memory before writing.
+    """
+    locations_fields = locations_layer.fields()
+    row_plan = compile_location_row_plan(csv_headers, locations_fields)
+    if row_plan is None:
+        csv_contents = ()
+
+    def location_features() -> typing.Iterator[QgsFeature]:
+        # feature ids follow the row order, which lets incremental builds find the features of each csv
+        for fid, line in enumerate(timed_iter(csv_contents, "csv read"), start=1):
+            feat = create_location_feature(row_plan, locations_fields, line)
+            feat.setId(fid)
+            yield feat
+
+    features = timed_iter(location_features(), "feature build")
+    if SPATIAL_ORDER_FEATURES:
+        with measure_stage("spatial ordering") as metrics:
+            features = order_features_spatially(features)
+            if row_fids is not None:
+                row_fids[:] = [0] * len(features)
+            for fid, feat in enumerate(features, start=1):
+                if row_fids is not None:
+                    row_fids[feat.id() - 1] = fid
+                feat.setId(fid)
+            metrics["items"] += len(features)
+
+    with GeoPackageWriter(LOCATION_HEATMAP_GPKG_OUTPUT) as writer:
+        error = writer.write_features(
+            locations_layer.name(),
+            locations_fields,
+            QgsWkbTypes.Type.Point,
+            QgsCoordinateReferenceSystem("EPSG:4326"),
+            features,
+            preserve_fids=True,
+            spatial_order=False,
+        )
+    if error[0] != QgsVectorFileWriter.WriterError.NoError:
+        logging.error(
+            f"Encountered error {error} when writing {locations_layer.name()}"
+        )
+        return locations_layer
+
+    locations_layer_path = (
+        f"{LOCATION_HEATMAP_GPKG_OUTPUT}|layername={locations_layer.name()}"
+    )
+    new_locations_layer = QgsVectorLayer(locations_layer_path, "Locations", "ogr")
+    logging.info(f"Wrote {new_locations_layer.featureCount()} locations")
+    return new_locations_layer
+
+
+def create_heatmap_renderer() -> QgsHeatmapRenderer:
+    """Create the renderer shared by every heating type heatmap
+
+    Returns:
+        QgsHeatmapRenderer: heatmap renderer
+    """
+    heatmap_renderer = QgsHeatmapRenderer()
+    heatmap_renderer.setWeightExpression("1")
+    heatmap_renderer.setRadius(HEATMAP_RADIUS_MM)
+    heatmap_renderer.setColorRamp(create_heatmap_color_ramp())
+    return heatmap_renderer
+
+
+def create_heatmap_color_ramp() -> QgsGradientColorRamp:
+    """Create the color ramp of the heatmaps, from transparent red to blue"""
+    return QgsGradientColorRamp(QColor(255, 16, 16, 0), QColor(67, 67, 215, 255))
+
+
+def create_heatmap_views(
+    locations_layer: QgsVectorLayer,
+    attributes: typing.List[str],
+) -> list[QgsVectorLayer]:
+    """Generate heat maps for the given attributes as filtered views of the locations GeoPackage table
+
+    Note:
+        No points are copied. Each heatmap reads the locations table through a subset string, so it always matches the point data. The heatmap style is saved to the GeoPackage under the heatmap name.
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        attributes (typing.List[str]): heating type fields to create a heatmap for
+
+    Returns:
+        list[QgsVectorLayer]: one heatmap view per attribute
+    """
+    heating_layers: list[QgsVectorLayer] = []
+    location_fields = locations_layer.fields()
+    for attribute_name in attributes:
+        if location_fields.indexFromName(attribute_name) < 0:
+            logging.error(
+                f"Could not find {attribute_name} field in {locations_layer.name()}"
+            )
+            continue
+        heatmap_layer = QgsVectorLayer(
+            locations_layer.source(), f"Heatmap-{attribute_name}", "ogr"
+        )
+        heatmap_layer.setSubsetString(
+            f"{QgsExpression.quotedColumnRef(attribute_name)} = 1"
+        )
+        heatmap_layer.setRenderer(create_heatmap_renderer())
+        heatmap_layer.saveStyleToDatabase(
+            heatmap_layer.name(), f"{heatmap_layer.name()} style", False, ""
+        )
+        heating_layers.append(heatmap_layer)
+
+    return heating_layers
+
+
+# Used to create heatmap layers from csv heating data
+def create_heatmap_layers(
+    locations_layer: QgsVectorLayer,
+    attributes: typing.List[str],
+    as_views: bool = False,
+) -> list[QgsVectorLayer]:
+    """Generate heat maps for the given attributes. Make sure that when you are rendering that you add all of these to a tree
+
+    Note:
+        The locations are read once, and each one is sent to the heatmap of every heating type it has.
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer
+        attributes (typing.List[str]): heating type fields to create a heatmap for
+        as_views (bool, optional): create filtered views of the locations table instead of copying the points of each heatmap. Defaults to False.
+    """
+    logging.info(attributes)
+    if as_views:
+        return create_heatmap_views(locations_layer, attributes)
+
+    # every heatmap is created, even when no location has that heating type
+    heatmap_layers = {
+        attribute_name: QgsVectorLayer(
+            "Point?crs=EPSG:4326", f"Heatmap-{attribute_name}", "memory"
+        )
+        for attribute_name in attributes
+    }
+    heatmap_features: dict[str, list[QgsFeature]] = {
+        attribute_name: [] for attribute_name in attributes
+    }
+
+    location_fields = locations_layer.fields()
+    # (attribute name, field index) for every heating type field on the locations layer
+    attribute_field_indices = []
+    for attribute_name in attributes:
+        field_index = location_fields.indexFromName(attribute_name)
+        if field_index < 0:
+            logging.error(
+                f"Could not find {attribute_name} field in {locations_layer.name()}"
+            )
+            continue
+        attribute_field_indices.append((attribute_name, field_index))
+
+    # Determine which layers a feature is worth putting on in a single pass
+    request = QgsFeatureRequest().setSubsetOfAttributes(
+        [field_index for _, field_index in attribute_field_indices]
+    )
+    with measure_stage("heatmap partitioning") as metrics:
+        for feat in locations_layer.getFeatures(request):
+            metrics["items"] += 1
+            feat_attributes = feat.attributes()
+            geometry = feat.geometry()
+            for attribute_name, field_index in attribute_field_indices:
+                # value inside the csv file for wether a house has Electricity, NG, etc
+                if feat_attributes[field_index] is not True:
+                    continue
+                heatmap_feature = QgsFeature()
+                heatmap_feature.setGeometry(geometry)
+                bucket = heatmap_features[attribute_name]
+                bucket.append(heatmap_feature)
+                if len(bucket) >= LOCATION_FEATURE_BATCH_SIZE:
+                    heatmap_layers[attribute_name].dataProvider().addFeatures(bucket)
+                    bucket.clear()
+
+    for attribute_name, heatmap_layer in heatmap_layers.items():
+        with measure_stage("heatmap partitioning"):
+            heatmap_layer.dataProvider().addFeatures(
+                heatmap_features.pop(attribute_name)
+            )
+            heatmap_layer.updateExtents()
+        with measure_stage("styling"):
+            heatmap_layer.setRenderer(create_heatmap_renderer())
+
+    # the heatmaps are indexed together once all of them are written
+    return save_styled_layers(
+        LOCATION_HEATMAP_GPKG_OUTPUT, list(heatmap_layers.values())
+    )
+
+
+def project_to_web_mercator(
+    longitudes: np.ndarray, latitudes: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Project EPSG:4326 coordinates to EPSG:3857
+
+    Args:
+        longitudes (np.ndarray): longitudes in degrees
+        latitudes (np.ndarray): latitudes in degrees, within +-85
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: x and y in meters
+    """
+    x = WEB_MERCATOR_RADIUS * np.radians(longitudes)
+    y = WEB_MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(latitudes) / 2))
+    return x, y
+
+
+def get_quartic_kernel(radius: int) -> np.ndarray:
+    """Get the quartic kernel QgsHeatmapRenderer uses by default, normalized to sum to 1
+
+    Args:
+        radius (int): kernel radius in pixels
+
+    Returns:
+        np.ndarray: (2 * radius + 1) square kernel
+    """
+    offsets = np.arange(-radius, radius + 1) / max(radius, 1)
+    distances = np.hypot(offsets[:, np.newaxis], offsets[np.newaxis, :])
+    kernel = np.where(distances < 1, (1 - distances**2) ** 2, 0.0)
+    return kernel / kernel.sum()
+
+
+def compute_density_tiles(
+    x: np.ndarray,
+    y: np.ndarray,
+    origin: tuple[float, float],
+    pixel_size: float,
+    raster_size: tuple[int, int],
+    radius: int,
+) -> typing.Iterator[tuple[int, int, np.ndarray]]:
+    """Compute the kernel density of points, one raster tile at a time
+
+    Note:
+        Points are counted per pixel, and the counts of each tile and the tiles around it are convolved with the kernel through an FFT. Only tiles within reach of a point are computed, so empty parts of the country cost nothing.
+
+    Args:
+        x (np.ndarray): x of the points in meters
+        y (np.ndarray): y of the points in meters
+        origin (tuple[float, float]): x and y of the top left corner of the raster
+        pixel_size (float): pixel size in meters
+        raster_size (tuple[int, int]): width and height of the raster in pixels
+        radius (int): kernel radius in pixels, at most HEATMAP_RASTER_TILE_SIZE
+
+    Yields:
+        tuple[int, int, np.ndarray]: column and row offset of a tile, and its float32 density in points per square kilometer
+    """
+    width, height = raster_size
+    tile_size = HEATMAP_RASTER_TILE_SIZE
+    columns = np.floor((x - origin[0]) / pixel_size).astype(np.int64)
+    rows = np.floor((origin[1] - y) / pixel_size).astype(np.int64)
+    inside = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+    pixels, counts = np.unique(
+        rows[inside] * width + columns[inside], return_counts=True
+    )
+    rows, columns = np.divmod(pixels, width)
+
+    # point counts of every tile with a point in it
+    tile_columns = -(-width // tile_size)
+    tile_rows = -(-height // tile_size)
+    tile_keys = (rows // tile_size) * tile_columns + columns // tile_size
+    tile_order = np.argsort(tile_keys, kind="stable")
+    rows, columns, counts, tile_keys = (
+        rows[tile_order],
+        columns[tile_order],
+        counts[tile_order],
+        tile_keys[tile_order],
+    )
+    occupied_keys, tile_starts = np.unique(tile_keys, return_index=True)
+    tile_ends = np.append(tile_starts[1:], len(tile_keys))
+    occupied_tiles = {
+        int(tile_key): (rows[start:end], columns[start:end], counts[start:end])
+        for tile_key, start, end in zip(occupied_keys, tile_starts, tile_ends)
+    }
+
+    # the kernel reaches one tile around the tiles with points
+    target_tiles = set()
+    for tile_key in occupied_tiles:
+        tile_row, tile_column = divmod(tile_key, tile_columns)
+        for row_offset in (-1, 0, 1):
+            for column_offset in (-1, 0, 1):
+                if (
+                    0 <= tile_row + row_offset < tile_rows
+                    and 0 <= tile_column + column_offset < tile_columns
+                ):
+                    target_tiles.add(
+                        (tile_row + row_offset, tile_column + column_offset)
+                    )
+
+    window_size = tile_size + 2 * radius
+    fft_shape = (window_size + 2 * radius, window_size + 2 * radius)
+    kernel_fft = np.fft.rfft2(get_quartic_kernel(radius), fft_shape)
+    pixel_area = (pixel_size / 1000) ** 2
+    for tile_row, tile_column in sorted(target_tiles):
+        window_row = tile_row * tile_size - radius
+        window_column = tile_column * tile_size - radius
+        window = np.zeros((window_size, window_size))
+        for row_offset in (-1, 0, 1):
+            for column_offset in (-1, 0, 1):
+                neighbor = occupied_tiles.get(
+                    (tile_row + row_offset) * tile_columns + tile_column + column_offset
+                )
+                if (
+                    neighbor is None
+                    or not 0 <= tile_column + column_offset < tile_columns
+                ):
+                    continue
+                neighbor_rows = neighbor[0] - window_row
+                neighbor_columns = neighbor[1] - window_column
+                in_window = (
+                    (neighbor_rows >= 0)
+                    & (neighbor_rows < window_size)
+                    & (neighbor_columns >= 0)
+                    & (neighbor_columns < window_size)
+                )
+                # pixels are unique, so plain fancy indexing adds every count
+                window[
+                    neighbor_rows[in_window], neighbor_columns[in_window]
+                ] += neighbor[2][in_window]
+        if not window.any():
+            continue
+
+        density = np.fft.irfft2(np.fft.rfft2(window, fft_shape) * kernel_fft, fft_shape)
+        tile_height = min(tile_size, height - tile_row * tile_size)
+        tile_width = min(tile_size, width - tile_column * tile_size)
+        tile = (
+            density[
+                2 * radius : 2 * radius + tile_height,
+                2 * radius : 2 * radius + tile_width,
+            ]
+            / pixel_area
+        )
+        # FFT round off leaves tiny values where there is no point, which would not be transparent
+        tile[tile < 1e-6 / pixel_area] = 0
+        if tile.any():
+            yield tile_column * tile_size, tile_row * tile_size, tile.astype(np.float32)
+
+
+def write_density_raster(
+    raster_path: Path, x: np.ndarray, y: np.ndarray
+) -> typing.Optional[float]:
+    """Write the kernel density of points to a tiled GeoTIFF, with an overview for every factor of HEATMAP_RASTER_OVERVIEW_FACTORS
+
+    Note:
+        The kernel radius is HEATMAP_RADIUS_MM in screen pixels at every level, so each overview is computed from the points with a wider kernel instead of being averaged from the full resolution. Empty tiles are never written and read as nodata.
+
+    Args:
+        raster_path (Path): GeoTIFF to write, in EPSG:3857
+        x (np.ndarray): x of the points in meters
+        y (np.ndarray): y of the points in meters
+
+    Returns:
+        typing.Optional[float]: largest full resolution density, or None if there are no points
+    """
+    if len(x) == 0:
+        return None
+    radius = round(HEATMAP_RADIUS_MM / SCREEN_PIXEL_SIZE_MM)
+    factors = (1,) + HEATMAP_RASTER_OVERVIEW_FACTORS
+    # every level is aligned on the pixels of the coarsest one, with room for its kernel
+    coarsest_pixel_size = HEATMAP_RASTER_PIXEL_SIZE * factors[-1]
+    margin = radius * coarsest_pixel_size
+    origin_x = (
+        math.floor((x.min() - margin) / coarsest_pixel_size) * coarsest_pixel_size
+    )
+    origin_y = math.ceil((y.max() + margin) / coarsest_pixel_size) * coarsest_pixel_size
+    width = math.ceil((x.max() + margin - origin_x) / coarsest_pixel_size) * factors[-1]
+    height = (
+        math.ceil((origin_y - (y.min() - margin)) / coarsest_pixel_size) * factors[-1]
+    )
+
+    driver = gdal.GetDriverByName("GTiff")
+    if raster_path.exists():
+        driver.Delete(str(raster_path))
+    raster_path.parent.mkdir(parents=True, exist_ok=True)
+    dataset = driver.Create(
+        str(raster_path),
+        width,
+        height,
+        1,
+        gdal.GDT_Float32,
+        [
+            "TILED=YES",
+            f"BLOCKXSIZE={HEATMAP_RASTER_TILE_SIZE}",
+            f"BLOCKYSIZE={HEATMAP_RASTER_TILE_SIZE}",
+            "COMPRESS=DEFLATE",
+            "PREDICTOR=3",
+            "SPARSE_OK=TRUE",
+            "BIGTIFF=IF_SAFER",
+        ],
+    )
+    if dataset is None:
+        logging.error(f"Could not create {raster_path}: {gdal.GetLastErrorMsg()}")
+        return None
+    dataset.SetGeoTransform(
+        (
+            origin_x,
+            HEATMAP_RASTER_PIXEL_SIZE,
+            0,
+            origin_y,
+            0,
+            -HEATMAP_RASTER_PIXEL_SIZE,
+        )
+    )
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(3857)
+    dataset.SetProjection(spatial_reference.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(0)
+    # only lay out the overviews, they are filled below
+    with gdal_config_options({"COMPRESS_OVERVIEW": "DEFLATE"}):
+        dataset.BuildOverviews("NONE", list(HEATMAP_RASTER_OVERVIEW_FACTORS))
+
+    max_density = 0.0
+    for level_index, factor in enumerate(factors):
+        level_band = band if factor == 1 else band.GetOverview(level_index - 1)
+        for column_offset, row_offset, tile in compute_density_tiles(
+            x,
+            y,
+            (origin_x, origin_y),
+            HEATMAP_RASTER_PIXEL_SIZE * factor,
+            (level_band.XSize, level_band.YSize),
+            radius,
+        ):
+            level_band.WriteArray(tile, column_offset, row_offset)
+            if factor == 1:
+                max_density = max(max_density, float(tile.max()))
+    band.FlushCache()
+    # dropping the reference closes the GeoTIFF
+    dataset = None
+    return max_density
+
+
+def create_heatmap_raster_layer(
+    raster_path: Path, layer_name: str, max_density: float
+) -> QgsRasterLayer:
+    """Open a heatmap raster and style it with the heatmap color ramp
+
+    Note:
+        The ramp is stretched to the densities in view every time the map is drawn, like QgsHeatmapRenderer does. The style is saved next to the raster, so it loads with it.
+
+    Args:
+        raster_path (Path): density GeoTIFF
+        layer_name (str): name of the layer
+        max_density (float): largest density, the initial end of the ramp
+
+    Returns:
+        QgsRasterLayer: styled raster layer
+    """
+    raster_layer = QgsRasterLayer(str(raster_path), layer_name)
+    color_ramp_shader = QgsColorRampShader(0.0, max_density)
+    color_ramp_shader.setColorRampType(QgsColorRampShader.Type.Interpolated)
+    color_ramp_shader.setSourceColorRamp(create_heatmap_color_ramp())
+    color_ramp_shader.classifyColorRamp(255)
+    raster_shader = QgsRasterShader()
+    raster_shader.setRasterShaderFunction(color_ramp_shader)
+    renderer = QgsSingleBandPseudoColorRenderer(
+        raster_layer.dataProvider(), 1, raster_shader
+    )
+    min_max_origin = QgsRasterMinMaxOrigin()
+    min_max_origin.setLimits(QgsRasterMinMaxOrigin.Limits.MinMax)
+    min_max_origin.setExtent(QgsRasterMinMaxOrigin.Extent.UpdatedCanvas)
+    min_max_origin.setStatAccuracy(QgsRasterMinMaxOrigin.StatAccuracy.Estimated)
+    renderer.setMinMaxOrigin(min_max_origin)
+    raster_layer.setRenderer(renderer)
+    raster_layer.saveNamedStyle(str(raster_path.with_suffix(".qml")))
+    return raster_layer
+
+
+def create_heatmap_rasters(
+    locations_layer: QgsVectorLayer, attributes: typing.List[str]
+) -> list[QgsRasterLayer]:
+    """Generate heat maps for the given attributes as precomputed density rasters
+
+    Note:
+        Drawing a raster is cheap, while QgsHeatmapRenderer computes the density of every matching point on every pan or zoom. The locations are read once for every heating type. A heating type without any location gets no raster.
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer
+        attributes (typing.List[str]): heating type fields to create a heatmap for
+
+    Returns:
+        list[QgsRasterLayer]: one density raster per attribute with locations
+    """
+    location_fields = locations_layer.fields()
+    # (attribute name, field index) for every heating type field on the locations layer
+    attribute_field_indices = []
+    for attribute_name in attributes:
+        field_index = location_fields.indexFromName(attribute_name)
+        if field_index < 0:
+            logging.error(
+                f"Could not find {attribute_name} field in {locations_layer.name()}"
+            )
+            continue
+        attribute_field_indices.append((attribute_name, field_index))
+
+    request = QgsFeatureRequest().setSubsetOfAttributes(
+        [field_index for _, field_index in attribute_field_indices]
+    )
+    # one coordinate array shared by every heating type, which only keeps a mask of its locations
+    capacity = max(locations_layer.featureCount(), 1)
+    coordinates = np.empty((capacity, 2))
+    heating_flags = np.zeros((capacity, len(attribute_field_indices)), dtype=bool)
+    location_count = 0
+    with measure_stage("heatmap partitioning") as metrics:
+        for feat in locations_layer.getFeatures(request):
+            geometry = feat.geometry()
+            if geometry.isNull():
+                continue
+            if location_count == len(coordinates):
+                # the provider undercounted, grow the arrays
+                coordinates = np.concatenate([coordinates, np.empty_like(coordinates)])
+                heating_flags = np.concatenate(
+                    [heating_flags, np.zeros_like(heating_flags)]
+                )
+            point = geometry.asPoint()
+            coordinates[location_count] = (point.x(), point.y())
+            feat_attributes = feat.attributes()
+            for attribute_index, (_, field_index) in enumerate(attribute_field_indices):
+                heating_flags[location_count, attribute_index] = (
+                    feat_attributes[field_index] is True
+                )
+            location_count += 1
+        metrics["items"] += location_count
+    longitudes = coordinates[:location_count, 0]
+    latitudes = coordinates[:location_count, 1]
+    heating_flags = heating_flags[:location_count]
+    # web mercator is undefined at the poles
+    valid = np.isfinite(longitudes) & (np.abs(latitudes) < 85)
+    x, y = project_to_web_mercator(longitudes[valid], latitudes[valid])
+    heating_flags = heating_flags[valid]
+
+    raster_layers: list[QgsRasterLayer] = []
+    for attribute_index, (attribute_name, _) in enumerate(attribute_field_indices):
+        layer_name = f"Heatmap-{attribute_name}"
+        raster_path = HEATMAP_RASTER_DIRECTORY / f"{layer_name}.tif"
+        heating_type_mask = heating_flags[:, attribute_index]
+        with measure_stage("density rasters") as metrics:
+            max_density = write_density_raster(
+                raster_path, x[heating_type_mask], y[heating_type_mask]
+            )
+            metrics["items"] += int(heating_type_mask.sum())
+        if max_density is None:
+            logging.info(f"No location has {attribute_name}, skipping its heatmap")
+            continue
+        with measure_stage("styling"):
+            raster_layers.append(
+                create_heatmap_raster_layer(raster_path, layer_name, max_density)
+            )
+        logging.info(f"Wrote {raster_path}")
+    return raster_layers
+
+
+def update_locations_layer(
+    all_metros_directory: Path, manifest: dict
+) -> tuple[QgsVectorLayer, list[str], bool]:
+    """Bring the locations GeoPackage layer up to date with the housing csvs, re-ingesting only the csvs that changed
+
+    Note:
+        The manifest records the feature ids written for every csv. Features of changed or removed csvs are deleted and changed or new csvs are appended, along with the other copies of their zip code so listings stay deduplicated. A first run, different csv headers, dedup columns or spatial ordering, or a missing locations layer rebuild everything. Appended features are not spatially ordered until the next full rebuild.
+
+    Args:
+        all_metros_directory (Path): directory holding a folder per metro
+        manifest (dict): build manifest, updated in place
+
+    Returns:
+        tuple[QgsVectorLayer, list[str], bool]: locations layer, heating attributes, whether any location changed
+    """
+    csv_files = find_housing_csv_files(all_metros_directory)
+    (
+        csv_layer,
+        _,
+        csv_headers,
+        csv_attributes,
+    ) = read_housing_data_and_create_temp_location_points_layer(
+        all_metros_directory, csv_files
+    )
+    previous_housing = manifest.get("housing", {})
+    previous_files = previous_housing.get("files", {})
+    current_files = {
+        str(csv_file): fingerprint_file(csv_file, previous_files.get(str(csv_file)))
+        for csv_file in csv_files
+    }
+
+    if (
+        previous_housing.get("headers") != csv_headers
+        or previous_housing.get("dedup_columns") != list(LISTING_DEDUP_COLUMNS)
+        or previous_housing.get("spatial_order", False) != SPATIAL_ORDER_FEATURES
+        or not gpkg_layer_exists(LOCATION_HEATMAP_GPKG_OUTPUT, csv_layer.name())
+    ):
+        logging.info("Rebuilding all locations")
+        row_counts: dict[str, int] = {}
+        row_fids: list[int] = []
+        locations_layer = create_locations_layer_from_csv(
+            iter_housing_csv_rows(csv_files, row_counts, csv_headers),
+            csv_headers,
+            csv_layer,
+            row_fids,
+        )
+        if not layers_written([locations_layer]):
+            # the next run has to rebuild what this one could not write
+            manifest.pop("housing", None)
+            return locations_layer, csv_attributes, True
+        # each csv owns the feature ids of its next row_count rows, which are the next row_count ids unless they were spatially ordered
+        next_row = 0
+        for csv_path, fingerprint in current_files.items():
+            row_count = row_counts.get(csv_path, 0)
+            fingerprint["fids"] = fids_to_ranges(
+                row_fids[next_row : next_row + row_count]
+                if row_fids
+                else range(next_row + 1, next_row + row_count + 1)
+            )
+            next_row += row_count
+        manifest["housing"] = {
+            "headers": csv_headers,
+            "dedup_columns": list(LISTING_DEDUP_COLUMNS),
+            "spatial_order": SPATIAL_ORDER_FEATURES,
+            "files": current_files,
+        }
+        return locations_layer, csv_attributes, True
+
+    removed_files = [
+        csv_path for csv_path in previous_files if csv_path not in current_files
+    ]
+    # listings are deduplicated across the copies of a zip code, so every copy of a changed or removed zip code is re-ingested
+    changed_zip_codes = {Path(csv_path).stem for csv_path in removed_files}
+    for csv_file in csv_files:
+        previous_fingerprint = previous_files.get(str(csv_file), {})
+        if previous_fingerprint.get("sha256") != current_files[str(csv_file)]["sha256"]:
+            changed_zip_codes.add(csv_file.stem)
+    changed_files = []
+    for csv_file in csv_files:
+        if csv_file.stem in changed_zip_codes:
+            changed_files.append(csv_file)
+        else:
+            current_files[str(csv_file)]["fids"] = previous_files[str(csv_file)].get(
+                "fids", []
+            )
+    manifest["housing"] = {
+        "headers": csv_headers,
+        "dedup_columns": list(LISTING_DEDUP_COLUMNS),
+        "spatial_order": SPATIAL_ORDER_FEATURES,
+        "files": current_files,
+    }
+
+    locations_layer_path = (
+        f"{LOCATION_HEATMAP_GPKG_OUTPUT}|layername={csv_layer.name()}"
+    )
+    locations_layer = QgsVectorLayer(locations_layer_path, "Locations", "ogr")
+    if not changed_files and not removed_files:
+        logging.info("Housing data is unchanged, reusing the locations layer")
+        return locations_layer, csv_attributes, False
+
+    provider = locations_layer.dataProvider()
+    update_failed = False
+    stale_fids = set()
+    for csv_path in [str(csv_file) for csv_file in changed_files] + removed_files:
+        for first_fid, last_fid in previous_files.get(csv_path, {}).get("fids", []):
+            stale_fids.update(range(first_fid, last_fid + 1))
+    if stale_fids and not provider.deleteFeatures(list(stale_fids)):
+        logging.error(f"Could not delete stale locations: {provider.lastError()}")
+        update_failed = True
+
+    locations_fields = locations_layer.fields()
+    row_plan = compile_location_row_plan(csv_headers, locations_fields)
+    changed_csvs = iter_unique_housing_csv_files(
+        iter_housing_csv_files(changed_files if row_plan else [], csv_headers),
+        csv_headers,
+    )
+    while True:
+        with measure_stage("csv read") as metrics:
+            csv_file, rows = next(changed_csvs, (None, []))
+            metrics["items"] += len(rows)
+        if csv_file is None:
+            break
+        added_fids = []
+        features = timed_iter(
+            (
+                create_location_feature(row_plan, locations_fields, line)
+                for line in rows
+            ),
+            "feature build",
+        )
+        for feature_batch in chunked(features, LOCATION_FEATURE_BATCH_SIZE):
+            with measure_stage("gpkg write") as metrics:
+                result, added_features = provider.addFeatures(list(feature_batch))
+                metrics["items"] += len(feature_batch)
+            if not result:
+                logging.error(
+                    f"Could not add locations from {csv_file}: {provider.lastError()}"
+                )
+                update_failed = True
+            added_fids.extend(feat.id() for feat in added_features)
+        current_files[str(csv_file)]["fids"] = fids_to_ranges(added_fids)
+    locations_layer.updateExtents()
+    if update_failed:
+        # the recorded feature ids no longer match the layer, so the next run rebuilds it
+        manifest.pop("housing", None)
+
+    logging.info(
+        f"Re-ingested {len(changed_files)} changed housing csvs and removed {len(removed_files)} deleted ones"
+    )
+    return locations_layer, csv_attributes, True
+
+
+def get_locations_signature(manifest: dict) -> str:
+    """Hash of the housing data the locations layer was last built from
+
+    Args:
+        manifest (dict): build manifest
+
+    Returns:
+        str: signature that changes whenever a location is added, changed or removed
+    """
+    housing = manifest.get("housing", {})
+    files = housing.get("files", {})
+    signature_source = {
+        "headers": housing.get("headers"),
+        "files": {
+            csv_path: [fingerprint.get("sha256"), fingerprint.get("fids")]
+            for csv_path, fingerprint in files.items()
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(signature_source, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def build_locations_layer(
+    all_metros_directory: Path, manifest: typing.Optional[dict] = None
+) -> tuple[QgsVectorLayer, list[str]]:
+    """Create the locations layer from the housing csvs
+
+    Args:
+        all_metros_directory (Path): directory holding a folder per metro
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Only changed housing csvs are re-ingested. Defaults to None, which rebuilds everything.
+
+    Returns:
+        tuple[QgsVectorLayer, list[str]]: locations layer and heating attributes
+    """
+    if manifest is not None:
+        locations_layer, csv_attributes, _ = update_locations_layer(
+            all_metros_directory, manifest
+        )
+        return locations_layer, csv_attributes
+
+    (
+        csv_layer,
+        csv_contents,
+        csv_headers,
+        csv_attributes,
+    ) = read_housing_data_and_create_temp_location_points_layer(all_metros_directory)
+    locations_layer = create_locations_layer_from_csv(
+        csv_contents, csv_headers, csv_layer
+    )
+    return locations_layer, csv_attributes
+
+
+def build_heatmap_layers(
+    locations_layer: QgsVectorLayer,
+    csv_attributes: list[str],
+    manifest: typing.Optional[dict] = None,
+    heatmap_views: bool = False,
+    heatmap_rasters: bool = False,
+) -> list[QgsMapLayer]:
+    """Create the heatmap layers of every heating type
+
+    Note:
+        With a manifest, the heatmaps are only rebuilt when the locations changed since they were last built.
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        csv_attributes (list[str]): heating type fields to create a heatmap for
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Defaults to None, which rebuilds everything.
+        heatmap_views (bool, optional): create the heatmaps as filtered views of the locations table. Defaults to False.
+        heatmap_rasters (bool, optional): create the heatmaps as precomputed density rasters. Defaults to False.
+
+    Returns:
+        list[QgsMapLayer]: heatmap layers
+    """
+    if manifest is None:
+        if heatmap_rasters:
+            return create_heatmap_rasters(locations_layer, csv_attributes)
+        return create_heatmap_layers(locations_layer, csv_attributes, heatmap_views)
+
+    locations_signature = get_locations_signature(manifest)
+    previous_heatmaps = manifest.get("heatmaps", {})
+    if heatmap_rasters:
+        heatmap_outputs_exist = all(
+            (HEATMAP_RASTER_DIRECTORY / f"{layer_name}.tif").exists()
+            for layer_name in previous_heatmaps.get("rasters", [])
+        )
+    else:
+        heatmap_outputs_exist = all(
+            gpkg_layer_exists(LOCATION_HEATMAP_GPKG_OUTPUT, f"Heatmap-{attribute}")
+            for attribute in csv_attributes
+        )
+    heatmaps_current = (
+        previous_heatmaps.get("locations") == locations_signature
+        and not heatmap_views
+        and previous_heatmaps.get("as_views") is False
+        and previous_heatmaps.get("as_rasters", False) == heatmap_rasters
+        and previous_heatmaps.get("attributes") == csv_attributes
+        and heatmap_outputs_exist
+    )
+    manifest["heatmaps"] = {
+        "as_views": heatmap_views,
+        "as_rasters": heatmap_rasters,
+        "attributes": csv_attributes,
+        "locations": locations_signature,
+    }
+
+    if heatmap_rasters and heatmaps_current:
+        logging.info("Locations are unchanged, reusing the heatmap rasters")
+        manifest["heatmaps"]["rasters"] = previous_heatmaps["rasters"]
+        # the raster style was saved next to it, so it loads with the layer
+        return [
+            QgsRasterLayer(
+                str(HEATMAP_RASTER_DIRECTORY / f"{layer_name}.tif"), layer_name
+            )
+            for layer_name in previous_heatmaps["rasters"]
+        ]
+    if heatmap_rasters:
+        raster_layers = create_heatmap_rasters(locations_layer, csv_attributes)
+        manifest["heatmaps"]["rasters"] = [layer.name() for layer in raster_layers]
+        return raster_layers
+
+    if not heatmaps_current:
+        # views never copy points, so they are always cheap to create
+        heatmap_layers = create_heatmap_layers(
+            locations_layer, csv_attributes, heatmap_views
+        )
+        if not layers_written(heatmap_layers):
+            del manifest["heatmaps"]
+        return heatmap_layers
+
+    logging.info("Locations are unchanged, reusing the heatmap layers")
+    # the heatmap style was saved as the default style, so it loads with the layer
+    return [
+        QgsVectorLayer(
+            f"{LOCATION_HEATMAP_GPKG_OUTPUT}|layername=Heatmap-{attribute}",
+            f"Heatmap-{attribute}",
+            "ogr",
+        )
+        for attribute in csv_attributes
+    ]
+
+
+def build_location_heatmap_layers(
+    all_metros_directory: Path,
+    manifest: typing.Optional[dict] = None,
+    heatmap_views: bool = False,
+    heatmap_rasters: bool = False,
+) -> tuple[QgsVectorLayer, list[QgsMapLayer]]:
+    """Create the locations layer and the heatmap layers of every heating type
+
+    Note:
+        With a manifest, only changed housing csvs are re-ingested and the heatmaps are only rebuilt when a location changed.
+
+    Args:
+        all_metros_directory (Path): directory holding a folder per metro
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Defaults to None, which rebuilds everything.
+        heatmap_views (bool, optional): create the heatmaps as filtered views of the locations table. Defaults to False.
+        heatmap_rasters (bool, optional): create the heatmaps as precomputed density rasters. Defaults to False.
+
+    Returns:
+        tuple[QgsVectorLayer, list[QgsMapLayer]]: locations layer and heatmap layers
+    """
+    locations_layer, csv_attributes = build_locations_layer(
+        all_metros_directory, manifest
+    )
+    return locations_layer, build_heatmap_layers(
+        locations_layer, csv_attributes, manifest, heatmap_views, heatmap_rasters
+    )
+
+
+class CensusTable(typing.NamedTuple):
+    """A census csv filtered to its allow list and stored as columns
+
+    Note:
+        values is float64 with NaN for NULL or negative (sentinel) cells. It is memory-mapped when the table comes from the cache.
+    """
+
+    # ZCTA of each row, sorted
+    zctas: np.ndarray
+    # census columns, the allow list without ZCTA
+    columns: list[str]
+    # shape (len(zctas), len(columns))
+    values: np.ndarray
+    # row of each normalized ZCTA, -1 for a ZCTA without a row. see build_zcta_index
+    zcta_index: np.ndarray
+
+
+def normalize_zcta(value: typing.Any) -> int:
+    """Convert a ZCTA from a census csv or the base layer to a number, so that "02134", "2134" and 2134 match
+
+    Args:
+        value (typing.Any): ZCTA as a string or number
+
+    Returns:
+        int: the ZCTA, -1 if the value is not a ZCTA
+    """
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return -1
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value != value or not float(value).is_integer():
+            return -1
+        zcta = int(value)
+        return zcta if 0 <= zcta < ZCTA_INDEX_SIZE else -1
+    match = ZCTA_PATTERN.match(str(value).strip())
+    if match is None:
+        return -1
+    return int(match.group(1) or match.group(2))
+
+
+def build_zcta_index(zctas: np.ndarray) -> np.ndarray:
+    """Build a dense ZCTA to row lookup for a census table
+
+    Note:
+        The last row of a repeated ZCTA wins, like it did when the rows were kept in a dict.
+
+    Args:
+        zctas (np.ndarray): ZCTA of each row
+
+    Returns:
+        np.ndarray: int64 array of ZCTA_INDEX_SIZE, the row of each ZCTA or -1
+    """
+    keys = np.array([normalize_zcta(zcta) for zcta in zctas.tolist()], dtype=np.int64)
+    valid_rows = np.flatnonzero(keys >= 0)
+    if len(valid_rows) < len(keys):
+        logging.warning(
+            f"Ignoring {len(keys) - len(valid_rows)} census rows without a valid ZCTA"
+        )
+    valid_keys = keys[valid_rows]
+    # np.unique keeps the first occurrence, so look for it from the end
+    _, last_positions = np.unique(valid_keys[::-1], return_index=True)
+    last_positions = len(valid_keys) - 1 - last_positions
+    zcta_index = np.full(ZCTA_INDEX_SIZE, -1, dtype=np.int64)
+    zcta_index[valid_keys[last_positions]] = valid_rows[last_positions]
+    return zcta_index
+
+
+def parse_census_cell(value: str) -> float:
+    """Convert a census cell to a float, NaN if it is not a number or a negative sentinel"""
+    try:
+        number = float(value)
+    except ValueError:
+        return math.nan
+    return number if number >= 0 else math.nan
+
+
+def parse_census_csv(
+    file_path: Path, census_columns: list[str]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Parse the ZCTA and census columns of a census csv
+
+    Args:
+        file_path (Path): the path to the census data csv
+        census_columns (list[str]): census columns to keep
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: ZCTAs and values, sorted by ZCTA
+    """
+    with open(file_path, encoding="utf-8") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        headers = next(csv_reader)
+        zcta_index = headers.index("ZCTA")
+        column_indices = [headers.index(column) for column in census_columns]
+        zctas = []
+        rows = []
+        for row in csv_reader:
+            zctas.append(row[zcta_index])
+            rows.append([parse_census_cell(row[index]) for index in column_indices])
+
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(census_columns))
+    zcta_array = np.array(zctas, dtype=str)
+    # stable, so the last row of a repeated ZCTA still wins like it did in a dict
+    order = np.argsort(zcta_array, kind="stable")
+    return zcta_array[order], values[order]
+
+
+def save_census_cache(
+    cache_directory: Path,
+    zctas: np.ndarray,
+    values: np.ndarray,
+    meta: dict[str, typing.Any],
+):
+    """Write a parsed census table to its cache directory
+
+    Note:
+        Files are written under a temporary name and moved into place, and meta.json goes last, so a reader never sees a partial cache. Another process holding the cache open makes the move fail, in which case the existing cache is kept.
+    """
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    try:
+        for name, array in (("zcta", zctas), ("values", values)):
+            temporary_path = cache_directory / f"{name}.{os.getpid()}.npy"
+            np.save(temporary_path, array)
+            os.replace(temporary_path, cache_directory / f"{name}.npy")
+        temporary_path = cache_directory / f"meta.{os.getpid()}.json"
+        with open(temporary_path, "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temporary_path, cache_directory / "meta.json")
+    except OSError as e:
+        logging.warning(f"Could not write census cache {cache_directory}: {e}")
+
+
+def load_census_table(file_path: Path, allow_list: list[str]) -> CensusTable:
+    """Load a census table from the columnar cache, parsing the csv and filling the cache if it is missing or stale
+
+    Args:
+        file_path (Path): the path to the census data csv
+        allow_list (list[str]): allow list of the census table type
+
+    Returns:
+        CensusTable: the table
+    """
+    census_columns = [column for column in allow_list if column != "ZCTA"]
+    cache_directory = CENSUS_CACHE_DIRECTORY / file_path.stem
+    meta: dict[str, typing.Any] = {}
+    try:
+        with open(cache_directory / "meta.json", encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        pass
+
+    fingerprint = fingerprint_file(file_path, meta.get("source"))
+    zctas = None
+    if (
+        meta.get("source", {}).get("sha256") == fingerprint["sha256"]
+        and meta.get("columns") == census_columns
+    ):
+        try:
+            zctas = np.load(cache_directory / "zcta.npy")
+            values = np.load(cache_directory / "values.npy", mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read census cache {cache_directory}: {e}")
+            zctas = None
+
+    if zctas is None:
+        logging.info(f"Parsing census table {file_path.stem}")
+        zctas, values = parse_census_csv(file_path, census_columns)
+        save_census_cache(
+            cache_directory,
+            zctas,
+            values,
+            {"source": fingerprint, "columns": census_columns},
+        )
+
+    return CensusTable(
+        zctas=zctas,
+        columns=census_columns,
+        values=values,
+        zcta_index=build_zcta_index(zctas),
+    )
+
+
+def load_filtered_data_from_demo_file(
+    file_path: Path
+) -> tuple[typing.Optional[CensusTable], typing.Optional[int]]:
+    """Filters csv to just be the allowed columns for that census table type
+
+    Note:
+        The table is parsed once and cached in CENSUS_CACHE_DIRECTORY, see load_census_table.
+
+    Args:
+        file_path (Path): the path to the census data csv
+
+    Returns:
+        tuple[typing.Optional[CensusTable], typing.Optional[int]]: the table and how many columns are grouped together, None for both if the table type is not recognized
+    """
+    table_type = get_census_table_type(file_path)
+    if table_type is None:
+        return (None, None)
+    table_allow_list, _ = CENSUS_TABLE_LISTS[table_type]
+    return (
+        load_census_table(file_path, table_allow_list),
+        CENSUS_TABLE_RANGE_TYPES[table_type],
+    )
+
+
+class ZctaGeometries(typing.NamedTuple):
+    """ZCTA5 and geometry of every base layer polygon, in base layer order"""
+
+    # ZCTA5 as stored in the base layer
+    zctas: list
+    # normalize_zcta of each ZCTA5
+    keys: np.ndarray
+    geometries: list[QgsGeometry]
+    # the geometries simplified for each of CENSUS_GEOMETRY_LEVELS
+    level_geometries: list[list[QgsGeometry]]
+
+
+class JoinedCensusTable(typing.NamedTuple):
+    """A census table joined onto the base layer polygons"""
+
+    # census columns, the allow list without ZCTA
+    columns: list[str]
+    # shape (polygons, len(columns)) in base layer order, NaN where a polygon has no census row
+    values: np.ndarray
+
+
+def get_base_layer() -> QgsVectorLayer:
+    """Get a copy of the ZCTA base layer from the project
+
+    Returns:
+        QgsVectorLayer: clone of the base layer
+    """
+    possible_layers = get_project().mapLayersByName(BASE_LAYER_NAME)
+
+    base_layer = None
+    if possible_layers:
+        base_layer = possible_layers[0].clone()
+
+    assert isinstance(base_layer, QgsMapLayer)
+    return base_layer
+
+
+def simplify_geometries(
+    geometries: list[QgsGeometry], tolerance: float
+) -> list[QgsGeometry]:
+    """Simplify polygons without letting their rings cross or collapse
+
+    Args:
+        geometries (list[QgsGeometry]): polygons to simplify
+        tolerance (float): largest distance a vertex may move, in layer units
+
+    Returns:
+        list[QgsGeometry]: simplified polygons, in the same order
+    """
+    simplified_geometries = []
+    for geometry in geometries:
+        if geometry.isNull():
+            simplified_geometries.append(geometry)
+            continue
+        ogr_geometry = ogr.CreateGeometryFromWkb(bytes(geometry.asWkb()))
+        simplified = ogr_geometry.SimplifyPreserveTopology(tolerance)
+        if simplified is None or simplified.IsEmpty():
+            simplified_geometries.append(geometry)
+            continue
+        simplified_geometry = QgsGeometry()
+        simplified_geometry.fromWkb(bytes(simplified.ExportToWkb()))
+        simplified_geometries.append(simplified_geometry)
+    return simplified_geometries
+
+
+def load_base_zcta_geometries(
+    base_layer: QgsVectorLayer, simplify: bool = True
+) -> ZctaGeometries:
+    """Read the ZCTA5 key and geometry of every base layer feature once, and simplify the geometries for every level of CENSUS_GEOMETRY_LEVELS
+
+    Note:
+        QgsGeometry is implicitly shared, so every attribute layer built from this list references the same geometry data instead of holding its own copy.
+
+    Args:
+        base_layer (QgsVectorLayer): base layer
+        simplify (bool, optional): simplify the geometries for CENSUS_GEOMETRY_LEVELS. Defaults to True.
+
+    Returns:
+        ZctaGeometries: (ZCTA5, geometry) for every polygon, in base layer order
+    """
+    zcta5_field_index = base_layer.fields().indexFromName("ZCTA5")
+    request = QgsFeatureRequest().setSubsetOfAttributes([zcta5_field_index])
+    zctas = []
+    geometries = []
+    for feat in base_layer.getFeatures(request):
+        zctas.append(feat.attributes()[zcta5_field_index])
+        geometries.append(feat.geometry())
+    keys = np.array([normalize_zcta(zcta) for zcta in zctas], dtype=np.int64)
+    logging.info(f"Loaded {len(zctas)} ZCTA geometries from {base_layer.name()}")
+    if (keys < 0).any():
+        logging.warning(
+            f"{int((keys < 0).sum())} polygons of {base_layer.name()} do not have a valid ZCTA5"
+        )
+
+    # tolerances are in meters, the base layer may be in degrees
+    unit_scale = 1 / METERS_PER_DEGREE if base_layer.crs().isGeographic() else 1.0
+    level_geometries = []
+    if not simplify:
+        return ZctaGeometries(zctas, keys, geometries, level_geometries)
+    with measure_stage("geometry simplification") as metrics:
+        for _, tolerance, _ in CENSUS_GEOMETRY_LEVELS:
+            level_geometries.append(
+                simplify_geometries(geometries, tolerance * unit_scale)
+            )
+            metrics["items"] += len(geometries)
+    return ZctaGeometries(zctas, keys, geometries, level_geometries)
+
+
+def join_census_table(
+    table_name: str, census_table: CensusTable, base_geometries: ZctaGeometries
+) -> JoinedCensusTable:
+    """Join the rows of a census table onto the base layer polygons, and record how many polygons found a row
+
+    Args:
+        table_name (str): census csv stem, used to report the coverage
+        census_table (CensusTable): census data of the table
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries shared by every census layer
+
+    Returns:
+        JoinedCensusTable: census values of every polygon
+    """
+    keys = base_geometries.keys
+    rows = np.full(len(keys), -1, dtype=np.int64)
+    valid_keys = keys >= 0
+    rows[valid_keys] = census_table.zcta_index[keys[valid_keys]]
+    matched = rows >= 0
+
+    # one gather for the whole table instead of a lookup per feature
+    values = np.full((len(rows), len(census_table.columns)), np.nan)
+    values[matched] = census_table.values[rows[matched]]
+
+    matched_rows = np.zeros(len(census_table.zctas), dtype=bool)
+    matched_rows[rows[matched]] = True
+    missing_zctas = [
+        base_geometries.zctas[index]
+        for index in np.flatnonzero(~matched & valid_keys)[:10]
+    ]
+    coverage = {
+        "polygons": len(rows),
+        "matched": int(matched.sum()),
+        "unmatched": int((~matched).sum()),
+        "invalid_zcta": int((~valid_keys).sum()),
+        "unused_census_rows": int((~matched_rows).sum()),
+        "coverage": float(matched.mean()) if len(rows) else None,
+    }
+    join_coverage[table_name] = coverage
+    logging.info(
+        f"{table_name}: joined census rows onto {coverage['matched']} of {coverage['polygons']} ZCTA polygons"
+    )
+    # theres a lot of zip codes without census data, so only log a few of them
+    if missing_zctas:
+        logging.info(
+            f"{table_name}: {coverage['unmatched']} polygons have no census row, such as {missing_zctas}"
+        )
+    return JoinedCensusTable(census_table.columns, values)
+
+
+def get_census_table_type(file_path: Path) -> typing.Optional[str]:
+    """Get which census table (DP05, S1501, S1901) a csv holds
+
+    Args:
+        file_path (Path): the path to the census data csv
+
+    Returns:
+        typing.Optional[str]: key of CENSUS_TABLE_LISTS, or None for an unrecognized file
+    """
+    for table_type in CENSUS_TABLE_LISTS:
+        if table_type in file_path.stem:
+            return table_type
+    return None
+
+
+# Used to create heatmap layers from csv demographic data
+def create_demographic_layers(
+    file_path: Path,
+    base_layer: QgsVectorLayer,
+    base_geometries: ZctaGeometries,
+    wide_table: bool = False,
+    attributes: typing.Optional[list[str]] = None,
+) -> typing.Union[list[QgsVectorLayer], None]:
+    """Create the styled layers for every attribute of a census table
+
+    Args:
+        file_path (Path): the path to the census data csv
+        base_layer (QgsVectorLayer): base layer, used for its style
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries shared by every census layer
+        wide_table (bool, optional): write the table once and return styled views over it instead of one layer per attribute. Defaults to False.
+        attributes (typing.Optional[list[str]], optional): only create the layers of these table attributes. Defaults to None, which creates all of them.
+
+    Returns:
+        typing.Union[list[QgsVectorLayer], None]: one layer per table attribute, or None for an unrecognized file
+    """
+    census_table, range_type = load_filtered_data_from_demo_file(file_path)
+    table_type = get_census_table_type(file_path)
+    # un recognized table
+    if census_table is None or range_type not in [2, 4] or table_type is None:
+        logging.warning("could not recognize file format.")
+        return None
+    table_allow_list, table_attributes_list = CENSUS_TABLE_LISTS[table_type]
+    with measure_stage("census join"):
+        joined_table = join_census_table(file_path.stem, census_table, base_geometries)
+    # classify every attribute of the table in one go instead of once per layer
+    with measure_stage("styling"):
+        class_breaks = compute_census_class_breaks(joined_table, table_attributes_list)
+
+    if wide_table:
+        return create_styled_demographics_table_views(
+            file_path.stem,
+            base_layer,
+            base_geometries,
+            table_attributes_list,
+            table_allow_list,
+            joined_table,
+            class_breaks,
+        )
+
+    demo_layers: list[QgsVectorLayer] = []
+    for attribute in table_attributes_list:
+        if attributes is not None and attribute not in attributes:
+            continue
+        logging.info(f"Making layer for {attribute =}")
+        demo_layers.extend(
+            create_styled_demographics_group_layers(
+                range_type,
+                base_layer,
+                base_geometries,
+                attribute,
+                table_attributes_list,
+                table_allow_list,
+                joined_table,
+                class_breaks,
+            )
+        )
+    assert len(demo_layers) > 0
+    # the layers of the table are indexed together once all of them are written
+    return save_styled_layers(CENSUS_DATA_GPKG_OUTPUT, demo_layers)
+
+
+def compute_quantile_breaks(values: np.ndarray, classes: int) -> np.ndarray:
+    """Quantile class breaks of every column at once
+
+    Note:
+        Uses the same linear interpolation between sorted values as QGIS. NaN values are ignored.
+
+    Args:
+        values (np.ndarray): shape (rows, columns)
+        classes (int): number of classes
+
+    Returns:
+        np.ndarray: upper bound of each class, shape (classes, columns)
+    """
+    quantiles = np.arange(1, classes + 1) / classes
+    return np.nanquantile(values, quantiles, axis=0)
+
+
+def compute_equal_interval_breaks(values: np.ndarray, classes: int) -> np.ndarray:
+    """Equal interval class breaks of every column at once
+
+    Args:
+        values (np.ndarray): shape (rows, columns)
+        classes (int): number of classes
+
+    Returns:
+        np.ndarray: upper bound of each class, shape (classes, columns)
+    """
+    minimums = np.nanmin(values, axis=0)
+    maximums = np.nanmax(values, axis=0)
+    steps = np.arange(1, classes + 1)[:, None] / classes
+    return minimums + steps * (maximums - minimums)
+
+
+def compute_jenks_breaks(column: np.ndarray, classes: int) -> np.ndarray:
+    """Jenks natural breaks of a single column
+
+    Note:
+        Fisher's dynamic program, vectorized over every (class start, class end) pair using prefix sums.
+
+    Args:
+        column (np.ndarray): column values, NaN values are ignored
+        classes (int): number of classes
+
+    Returns:
+        np.ndarray: upper bound of each class
+    """
+    values = np.sort(column[~np.isnan(column)])
+    if values.size > JENKS_MAX_SAMPLE_SIZE:
+        # keep the minimum and maximum, and sample the values in between
+        sample = np.random.default_rng(0).choice(
+            values[1:-1], JENKS_MAX_SAMPLE_SIZE - 2, replace=False
+        )
+        values = np.sort(np.concatenate(([values[0]], sample, [values[-1]])))
+    value_count = values.size
+    if value_count <= classes:
+        return values
+
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    square_sums = np.concatenate(([0.0], np.cumsum(values**2)))
+    starts = np.arange(value_count)[:, None]
+    ends = np.arange(value_count)[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # squared deviation of values[start:end + 1] around its mean
+        deviations = (square_sums[ends + 1] - square_sums[starts]) - (
+            sums[ends + 1] - sums[starts]
+        ) ** 2 / (ends - starts + 1)
+    deviations = np.where(starts <= ends, deviations, np.inf)
+
+    # cost[end]: smallest deviation of values[:end + 1] split into the classes so far
+    cost = deviations[0]
+    class_starts = np.zeros((classes, value_count), dtype=np.int64)
+    for class_index in range(1, classes):
+        previous_cost = np.concatenate(([np.inf], cost[:-1]))
+        candidates = previous_cost[:, None] + deviations
+        class_starts[class_index] = np.argmin(candidates, axis=0)
+        cost = candidates[class_starts[class_index], np.arange(value_count)]
+
+    breaks = [values[-1]]
+    end = value_count - 1
+    for class_index in range(classes - 1, 0, -1):
+        start = class_starts[class_index, end]
+        breaks.append(values[start - 1])
+        end = start - 1
+    return np.array(breaks[::-1])
+
+
+def compute_class_breaks(
+    values: np.ndarray, mode: str, classes: int
+) -> list[typing.Optional[np.ndarray]]:
+    """Class breaks of every column of a census table
+
+    Args:
+        values (np.ndarray): shape (rows, columns), NaN for NULL
+        mode (str): "quantile", "jenks" or "equal_interval"
+        classes (int): number of classes
+
+    Returns:
+        list[typing.Optional[np.ndarray]]: upper bound of each class per column, None for a column without values
+    """
+    has_values = ~np.isnan(values).all(axis=0)
+    column_breaks: list[typing.Optional[np.ndarray]] = [None] * values.shape[1]
+    if not has_values.any():
+        return column_breaks
+
+    if mode == "jenks":
+        for column_index in np.flatnonzero(has_values):
+            column_breaks[column_index] = compute_jenks_breaks(
+                values[:, column_index], classes
+            )
+        return column_breaks
+
+    if mode == "equal_interval":
+        breaks = compute_equal_interval_breaks(values[:, has_values], classes)
+    else:
+        breaks = compute_quantile_breaks(values[:, has_values], classes)
+    for breaks_index, column_index in enumerate(np.flatnonzero(has_values)):
+        column_breaks[column_index] = breaks[:, breaks_index]
+    return column_breaks
+
+
+def compute_census_class_breaks(
+    joined_table: JoinedCensusTable, table_attributes_list: list[str]
+) -> dict[str, typing.Optional[np.ndarray]]:
+    """Class breaks of every attribute of a census table, over the values the ZCTA polygons will show
+
+    Args:
+        joined_table (JoinedCensusTable): census data joined onto the ZCTA polygons
+        table_attributes_list (list[str]): attributes that get a layer
+
+    Returns:
+        dict[str, typing.Optional[np.ndarray]]: upper bound of each class by attribute
+    """
+    column_indices = [
+        joined_table.columns.index(attribute) for attribute in table_attributes_list
+    ]
+    joined_values = joined_table.values[:, column_indices]
+    column_breaks = compute_class_breaks(
+        joined_values, CENSUS_CLASSIFICATION_MODE, CENSUS_CLASS_COUNT
+    )
+    return dict(zip(table_attributes_list, column_breaks))
+
+
+_census_color_ramp: typing.Optional[QgsColorRamp] = None
+
+
+def get_census_color_ramp() -> QgsColorRamp:
+    """Get the Blues color ramp of the default style, loading it only once"""
+    global _census_color_ramp
+    if _census_color_ramp is None:
+        # might help: https://gis.stackexchange.com/a/342412/234305
+        _census_color_ramp = QgsStyle.defaultStyle().colorRamp("Blues")
+    return _census_color_ramp
+
+
+def create_graduated_renderer(
+    field_name: str, class_breaks: typing.Optional[np.ndarray]
+) -> QgsGraduatedSymbolRenderer:
+    """Create the renderer used to color a census column from precomputed class breaks
+
+    Args:
+        field_name (str): census column to color with
+        class_breaks (typing.Optional[np.ndarray]): upper bound of each class, None for a column without values
+
+    Returns:
+        QgsGraduatedSymbolRenderer: renderer for the column
+    """
+    classification_method = {
+        "jenks": QgsClassificationJenks,
+        "equal_interval": QgsClassificationEqualInterval,
+    }.get(CENSUS_CLASSIFICATION_MODE, QgsClassificationQuantile)()
+    color_ramp = get_census_color_ramp()
+    source_symbol = QgsFillSymbol.createSimple({"color": "#000dfe"})
+
+    ranges = []
+    if class_breaks is not None:
+        upper_values = class_breaks.tolist()
+        # the first class starts at 0
+        lower_values = [0.0] + upper_values[:-1]
+        for index, (lower_value, upper_value) in enumerate(
+            zip(lower_values, upper_values)
+        ):
+            symbol = source_symbol.clone()
+            symbol.setColor(
+                color_ramp.color(index / (len(upper_values) - 1))
+                if len(upper_values) > 1
+                else color_ramp.color(0)
+            )
+            ranges.append(
+                QgsRendererRange(
+                    lower_value,
+                    upper_value,
+                    symbol,
+                    classification_method.labelForRange(lower_value, upper_value),
+                )
+            )
+
+    renderer = QgsGraduatedSymbolRenderer(field_name, ranges)
+    renderer.setClassificationMethod(classification_method)
+    renderer.setSourceSymbol(source_symbol)
+    renderer.setSourceColorRamp(color_ramp.clone())
+    return renderer
+
+
+def get_styled_demo_layer(
+    table_attributes: list,
+    demo_layer: QgsVectorLayer,
+    class_breaks: dict[str, typing.Optional[np.ndarray]],
+) -> QgsVectorLayer:
+    with measure_stage("styling"):
+        for field_name in demo_layer.fields().names():
+            if field_name not in table_attributes:
+                continue
+            demo_layer.setRenderer(
+                create_graduated_renderer(field_name, class_breaks.get(field_name))
+            )
+
+    return demo_layer
+
+
+def chunked(it, size):
+    it = iter(it)
+    while True:
+        p = tuple(itertools.islice(it, size))
+        if not p:
+            break
+        yield p
+
+
+def get_census_level_layer_name(layer_name: str, level_name: str) -> str:
+    """Get the name of the simplified copy of a census layer"""
+    return f"{layer_name} ({level_name})"
+
+
+def split_census_level_layer_name(layer_name: str) -> tuple[str, typing.Optional[str]]:
+    """Split the name of a census layer into the name of its full layer and its level
+
+    Args:
+        layer_name (str): census layer name
+
+    Returns:
+        tuple[str, typing.Optional[str]]: name of the full layer, and the name of the level or None for a full layer
+    """
+    for level_name, _, _ in CENSUS_GEOMETRY_LEVELS:
+        suffix = f" ({level_name})"
+        if layer_name.endswith(suffix):
+            return layer_name[: -len(suffix)], level_name
+    return layer_name, None
+
+
+def set_census_level_scale_range(layer: QgsVectorLayer, level_index: int):
+    """Only draw a census layer at the scales of its geometry level
+
+    Args:
+        layer (QgsVectorLayer): census layer
+        level_index (int): 0 for the full polygons, otherwise 1 + the index in CENSUS_GEOMETRY_LEVELS
+    """
+    level_scales = [scale for _, _, scale in CENSUS_GEOMETRY_LEVELS]
+    if not level_scales:
+        return
+    layer.setScaleBasedVisibility(True)
+    # the minimum scale is the most zoomed out one, 0 has no limit
+    layer.setMaximumScale(level_scales[level_index - 1] if level_index > 0 else 0)
+    layer.setMinimumScale(
+        level_scales[level_index] if level_index < len(level_scales) else 0
+    )
+
+
+def create_census_memory_layer(
+    layer_name: str,
+    base_layer: QgsVectorLayer,
+    base_geometries: ZctaGeometries,
+    census_columns: list[str],
+    joined_table: JoinedCensusTable,
+    level_index: int = 0,
+) -> QgsVectorLayer:
+    """Create a memory layer of the ZCTA polygons with the given census columns
+
+    Note:
+        The columns are selected from the joined table with one index vector, and features are pushed to the provider in batches of DEMOGRAPHIC_FEATURE_BATCH_SIZE.
+
+    Args:
+        layer_name (str): name of the new layer
+        base_layer (QgsVectorLayer): base layer, used for its crs and style
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries shared by every census layer
+        census_columns (list[str]): census columns to add as Double fields
+        joined_table (JoinedCensusTable): census data joined onto the ZCTA polygons
+        level_index (int, optional): 0 for the full polygons, otherwise 1 + the index in CENSUS_GEOMETRY_LEVELS of the simplified polygons to use. Defaults to 0.
+
+    Returns:
+        QgsVectorLayer: the populated layer
+    """
+    # the geometries, simplified or not, are still in the crs of the base layer
+    demo_layer = QgsVectorLayer(
+        f"MultiPolygon?crs={base_layer.crs().authid()}", layer_name, "memory"
+    )
+    demo_prov = demo_layer.dataProvider()
+
+    # add all fields in one go. everyone has at least NULL for the value of a census column
+    demo_prov.addAttributes(
+        [QgsField("ZCTA5", QVariant.Type.String)]
+        + [QgsField(column, QVariant.Type.Double) for column in census_columns]
+    )
+    demo_layer.updateFields()
+    demo_layer.loadNamedStyle(base_layer.styleURI())
+    demo_layer.styleManager().copyStylesFrom(base_layer.styleManager())
+
+    demo_fields = demo_layer.fields()
+    column_indices = [joined_table.columns.index(column) for column in census_columns]
+    geometries = (
+        base_geometries.level_geometries[level_index - 1]
+        if level_index > 0
+        else base_geometries.geometries
+    )
+
+    def joined_features() -> typing.Iterator[QgsFeature]:
+        layer_values = joined_table.values[:, column_indices].tolist()
+        for target_zip_code, geometry, census_values in zip(
+            base_geometries.zctas, geometries, layer_values
+        ):
+            new_zcta5_feature = QgsFeature(demo_fields)
+            new_zcta5_feature.setGeometry(geometry)
+            # missing rows and erroneous census values are NaN, which becomes NULL
+            new_zcta5_feature.setAttributes(
+                [target_zip_code]
+                + [None if math.isnan(value) else value for value in census_values]
+            )
+            yield new_zcta5_feature
+
+    start_time = time.perf_counter()
+    feature_count = 0
+    with measure_stage("census join") as metrics:
+        for feature_batch in chunked(joined_features(), DEMOGRAPHIC_FEATURE_BATCH_SIZE):
+            result, _ = demo_prov.addFeatures(list(feature_batch))
+            if not result:
+                logging.error(
+                    f"Could not add features to {demo_layer.name()}: {demo_prov.lastError()}"
+                )
+            feature_count += len(feature_batch)
+        metrics["items"] += feature_count
+    elapsed_time = time.perf_counter() - start_time
+    logging.info(
+        f"Built {feature_count} features for {layer_name} in {elapsed_time:.2f}s "
+        f"({feature_count / max(elapsed_time, 1e-9):.0f} features/s)"
+    )
+
+    demo_layer.updateExtents()
+    set_census_level_scale_range(demo_layer, level_index)
+    return demo_layer
+
+
+# Creates heatmap layers for csvs that are grouped in twos
+def create_styled_demographics_group_layers(
+    range_type: int,
+    base_layer: QgsVectorLayer,
+    base_geometries: ZctaGeometries,
+    attr_name: str,
+    table_attributes_list: list,
+    table_allow_list: list,
+    joined_table: JoinedCensusTable,
+    class_breaks: dict[str, typing.Optional[np.ndarray]],
+) -> list[QgsVectorLayer]:
+    """create layer based on census column, and a copy of it for every level of CENSUS_GEOMETRY_LEVELS
+
+
+    Note:
+        Features are rows in a layer, fields are columns in a layer. attributes are cells.
+        Each layer is only drawn at the scales of its geometry level, so zoomed out maps draw the simplified polygons.
+
+    Args:
+        base_layer (QgsVectorLayer): base layer, used for its style
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries shared by every census layer
+        attr_name (str): census column name you would like a layer created for
+        joined_table (JoinedCensusTable): census data joined onto the ZCTA polygons. should be about 33k zip codes long, with about 40 columns
+        class_breaks (dict[str, typing.Optional[np.ndarray]]): class breaks of the table attributes
+
+    Returns:
+        list[QgsVectorLayer]: the layer of the attribute, followed by its simplified copies
+    """
+    # find the table grouping ie (PCT PME; EST, MOE, PCT, PME) that contains the target census table column
+    desired_census_columns = []
+    for attr_chunk in chunked(table_allow_list, range_type):
+        if len(attr_chunk) != range_type:
+            break
+        if attr_name not in attr_chunk:
+            continue
+        desired_census_columns.extend(attr_chunk)
+        break
+
+    demo_layers = []
+    level_names = [None] + [level_name for level_name, _, _ in CENSUS_GEOMETRY_LEVELS]
+    for level_index, level_name in enumerate(level_names):
+        demo_layer = create_census_memory_layer(
+            (
+                get_census_level_layer_name(attr_name, level_name)
+                if level_name
+                else attr_name
+            ),
+            base_layer,
+            base_geometries,
+            desired_census_columns,
+            joined_table,
+            level_index,
+        )
+        # style
+        demo_layers.append(
+            get_styled_demo_layer(table_attributes_list, demo_layer, class_breaks)
+        )
+    return demo_layers
+
+
+def create_styled_demographics_table_views(
+    table_name: str,
+    base_layer: QgsVectorLayer,
+    base_geometries: ZctaGeometries,
+    table_attributes_list: list,
+    table_allow_list: list,
+    joined_table: JoinedCensusTable,
+    class_breaks: dict[str, typing.Optional[np.ndarray]],
+) -> list[QgsVectorLayer]:
+    """Write a census table once as a wide layer and create a styled view over it for each attribute
+
+    Note:
+        Every view reads the same GeoPackage table, so the ZCTA polygons are only stored once per census table. The style of each view is saved to the GeoPackage under the view name. The table is also written with the simplified polygons of every level of CENSUS_GEOMETRY_LEVELS, each with its own views that are drawn at the scales of the level.
+
+    Args:
+        table_name (str): name of the GeoPackage table, the census csv stem
+        base_layer (QgsVectorLayer): base layer, used for its style
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries shared by every census layer
+        table_attributes_list (list): census columns to create a view for
+        table_allow_list (list): census columns to store in the table
+        joined_table (JoinedCensusTable): census data joined onto the ZCTA polygons
+        class_breaks (dict[str, typing.Optional[np.ndarray]]): class breaks of the table attributes
+
+    Returns:
+        list[QgsVectorLayer]: one styled view per table attribute, each followed by its views of the simplified tables
+    """
+    census_columns = [column for column in table_allow_list if column != "ZCTA"]
+    level_names = [None] + [level_name for level_name, _, _ in CENSUS_GEOMETRY_LEVELS]
+    table_layers = [
+        create_census_memory_layer(
+            (
+                get_census_level_layer_name(table_name, level_name)
+                if level_name
+                else table_name
+            ),
+            base_layer,
+            base_geometries,
+            census_columns,
+            joined_table,
+            level_index,
+        )
+        for level_index, level_name in enumerate(level_names)
+    ]
+    errors = save_layers_to_gpkg(CENSUS_DATA_GPKG_OUTPUT, table_layers)
+    for table_layer, error in zip(table_layers, errors):
+        if error[0] != QgsVectorFileWriter.WriterError.NoError:
+            logging.error(
+                f"Encountered error {error} when writing {table_layer.name()}"
+            )
+            return [table_layer]
+
+    demo_layers: list[QgsVectorLayer] = []
+    for attribute in table_attributes_list:
+        logging.info(f"Making view for {attribute =}")
+        with measure_stage("styling"):
+            for level_index, (level_name, table_layer) in enumerate(
+                zip(level_names, table_layers)
+            ):
+                view_name = (
+                    get_census_level_layer_name(attribute, level_name)
+                    if level_name
+                    else attribute
+                )
+                view_layer = QgsVectorLayer(
+                    f"{CENSUS_DATA_GPKG_OUTPUT}|layername={table_layer.name()}",
+                    view_name,
+                    "ogr",
+                )
+                view_layer.setRenderer(
+                    create_graduated_renderer(attribute, class_breaks.get(attribute))
+                )
+                set_census_level_scale_range(view_layer, level_index)
+                # the first attribute's style is what the table opens with outside of this project
+                view_layer.saveStyleToDatabase(
+                    view_name,
+                    f"{view_name} style",
+                    attribute == table_attributes_list[0],
+                    "",
+                )
+                demo_layers.append(view_layer)
+    assert len(demo_layers) > 0
+    return demo_layers
+
+
+def load_style_from_database(layer: QgsVectorLayer, style_name: str) -> bool:
+    """Apply a style saved in the layer's GeoPackage by name
+
+    Args:
+        layer (QgsVectorLayer): GeoPackage layer
+        style_name (str): name the style was saved under
+
+    Returns:
+        bool: whether the style was found and applied
+    """
+    _, style_ids, style_names, _, _ = layer.listStylesInDatabase()
+    if style_name not in style_names:
+        return False
+    style_xml, _ = layer.getStyleFromDatabase(style_ids[style_names.index(style_name)])
+    doc = QDomDocument()
+    if not doc.setContent(style_xml):
+        return False
+    return layer.importNamedStyle(doc)[0]
+
+
+def load_demographic_layers(
+    table_name: str, layer_names: list[str], wide_table: bool
+) -> typing.Optional[list[QgsVectorLayer]]:
+    """Load the layers a previous build wrote for a census table
+
+    Args:
+        table_name (str): census csv stem
+        layer_names (list[str]): names of the layers written for the table
+        wide_table (bool): whether the table was written as a wide table with styled views
+
+    Returns:
+        typing.Optional[list[QgsVectorLayer]]: the layers, or None if any of them is missing
+    """
+    if not layer_names:
+        return None
+
+    if wide_table:
+        if not gpkg_layer_exists(CENSUS_DATA_GPKG_OUTPUT, table_name):
+            return None
+        view_layers = []
+        for view_name in layer_names:
+            # views of a simplified level read the simplified table
+            _, level_name = split_census_level_layer_name(view_name)
+            view_table_name = (
+                get_census_level_layer_name(table_name, level_name)
+                if level_name
+                else table_name
+            )
+            view_layer = QgsVectorLayer(
+                f"{CENSUS_DATA_GPKG_OUTPUT}|layername={view_table_name}",
+                view_name,
+                "ogr",
+            )
+            if not load_style_from_database(view_layer, view_name):
+                return None
+            view_layers.append(view_layer)
+        return view_layers
+
+    demo_layers = [
+        QgsVectorLayer(
+            f"{CENSUS_DATA_GPKG_OUTPUT}|layername={layer_name}", layer_name, "ogr"
+        )
+        for layer_name in layer_names
+    ]
+    if not all(demo_layer.isValid() for demo_layer in demo_layers):
+        return None
+    return demo_layers
+
+
+# Used to map a value from one scale to another scale
+def translate(value, fromMin, fromMax, toMin, toMax):
+    fromSpan = fromMax - fromMin
+    toSpan = toMax - toMin
+    valueScaled = float(value - fromMin) / float(fromSpan)
+    return toMin + (valueScaled * toSpan)
+
+
+def get_process_pool_context() -> multiprocessing.context.BaseContext:
+    """Get the multiprocessing context used for census workers
+
+    Note:
+        Inside the QGIS application sys.executable is QGIS itself, so workers are pointed at the bundled python instead.
+
+    Returns:
+        multiprocessing.context.BaseContext: spawn context
+    """
+    context = multiprocessing.get_context("spawn")
+    if Path(sys.executable).stem.lower().startswith("qgis"):
+        if os.name == "nt":
+            python_executable = Path(sys.exec_prefix) / "python.exe"
+        else:
+            python_executable = Path(sys.exec_prefix) / "bin" / "python3"
+        context.set_executable(str(python_executable))
+    return context
+
+
+# ZCTA geometries a census worker process loaded, by base layer source
+worker_base_geometries: dict[str, ZctaGeometries] = {}
+
+
+def build_census_staging_layers(
+    file_path: str,
+    attributes: typing.Optional[list[str]],
+    wide_table: bool,
+    base_layer_source: str,
+    base_layer_provider: str,
+    staging_gpkg: str,
+    census_cache_directory: str,
+    geometry_levels: tuple[tuple[str, float, int], ...] = (),
+    spatial_order: bool = False,
+) -> tuple[list[tuple[str, str, str]], dict[str, dict], dict[str, dict]]:
+    """Worker process entry point: build census layers into a staging GeoPackage
+
+    Note:
+        Runs in its own process and starts its own QgsApplication, so the base layer is opened from its source instead of the project, and CENSUS_DATA_GPKG_OUTPUT is pointed at the staging GeoPackage for this process only. The census cache directory, geometry levels and spatial ordering of the parent are passed along, since the worker does not see changes the parent made to them.
+
+    Args:
+        file_path (str): the path to the census data csv
+        attributes (typing.Optional[list[str]]): table attributes to build, None for all of them
+        wide_table (bool): write the table once and style views over it
+        base_layer_source (str): data source of the ZCTA base layer
+        base_layer_provider (str): provider of the ZCTA base layer
+        staging_gpkg (str): GeoPackage to write the layers to
+        census_cache_directory (str): CENSUS_CACHE_DIRECTORY of the parent process
+        geometry_levels (tuple[tuple[str, float, int], ...], optional): CENSUS_GEOMETRY_LEVELS of the parent process. Defaults to ().
+        spatial_order (bool, optional): SPATIAL_ORDER_FEATURES of the parent process. Defaults to False.
+
+    Returns:
+        tuple[list[tuple[str, str, str]], dict[str, dict], dict[str, dict]]: (GeoPackage table, layer name, style xml) of every layer built, and the stage metrics and join coverage of the job
+    """
+    global CENSUS_DATA_GPKG_OUTPUT, CENSUS_CACHE_DIRECTORY, CENSUS_GEOMETRY_LEVELS, SPATIAL_ORDER_FEATURES
+    CENSUS_DATA_GPKG_OUTPUT = Path(staging_gpkg)
+    CENSUS_CACHE_DIRECTORY = Path(census_cache_directory)
+    CENSUS_GEOMETRY_LEVELS = geometry_levels
+    SPATIAL_ORDER_FEATURES = spatial_order
+    configure_logging()
+    init_qgis()
+    # a worker runs many jobs, so only report what this one measured
+    reset_stage_metrics()
+
+    base_layer = QgsVectorLayer(base_layer_source, BASE_LAYER_NAME, base_layer_provider)
+    # the geometries are simplified once per worker, not once per job
+    if base_layer_source not in worker_base_geometries:
+        worker_base_geometries[base_layer_source] = load_base_zcta_geometries(
+            base_layer
+        )
+    base_geometries = worker_base_geometries[base_layer_source]
+    demo_layers = create_demographic_layers(
+        Path(file_path), base_layer, base_geometries, wide_table, attributes
+    )
+    if demo_layers is None:
+        return [], stage_metrics, join_coverage
+
+    staged_layers = []
+    read_write_context = QgsReadWriteContext()
+    for demo_layer in demo_layers:
+        doc = QDomDocument()
+        demo_layer.exportNamedStyle(doc, read_write_context)
+        gpkg_layer_name = demo_layer.name()
+        if wide_table:
+            _, level_name = split_census_level_layer_name(demo_layer.name())
+            gpkg_layer_name = (
+                get_census_level_layer_name(Path(file_path).stem, level_name)
+                if level_name
+                else Path(file_path).stem
+            )
+        staged_layers.append((gpkg_layer_name, demo_layer.name(), doc.toString()))
+    return staged_layers, stage_metrics, join_coverage
+
+
+def merge_census_staging_layers(
+    staged_jobs: list[tuple[Path, list[tuple[str, str, str]]]]
+) -> list[list[QgsVectorLayer]]:
+    """Copy the layers the workers staged into the census GeoPackage and restore their styles
+
+    Note:
+        Tables are copied with OGR CopyLayer, each in one transaction, so features are never converted to QGIS features and back. A table that fails to copy is rolled back and removed. The styles are saved after the GeoPackage is closed.
+
+    Args:
+        staged_jobs (list[tuple[Path, list[tuple[str, str, str]]]]): GeoPackage each worker wrote to, and the (GeoPackage table, layer name, style xml) it returned
+
+    Returns:
+        list[list[QgsVectorLayer]]: the merged layers of each job, read from the census GeoPackage
+    """
+    copied_tables = set()
+    with measure_stage("gpkg write") as metrics, gdal_config_options(
+        GPKG_WRITE_CONFIG_OPTIONS
+    ):
+        if CENSUS_DATA_GPKG_OUTPUT.exists():
+            census_dataset = ogr.Open(str(CENSUS_DATA_GPKG_OUTPUT), 1)
+        else:
+            CENSUS_DATA_GPKG_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
+            census_dataset = ogr.GetDriverByName("GPKG").CreateDataSource(
+                str(CENSUS_DATA_GPKG_OUTPUT)
+            )
+        if census_dataset is None:
+            logging.error(
+                f"Could not open {CENSUS_DATA_GPKG_OUTPUT} for writing: {gdal.GetLastErrorMsg()}"
+            )
+            return [[] for _ in staged_jobs]
+
+        for staging_gpkg, staged_layers in staged_jobs:
+            staging_dataset = ogr.Open(str(staging_gpkg))
+            if staging_dataset is None:
+                if staged_layers:
+                    logging.error(f"Could not open {staging_gpkg}")
+                continue
+            for gpkg_layer_name, _, _ in staged_layers:
+                if gpkg_layer_name in copied_tables:
+                    continue
+                staged_layer = staging_dataset.GetLayerByName(gpkg_layer_name)
+                if staged_layer is None:
+                    logging.error(f"{staging_gpkg} has no {gpkg_layer_name} layer")
+                    continue
+                census_dataset.StartTransaction()
+                merged_layer = census_dataset.CopyLayer(
+                    staged_layer,
+                    gpkg_layer_name,
+                    ["OVERWRITE=YES", "FID=fid", "GEOMETRY_NAME=geom"],
+                )
+                if merged_layer is None:
+                    logging.error(
+                        f"Could not merge {gpkg_layer_name}: {gdal.GetLastErrorMsg()}"
+                    )
+                    census_dataset.RollbackTransaction()
+                    continue
+                census_dataset.CommitTransaction()
+                metrics["items"] += merged_layer.GetFeatureCount()
+                copied_tables.add(gpkg_layer_name)
+            # dropping the reference closes the staging GeoPackage
+            staging_dataset = None
+        census_dataset = None
+
+    for gpkg_layer_name in {
+        gpkg_layer_name
+        for _, staged_layers in staged_jobs
+        for gpkg_layer_name, _, _ in staged_layers
+    } - copied_tables:
+        # a failed copy may have replaced the previous table before it was rolled back
+        GeoPackageWriter(CENSUS_DATA_GPKG_OUTPUT).discard_layer(gpkg_layer_name)
+
+    merged_jobs: list[list[QgsVectorLayer]] = []
+    default_styled_tables = set()
+    for _, staged_layers in staged_jobs:
+        merged_layers: list[QgsVectorLayer] = []
+        for gpkg_layer_name, layer_name, style_xml in staged_layers:
+            if gpkg_layer_name not in copied_tables:
+                continue
+            merged_layer = QgsVectorLayer(
+                f"{CENSUS_DATA_GPKG_OUTPUT}|layername={gpkg_layer_name}",
+                layer_name,
+                "ogr",
+            )
+            doc = QDomDocument()
+            doc.setContent(style_xml)
+            merged_layer.importNamedStyle(doc)
+            # views share a table, so only the first one becomes its default style
+            merged_layer.saveStyleToDatabase(
+                layer_name,
+                f"{layer_name} style",
+                gpkg_layer_name not in default_styled_tables,
+                "",
+            )
+            default_styled_tables.add(gpkg_layer_name)
+            merged_layers.append(merged_layer)
+        merged_jobs.append(merged_layers)
+    return merged_jobs
+
+
+def build_demographic_layers_in_parallel(
+    file_paths: list[Path], wide_tables: bool, processes: int
+) -> dict[Path, typing.Optional[list[QgsVectorLayer]]]:
+    """Build census layers in worker processes and merge them into the census GeoPackage
+
+    Note:
+        Wide tables are one job per table. Otherwise every table attribute is its own job. Each job writes to its own staging GeoPackage because SQLite only allows one writer per file.
+
+    Args:
+        file_paths (list[Path]): census csvs to build
+        wide_tables (bool): store each census table once and style views over it
+        processes (int): number of worker processes
+
+    Returns:
+        dict[Path, typing.Optional[list[QgsVectorLayer]]]: layers of each census csv, None for an unrecognized file
+    """
+    base_layer = get_base_layer()
+    CENSUS_STAGING_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    # fill the census caches first so the workers of a table only ever read them
+    for file_path in file_paths:
+        load_filtered_data_from_demo_file(file_path)
+
+    jobs: list[tuple[Path, typing.Optional[list[str]], Path]] = []
+    for file_path in file_paths:
+        table_type = get_census_table_type(file_path)
+        if table_type is None or wide_tables:
+            job_attributes = [None]
+        else:
+            job_attributes = [
+                [attribute] for attribute in CENSUS_TABLE_LISTS[table_type][1]
+            ]
+        for job_index, attributes in enumerate(job_attributes):
+            staging_gpkg = (
+                CENSUS_STAGING_DIRECTORY / f"{file_path.stem}-{job_index}.gpkg"
+            )
+            if staging_gpkg.exists():
+                staging_gpkg.unlink()
+            jobs.append((file_path, attributes, staging_gpkg))
+
+    logging.info(f"Building {len(jobs)} census jobs in {processes} processes")
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=get_process_pool_context()
+    ) as executor:
+        futures = [
+            executor.submit(
+                build_census_staging_layers,
+                str(file_path),
+                attributes,
+                wide_tables,
+                base_layer.source(),
+                base_layer.providerType(),
+                str(staging_gpkg),
+                str(CENSUS_CACHE_DIRECTORY),
+                CENSUS_GEOMETRY_LEVELS,
+                SPATIAL_ORDER_FEATURES,
+            )
+            for file_path, attributes, staging_gpkg in jobs
+        ]
+        staged_jobs = []
+        for (_, _, staging_gpkg), future in zip(jobs, futures):
+            staged_layers, job_stage_metrics, job_join_coverage = future.result()
+            merge_stage_metrics(job_stage_metrics)
+            join_coverage.update(job_join_coverage)
+            staged_jobs.append((staging_gpkg, staged_layers))
+
+    # merging in submission order keeps the layers in table attribute order
+    merged_jobs = merge_census_staging_layers(staged_jobs)
+    built_layers: dict[Path, typing.Optional[list[QgsVectorLayer]]] = {}
+    for (file_path, _, _), (_, staged_layers), merged_layers in zip(
+        jobs, staged_jobs, merged_jobs
+    ):
+        if not staged_layers:
+            built_layers.setdefault(file_path, None)
+            continue
+        built_layers[file_path] = (built_layers.get(file_path) or []) + merged_layers
+
+    shutil.rmtree(CENSUS_STAGING_DIRECTORY, ignore_errors=True)
+    return built_layers
+
+
+def get_census_gpkg_tables(table_name: str, table_manifest: dict) -> set[str]:
+    """Get the GeoPackage tables a census csv was written to, from its manifest entry
+
+    Args:
+        table_name (str): census csv stem
+        table_manifest (dict): manifest entry of the csv
+
+    Returns:
+        set[str]: tables of the csv in the census GeoPackage
+    """
+    if not table_manifest.get("wide_table"):
+        return set(table_manifest.get("layers", []))
+    return {table_name} | {
+        get_census_level_layer_name(table_name, level_name)
+        for level_name, _, _ in table_manifest.get("geometry_levels", [])
+    }
+
+
+def get_stale_census_tables(previous_census: dict, census: dict) -> set[str]:
+    """Get the census GeoPackage tables an earlier build recorded that the new manifest no longer has
+
+    Note:
+        Only tables of the previous manifest are stale, so tables the build never recorded, like ones added by hand, are kept.
+
+    Args:
+        previous_census (dict): census manifest of the previous build
+        census (dict): census manifest of this build
+
+    Returns:
+        set[str]: tables to delete from the census GeoPackage
+    """
+    stale_tables: set[str] = set()
+    for table_name, table_manifest in previous_census.items():
+        stale_tables.update(get_census_gpkg_tables(table_name, table_manifest))
+    for table_name, table_manifest in census.items():
+        stale_tables.difference_update(
+            get_census_gpkg_tables(table_name, table_manifest)
+        )
+    return stale_tables
+
+
+def read_demographic_data(
+    directory: Path,
+    wide_tables: bool = False,
+    manifest: typing.Optional[dict] = None,
+    processes: int = 1,
+) -> list[tuple[str, list[QgsVectorLayer]]]:
+    """Read the census directory and create a list of vector layers for each filtered field in each file found in the dir.
+
+    Args:
+        directory (Path): census directory
+        wide_tables (bool, optional): store each census table once and style views over it, instead of one GeoPackage layer per field. Defaults to False.
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Tables whose csv is unchanged since the last build reuse their layers. Defaults to None, which rebuilds everything.
+        processes (int, optional): number of worker processes to build the census layers in. Defaults to 1, which builds them in this process.
+
+    Returns:
+        typing.List[typing.List[QgsVectorLayer]]: list of lists, grouped by filename
+    """
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]] = []
+    previous_census_manifest = (
+        manifest.get("census", {}) if manifest is not None else {}
+    )
+    census_manifest = {}
+    fingerprints = {}
+    # layers of each csv, in the order the csvs were found
+    layers_by_file: dict[Path, typing.Optional[list[QgsVectorLayer]]] = {}
+    files_to_build: list[Path] = []
+
+    # All files in the other folders, in the layers folder, will be processed individually
+    for file_path in directory.glob("*.csv"):
+        logging.info(f"Found census table : {file_path.stem}")
+        layers_by_file[file_path] = None
+        if manifest is not None:
+            previous_table = previous_census_manifest.get(file_path.stem, {})
+            fingerprint = fingerprint_file(file_path, previous_table.get("input"))
+            fingerprints[file_path] = fingerprint
+            if (
+                previous_table.get("input", {}).get("sha256") == fingerprint["sha256"]
+                and previous_table.get("wide_table") == wide_tables
+                and previous_table.get("spatial_order", False) == SPATIAL_ORDER_FEATURES
+                and previous_table.get("geometry_levels")
+                == [list(level) for level in CENSUS_GEOMETRY_LEVELS]
+            ):
+                layers_for_file = load_demographic_layers(
+                    file_path.stem, previous_table.get("layers", []), wide_tables
+                )
+                if layers_for_file is not None:
+                    logging.info(f"{file_path.stem} is unchanged, reusing its layers")
+                    census_manifest[file_path.stem] = {
+                        **previous_table,
+                        "input": fingerprint,
+                    }
+                    layers_by_file[file_path] = layers_for_file
+                    continue
+        files_to_build.append(file_path)
+
+    if processes > 1 and files_to_build:
+        built_layers = build_demographic_layers_in_parallel(
+            files_to_build, wide_tables, processes
+        )
+    else:
+        built_layers = {}
+        # the base layer geometries are the same for every table, so only read them once
+        if files_to_build:
+            base_layer = get_base_layer()
+            base_geometries = load_base_zcta_geometries(base_layer)
+        for file_path in files_to_build:
+            built_layers[file_path] = create_demographic_layers(
+                file_path, base_layer, base_geometries, wide_tables
+            )
+
+    for file_path, layers_for_file in built_layers.items():
+        layers_by_file[file_path] = layers_for_file
+        if manifest is None:
+            continue
+        if layers_for_file is None or not layers_written(layers_for_file):
+            # the last good layers of the csv may still be in the GeoPackage, so keep
+            # tracking them. the old input fingerprint makes the next build retry the csv
+            if file_path.stem in previous_census_manifest:
+                census_manifest[file_path.stem] = previous_census_manifest[
+                    file_path.stem
+                ]
+            continue
+        census_manifest[file_path.stem] = {
+            "input": fingerprints[file_path],
+            "wide_table": wide_tables,
+            "spatial_order": SPATIAL_ORDER_FEATURES,
+            "geometry_levels": [list(level) for level in CENSUS_GEOMETRY_LEVELS],
+            "layers": [layer.name() for layer in layers_for_file],
+        }
+
+    for file_path, layers_for_file in layers_by_file.items():
+        if layers_for_file is None:
+            continue
+        demo_groups.append((file_path.stem, layers_for_file))
+
+    if manifest is not None:
+        manifest["census"] = census_manifest
+        # tables of removed csvs, or of attributes and levels no longer built, would otherwise stay in the GeoPackage forever
+        delete_gpkg_layers(
+            CENSUS_DATA_GPKG_OUTPUT,
+            get_stale_census_tables(previous_census_manifest, census_manifest),
+        )
+
+    assert len(demo_groups) > 0
+    return demo_groups
+
+
+def transform_points(
+    x: np.ndarray,
+    y: np.ndarray,
+    source_crs: QgsCoordinateReferenceSystem,
+    destination_crs: QgsCoordinateReferenceSystem,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Transform point coordinates between two crs
+
+    Note:
+        EPSG:4326 to EPSG:3857 is computed with numpy. Other transforms go through QgsCoordinateTransform one point at a time.
+
+    Args:
+        x (np.ndarray): x of the points
+        y (np.ndarray): y of the points
+        source_crs (QgsCoordinateReferenceSystem): crs of the points
+        destination_crs (QgsCoordinateReferenceSystem): crs to transform to
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: transformed x and y
+    """
+    if source_crs == destination_crs:
+        return x, y
+    if source_crs.authid() == "EPSG:4326" and destination_crs.authid() == "EPSG:3857":
+        return project_to_web_mercator(x, y)
+    transform = QgsCoordinateTransform(
+        source_crs, destination_crs, get_project().transformContext()
+    )
+    transformed = [transform.transform(QgsPointXY(px, py)) for px, py in zip(x, y)]
+    return (
+        np.array([point.x() for point in transformed]),
+        np.array([point.y() for point in transformed]),
+    )
+
+
+def find_listing_polygons(
+    x: np.ndarray,
+    y: np.ndarray,
+    zip_keys: np.ndarray,
+    base_geometries: ZctaGeometries,
+) -> np.ndarray:
+    """Find the ZCTA polygon every listing lies in
+
+    Note:
+        The polygon of a listing's zip code is tried first, through the dense ZCTA index. Listings outside of it, or without a zip code, are looked up in a spatial index of the polygons, which is only built if needed. Point in polygon tests use prepared geometries.
+
+    Args:
+        x (np.ndarray): x of the listings, in the crs of the base layer
+        y (np.ndarray): y of the listings, in the crs of the base layer
+        zip_keys (np.ndarray): normalize_zcta of the zip code of each listing
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries of the base layer
+
+    Returns:
+        np.ndarray: index in base_geometries of the polygon of each listing, -1 for listings outside of every polygon
+    """
+    polygon_of_zcta = np.full(ZCTA_INDEX_SIZE, -1, dtype=np.int64)
+    valid_keys = base_geometries.keys >= 0
+    polygon_of_zcta[base_geometries.keys[valid_keys]] = np.flatnonzero(valid_keys)
+    zip_polygons = np.where(zip_keys >= 0, polygon_of_zcta[zip_keys.clip(0)], -1)
+
+    engines = {}
+
+    def polygon_contains(polygon_index: int, point: QgsGeometry) -> bool:
+        if polygon_index not in engines:
+            geometry = base_geometries.geometries[polygon_index]
+            if geometry.isNull():
+                engines[polygon_index] = None
+            else:
+                engines[polygon_index] = QgsGeometry.createGeometryEngine(
+                    geometry.constGet()
+                )
+                engines[polygon_index].prepareGeometry()
+        engine = engines[polygon_index]
+        return engine is not None and engine.intersects(point.constGet())
+
+    spatial_index = None
+    listing_polygons = np.full(len(x), -1, dtype=np.int64)
+    zip_matches = 0
+    for listing_index, (px, py, zip_polygon) in enumerate(
+        zip(x.tolist(), y.tolist(), zip_polygons.tolist())
+    ):
+        point = QgsGeometry.fromPointXY(QgsPointXY(px, py))
+        if zip_polygon >= 0 and polygon_contains(zip_polygon, point):
+            listing_polygons[listing_index] = zip_polygon
+            zip_matches += 1
+            continue
+        if spatial_index is None:
+            spatial_index = QgsSpatialIndex()
+            for polygon_index, geometry in enumerate(base_geometries.geometries):
+                if not geometry.isNull():
+                    spatial_index.addFeature(polygon_index, geometry.boundingBox())
+        for polygon_index in spatial_index.intersects(QgsRectangle(px, py, px, py)):
+            if polygon_contains(polygon_index, point):
+                listing_polygons[listing_index] = polygon_index
+                break
+
+    matched = int((listing_polygons >= 0).sum())
+    logging.info(
+        f"Joined {matched} of {len(x)} listings to a ZCTA, {zip_matches} of them through their zip code"
+    )
+    return listing_polygons
+
+
+def compute_group_medians(
+    groups: np.ndarray, values: np.ndarray, group_count: int
+) -> np.ndarray:
+    """Median of the values of every group
+
+    Args:
+        groups (np.ndarray): group of each value, -1 for none
+        values (np.ndarray): values, NaN for NULL
+        group_count (int): number of groups
+
+    Returns:
+        np.ndarray: median of each group, NaN for a group without values
+    """
+    valid = (groups >= 0) & ~np.isnan(values)
+    order = np.lexsort((values[valid], groups[valid]))
+    sorted_groups = groups[valid][order]
+    sorted_values = values[valid][order]
+    counts = np.bincount(sorted_groups, minlength=group_count)
+    starts = np.cumsum(counts) - counts
+    has_values = counts > 0
+    medians = np.full(group_count, np.nan)
+    lower = starts[has_values] + (counts[has_values] - 1) // 2
+    upper = starts[has_values] + counts[has_values] // 2
+    medians[has_values] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return medians
+
+
+def aggregate_listings_by_zcta(
+    locations_layer: QgsVectorLayer,
+    csv_attributes: list[str],
+    base_layer: QgsVectorLayer,
+    base_geometries: ZctaGeometries,
+) -> JoinedCensusTable:
+    """Count the listings of every heating type in each ZCTA polygon
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer
+        csv_attributes (list[str]): heating type fields
+        base_layer (QgsVectorLayer): base layer, for its crs
+        base_geometries (ZctaGeometries): ZCTA5 keys and geometries of the base layer
+
+    Returns:
+        JoinedCensusTable: for every polygon, its number of listings, the number and share of listings of each heating type, and the medians of LISTING_MEDIAN_FIELDS
+    """
+    location_fields = locations_layer.fields()
+    heating_fields = [
+        (attribute, location_fields.indexFromName(attribute))
+        for attribute in csv_attributes
+        if location_fields.indexFromName(attribute) >= 0
+    ]
+    median_fields = [
+        (field_name, location_fields.indexFromName(field_name))
+        for field_name in LISTING_MEDIAN_FIELDS
+        if location_fields.indexFromName(field_name) >= 0
+    ]
+    zip_field_index = location_fields.indexFromName(LISTING_ZIP_FIELD)
+    request = QgsFeatureRequest().setSubsetOfAttributes(
+        [field_index for _, field_index in heating_fields + median_fields]
+        + ([zip_field_index] if zip_field_index >= 0 else [])
+    )
+
+    x = []
+    y = []
+    zip_keys = []
+    heating_flags = []
+    median_values = []
+    with measure_stage("listing join") as metrics:
+        for feat in locations_layer.getFeatures(request):
+            geometry = feat.geometry()
+            if geometry.isNull():
+                continue
+            point = geometry.asPoint()
+            x.append(point.x())
+            y.append(point.y())
+            feat_attributes = feat.attributes()
+            zip_keys.append(
+                normalize_zcta(feat_attributes[zip_field_index])
+                if zip_field_index >= 0
+                else -1
+            )
+            heating_flags.append(
+                [
+                    feat_attributes[field_index] is True
+                    for _, field_index in heating_fields
+                ]
+            )
+            median_values.append(
+                [
+                    math.nan
+                    if feat_attributes[field_index] is None
+                    or (
+                        isinstance(feat_attributes[field_index], QVariant)
+                        and feat_attributes[field_index].isNull()
+                    )
+                    else float(feat_attributes[field_index])
+                    for _, field_index in median_fields
+                ]
+            )
+        metrics["items"] += len(x)
+
+        x, y = transform_points(
+            np.array(x), np.array(y), locations_layer.crs(), base_layer.crs()
+        )
+        listing_polygons = find_listing_polygons(
+            x, y, np.array(zip_keys, dtype=np.int64), base_geometries
+        )
+
+    polygon_count = len(base_geometries.geometries)
+    heating_flags = np.array(heating_flags, dtype=bool).reshape(
+        len(x), len(heating_fields)
+    )
+    median_values = np.array(median_values, dtype=float).reshape(
+        len(x), len(median_fields)
+    )
+    joined = listing_polygons >= 0
+    listing_counts = np.bincount(
+        listing_polygons[joined], minlength=polygon_count
+    ).astype(float)
+
+    columns = ["listings"]
+    column_values = [listing_counts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for heating_index, (attribute, _) in enumerate(heating_fields):
+            heating_counts = np.bincount(
+                listing_polygons[joined],
+                weights=heating_flags[joined, heating_index],
+                minlength=polygon_count,
+            )
+            columns.extend([f"{attribute} listings", f"{attribute} share"])
+            # polygons without listings have no share
+            column_values.extend([heating_counts, heating_counts / listing_counts])
+    for median_index, (field_name, _) in enumerate(median_fields):
+        columns.append(f"median {field_name}")
+        column_values.append(
+            compute_group_medians(
+                listing_polygons, median_values[:, median_index], polygon_count
+            )
+        )
+    return JoinedCensusTable(columns, np.column_stack(column_values))
+
+
+def build_listing_aggregate_layer(
+    locations_layer: QgsVectorLayer,
+    csv_attributes: list[str],
+    manifest: typing.Optional[dict] = None,
+) -> QgsVectorLayer:
+    """Create the layer of the listings of every ZCTA, and write it to the census GeoPackage
+
+    Note:
+        With a manifest, the layer is only rebuilt when the locations changed since it was last built.
+
+    Args:
+        locations_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        csv_attributes (list[str]): heating type fields
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Defaults to None, which always rebuilds.
+
+    Returns:
+        QgsVectorLayer: the listings layer, styled with the heat pump share
+    """
+    base_layer = get_base_layer()
+    if manifest is not None:
+        listings_inputs = {
+            "locations": get_locations_signature(manifest),
+            "attributes": csv_attributes,
+            "base_layer": base_layer.source(),
+            "spatial_order": SPATIAL_ORDER_FEATURES,
+        }
+        if manifest.get("listings") == listings_inputs and gpkg_layer_exists(
+            CENSUS_DATA_GPKG_OUTPUT, LISTING_AGGREGATE_LAYER_NAME
+        ):
+            logging.info("Locations are unchanged, reusing the listings layer")
+            return QgsVectorLayer(
+                f"{CENSUS_DATA_GPKG_OUTPUT}|layername={LISTING_AGGREGATE_LAYER_NAME}",
+                LISTING_AGGREGATE_LAYER_NAME,
+                "ogr",
+            )
+
+    base_geometries = load_base_zcta_geometries(base_layer, simplify=False)
+    listings_table = aggregate_listings_by_zcta(
+        locations_layer, csv_attributes, base_layer, base_geometries
+    )
+    listings_layer = create_census_memory_layer(
+        LISTING_AGGREGATE_LAYER_NAME,
+        base_layer,
+        base_geometries,
+        listings_table.columns,
+        listings_table,
+    )
+    style_column = (
+        LISTING_AGGREGATE_STYLE_COLUMN
+        if LISTING_AGGREGATE_STYLE_COLUMN in listings_table.columns
+        else "listings"
+    )
+    with measure_stage("styling"):
+        class_breaks = compute_census_class_breaks(listings_table, [style_column])
+        listings_layer.setRenderer(
+            create_graduated_renderer(style_column, class_breaks[style_column])
+        )
+    listings_layer = save_styled_layers(CENSUS_DATA_GPKG_OUTPUT, [listings_layer])[0]
+    if manifest is not None and layers_written([listings_layer]):
+        manifest["listings"] = listings_inputs
+    return listings_layer
+
+
+def get_layer_zoom_range(layer: QgsMapLayer) -> tuple[int, int]:
+    """Get the tile zoom levels matching the scales a layer is drawn at
+
+    Args:
+        layer (QgsMapLayer): layer, with or without scale based visibility
+
+    Returns:
+        tuple[int, int]: first and last zoom level
+    """
+    if not layer.hasScaleBasedVisibility():
+        return 0, VECTOR_TILE_MAX_ZOOM
+    # the minimum scale is the most zoomed out one, 0 has no limit
+    min_zoom = 0
+    if layer.minimumScale() > 0:
+        min_zoom = max(
+            0, math.floor(math.log2(ZOOM_0_SCALE / layer.minimumScale())) + 1
+        )
+    max_zoom = VECTOR_TILE_MAX_ZOOM
+    if layer.maximumScale() > 0:
+        max_zoom = min(
+            VECTOR_TILE_MAX_ZOOM,
+            math.floor(math.log2(ZOOM_0_SCALE / layer.maximumScale())),
+        )
+    return min_zoom, max_zoom
+
+
+def create_tile_source_layer(
+    layer: QgsVectorLayer, layer_name: str, field_names: list[str]
+) -> QgsVectorLayer:
+    """Open a GeoPackage layer again with only the given fields
+
+    Note:
+        The fields are selected with a SQL subset string, so GeoPackage only reads those columns. If the provider does not accept it, every field is kept. Layers that are not GeoPackage layers are returned as they are.
+
+    Args:
+        layer (QgsVectorLayer): GeoPackage layer
+        layer_name (str): name of the new layer
+        field_names (list[str]): fields to keep
+
+    Returns:
+        QgsVectorLayer: layer reading only the given fields
+    """
+    table_name = (
+        QgsProviderRegistry.instance().decodeUri("ogr", layer.source()).get("layerName")
+    )
+    # layers that could not be written to a GeoPackage are kept in memory
+    if layer.providerType() != "ogr" or not table_name:
+        return layer
+    source_layer = QgsVectorLayer(layer.source(), layer_name, "ogr")
+    columns = ", ".join(
+        ["fid", "geom"] + [QgsExpression.quotedColumnRef(name) for name in field_names]
+    )
+    if not source_layer.setSubsetString(
+        f"SELECT {columns} FROM {QgsExpression.quotedColumnRef(table_name)}"
+    ):
+        logging.warning(f"Could not select the fields of {layer_name}, keeping all")
+    return source_layer
+
+
+def export_vector_tiles(
+    location_layer: QgsVectorLayer,
+    csv_attributes: list[str],
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]],
+    output_path: Path = VECTOR_TILES_OUTPUT,
+) -> bool:
+    """Write the locations and census layers as vector tiles to an MBTiles file
+
+    Note:
+        Locations are thinned at low zooms following LOCATION_TILE_THINNING. Census layers are written at the zooms their scale based visibility covers, so the simplified polygons of CENSUS_GEOMETRY_LEVELS fill the low zooms. Only the fields a map draws are written: the location fields of LOCATION_TILE_FIELDS and the heating types, and the ZCTA and attribute of each census layer.
+
+    Args:
+        location_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        csv_attributes (list[str]): heating type fields
+        demo_groups (list[tuple[str, list[QgsVectorLayer]]]): census layers grouped by census table
+        output_path (Path, optional): MBTiles file to write. Defaults to VECTOR_TILES_OUTPUT.
+
+    Returns:
+        bool: whether the tiles were written
+    """
+    tile_layers: list[QgsVectorTileWriter.Layer] = []
+    source_layers: list[QgsVectorLayer] = []
+
+    location_field_names = location_layer.fields().names()
+    location_tile_fields = [
+        field_name
+        for field_name in list(LOCATION_TILE_FIELDS) + csv_attributes
+        if field_name in location_field_names
+    ]
+    locations_source = create_tile_source_layer(
+        location_layer, "locations", location_tile_fields
+    )
+    source_layers.append(locations_source)
+    for min_zoom, max_zoom, keep_every in LOCATION_TILE_THINNING:
+        tile_layer = QgsVectorTileWriter.Layer(locations_source)
+        tile_layer.setLayerName("locations")
+        tile_layer.setMinZoom(min_zoom)
+        tile_layer.setMaxZoom(max_zoom)
+        if keep_every > 1:
+            tile_layer.setFilterExpression(f"$id % {keep_every} = 0")
+        tile_layers.append(tile_layer)
+
+    for table_name, demo_layers in demo_groups:
+        for demo_layer in demo_layers:
+            attribute_name, _ = split_census_level_layer_name(demo_layer.name())
+            census_source = create_tile_source_layer(
+                demo_layer, demo_layer.name(), ["ZCTA5", attribute_name]
+            )
+            source_layers.append(census_source)
+            min_zoom, max_zoom = get_layer_zoom_range(demo_layer)
+            if min_zoom > max_zoom:
+                continue
+            tile_layer = QgsVectorTileWriter.Layer(census_source)
+            # every level of an attribute is the same tile layer, at different zooms
+            tile_layer.setLayerName(f"{table_name}-{attribute_name}")
+            tile_layer.setMinZoom(min_zoom)
+            tile_layer.setMaxZoom(max_zoom)
+            tile_layers.append(tile_layer)
+
+    # only the tiles over the data are visited, not the whole world
+    tile_crs = QgsCoordinateReferenceSystem("EPSG:3857")
+    transform_context = get_project().transformContext()
+    tile_extent = QgsRectangle()
+    tile_extent.setMinimal()
+    for source_layer in source_layers:
+        transform = QgsCoordinateTransform(
+            source_layer.crs(), tile_crs, transform_context
+        )
+        tile_extent.combineExtentWith(
+            transform.transformBoundingBox(source_layer.extent())
+        )
+
+    if output_path.exists():
+        output_path.unlink()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    destination_uri = QgsDataSourceUri()
+    destination_uri.setParam("type", "mbtiles")
+    destination_uri.setParam("url", str(output_path))
+
+    writer = QgsVectorTileWriter()
+    writer.setDestinationUri(bytes(destination_uri.encodedUri()).decode("utf-8"))
+    writer.setMinZoom(0)
+    writer.setMaxZoom(VECTOR_TILE_MAX_ZOOM)
+    writer.setExtent(tile_extent)
+    writer.setTransformContext(transform_context)
+    writer.setLayers(tile_layers)
+    writer.setMetadata(
+        {
+            "name": output_path.stem,
+            "description": "Housing locations and census data of the electrification tracker",
+        }
+    )
+    if not writer.writeTiles():
+        logging.error(f"Could not write {output_path}: {writer.errorMessage()}")
+        return False
+    logging.info(f"Wrote {len(tile_layers)} vector tile layers to {output_path}")
+    return True
+
+
+def build_vector_tiles(
+    location_layer: QgsVectorLayer,
+    csv_attributes: list[str],
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]],
+    manifest: typing.Optional[dict] = None,
+):
+    """Export the vector tiles, unless the layers are unchanged since they were last exported
+
+    Args:
+        location_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        csv_attributes (list[str]): heating type fields
+        demo_groups (list[tuple[str, list[QgsVectorLayer]]]): census layers grouped by census table
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Defaults to None, which always exports.
+    """
+    if manifest is None:
+        export_vector_tiles(location_layer, csv_attributes, demo_groups)
+        return
+
+    tiles_signature = hashlib.sha256(
+        json.dumps(
+            {
+                "locations": get_locations_signature(manifest),
+                "census": manifest.get("census", {}),
+                "thinning": LOCATION_TILE_THINNING,
+                "fields": LOCATION_TILE_FIELDS,
+                "max_zoom": VECTOR_TILE_MAX_ZOOM,
+            },
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()
+    if (
+        manifest.get("tiles", {}).get("inputs") == tiles_signature
+        and VECTOR_TILES_OUTPUT.exists()
+    ):
+        logging.info("Layers are unchanged, reusing the vector tiles")
+        return
+    if export_vector_tiles(location_layer, csv_attributes, demo_groups):
+        manifest["tiles"] = {"inputs": tiles_signature}
+
+
+def export_layers(
+    layers: list[QgsVectorLayer],
+    output_format: str,
+    output_directory: Path = EXPORT_DIRECTORY,
+) -> bool:
+    """Write layers to one file each in another format, with their style in a .qml file next to it
+
+    Note:
+        Layers reading the same table, like the views of a wide census table, write it once. QGIS opens a file with the style of the .qml of the same name, which is the style of the first layer of the table. The styles of the other layers are saved as .qml files named after them.
+
+    Args:
+        layers (list[QgsVectorLayer]): layers to write
+        output_format (str): format to write, from EXPORT_FORMAT_WRITERS
+        output_directory (Path, optional): directory holding a directory per format. Defaults to EXPORT_DIRECTORY.
+
+    Returns:
+        bool: whether every layer was written
+    """
+    format_directory = output_directory / output_format
+    table_layers: dict[str, list[QgsVectorLayer]] = {}
+    for layer in layers:
+        table_name = (
+            QgsProviderRegistry.instance()
+            .decodeUri(layer.providerType(), layer.source())
+            .get("layerName")
+        )
+        table_layers.setdefault(table_name or layer.name(), []).append(layer)
+
+    written = True
+    with EXPORT_FORMAT_WRITERS[output_format](format_directory) as writer:
+        for table_name, layers_of_table in table_layers.items():
+            error = writer.write_layer(layers_of_table[0], table_name)
+            if error[0] != QgsVectorFileWriter.WriterError.NoError:
+                logging.error(f"Encountered error {error} when exporting {table_name}")
+                written = False
+                continue
+            table_path = writer.get_layer_path(table_name)
+            with measure_stage("styling"):
+                style_paths = [table_path.with_suffix(".qml")] + [
+                    format_directory / f"{get_layer_file_name(layer.name())}.qml"
+                    for layer in layers_of_table[1:]
+                ]
+                for layer, style_path in zip(layers_of_table, style_paths):
+                    message, saved = layer.saveNamedStyle(str(style_path))
+                    if not saved:
+                        logging.warning(
+                            f"Could not save the style of {layer.name()}: {message}"
+                        )
+    return written
+
+
+def build_exports(
+    location_layer: QgsVectorLayer,
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]],
+    listings_layer: typing.Optional[QgsVectorLayer],
+    export_formats: typing.Iterable[str] = DEFAULT_EXPORT_FORMATS,
+    manifest: typing.Optional[dict] = None,
+):
+    """Export the locations, listings and census layers in every format, unless they are unchanged since they were last exported
+
+    Args:
+        location_layer (QgsVectorLayer): locations layer read from the GeoPackage
+        demo_groups (list[tuple[str, list[QgsVectorLayer]]]): census layers grouped by census table
+        listings_layer (typing.Optional[QgsVectorLayer]): listings of every ZCTA
+        export_formats (typing.Iterable[str], optional): formats to write, from EXPORT_FORMAT_WRITERS. Defaults to DEFAULT_EXPORT_FORMATS.
+        manifest (typing.Optional[dict], optional): build manifest, updated in place. Defaults to None, which always exports.
+    """
+    layers = [location_layer]
+    if listings_layer is not None:
+        layers.append(listings_layer)
+    for _, demo_layers in demo_groups:
+        layers.extend(demo_layers)
+
+    exports_signature = None
+    if manifest is not None:
+        exports_signature = hashlib.sha256(
+            json.dumps(
+                {
+                    "locations": get_locations_signature(manifest),
+                    "census": manifest.get("census", {}),
+                    "listings": manifest.get("listings"),
+                    "layers": [layer.name() for layer in layers],
+                },
+                sort_keys=True,
+            ).encode("utf-8")
+        ).hexdigest()
+
+    for output_format in export_formats:
+        if (
+            exports_signature is not None
+            and manifest.get("exports", {}).get(output_format) == exports_signature
+            and (EXPORT_DIRECTORY / output_format).exists()
+        ):
+            logging.info(f"Layers are unchanged, reusing the {output_format} export")
+            continue
+        with measure_stage(f"{output_format} export"):
+            written = export_layers(layers, output_format)
+        if written and manifest is not None:
+            manifest.setdefault("exports", {})[output_format] = exports_signature
+
+
+def ingest_inputs(all_metros_directory: Path, census_directory: Path):
+    """Parse the census tables into their caches
+
+    Note:
+        Only reads csvs and writes the census caches, so it runs without starting QGIS. Later stages then load the census tables from the caches. The housing csvs are only listed, since the locations stage streams them straight into the GeoPackage and reading them here would read them twice.
+
+    Args:
+        all_metros_directory (Path): directory holding a folder per metro
+        census_directory (Path): census directory
+    """
+    csv_files = find_housing_csv_files(all_metros_directory)
+    logging.info(f"Found {len(csv_files)} housing csvs")
+
+    for file_path in census_directory.glob("*.csv"):
+        census_table, _ = load_filtered_data_from_demo_file(file_path)
+        if census_table is None:
+            logging.warning(f"could not recognize file format of {file_path.stem}.")
+            continue
+        logging.info(
+            f"Cached census table {file_path.stem} with {len(census_table.zctas)} ZCTAs"
+        )
+
+
+def add_layers_to_project(
+    qgis_project: QgsProject,
+    location_layer: QgsVectorLayer,
+    heatmap_layers: list[QgsMapLayer],
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]],
+    listings_layer: typing.Optional[QgsVectorLayer] = None,
+):
+    """Add the built layers to the project, with the heatmaps and census layers in collapsed groups
+
+    Args:
+        qgis_project (QgsProject): project to add the layers to
+        location_layer (QgsVectorLayer): locations layer
+        heatmap_layers (list[QgsMapLayer]): heatmap layers, vector or raster
+        demo_groups (list[tuple[str, list[QgsVectorLayer]]]): census layers grouped by census table
+        listings_layer (typing.Optional[QgsVectorLayer], optional): listings of every ZCTA, added after the census tables. Defaults to None.
+    """
+    layer_tree_root = qgis_project.layerTreeRoot()
+    heatmap_tree_group = QgsLayerTreeGroup("Heating Types")
+    demo_tree_group = QgsLayerTreeGroup("Demographics")
+    layer_tree_root.insertChildNode(0, heatmap_tree_group)
+    layer_tree_root.insertChildNode(1, demo_tree_group)
 
     for i, layer in enumerate(heatmap_layers):
-        project.addMapLayer(layer, False)
+        qgis_project.addMapLayer(layer, False)
         tree_layer = QgsLayerTreeLayer(layer)
         tree_layer.setItemVisibilityChecked(False)
         heatmap_tree_group.insertChildNode(i, tree_layer)
 
     for i, table_layer_list in enumerate(demo_groups):
         sub_group = demo_tree_group.addGroup(table_layer_list[0])
-        for j, layer in enumerate(table_layer_list[1]):
-            project.addMapLayer(layer, False)
+        # an attribute's simplified copies share a group with it, so checking the group shows whichever suits the scale
+        attribute_groups: dict[str, QgsLayerTreeGroup] = {}
+        for layer in table_layer_list[1]:
+            qgis_project.addMapLayer(layer, False)
             tree_layer = QgsLayerTreeLayer(layer)
             tree_layer.setItemVisibilityChecked(False)
-            sub_group.insertChildNode(j, tree_layer)
+            if not CENSUS_GEOMETRY_LEVELS:
+                sub_group.addChildNode(tree_layer)
+                continue
+            attribute_name, _ = split_census_level_layer_name(layer.name())
+            if attribute_name not in attribute_groups:
+                attribute_groups[attribute_name] = sub_group.addGroup(attribute_name)
+                attribute_groups[attribute_name].setItemVisibilityChecked(False)
+                attribute_groups[attribute_name].setExpanded(False)
+            attribute_groups[attribute_name].addChildNode(tree_layer)
         demo_tree_group.insertChildNode(i, sub_group)
 
+    if listings_layer is not None:
+        qgis_project.addMapLayer(listings_layer, False)
+        tree_layer = QgsLayerTreeLayer(listings_layer)
+        tree_layer.setItemVisibilityChecked(False)
+        demo_tree_group.addChildNode(tree_layer)
+
     heatmap_tree_group.setExpanded(False)
     demo_tree_group.setExpanded(False)
 
-    project.addMapLayer(location_layer)  # goes to front
+    qgis_project.addMapLayer(location_layer)  # goes to front
+
+
+def read_gpkg_layer_extents(
+    gpkg_path: Path
+) -> dict[str, tuple[float, float, float, float]]:
+    """Read the extent GDAL stored for every table of a GeoPackage when it wrote the table
+
+    Note:
+        Reads gpkg_contents with sqlite3, so no layer is opened.
+
+    Args:
+        gpkg_path (Path): GeoPackage to read
+
+    Returns:
+        dict[str, tuple[float, float, float, float]]: (xmin, ymin, xmax, ymax) in the crs of the table by table name, leaving out tables without a stored extent. Empty if the GeoPackage can not be read
+    """
+    if not gpkg_path.exists():
+        return {}
+    connection = sqlite3.connect(f"{gpkg_path.as_uri()}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(
+            "SELECT table_name, min_x, min_y, max_x, max_y FROM gpkg_contents"
+        ).fetchall()
+    except sqlite3.DatabaseError as e:
+        logging.error(f"Could not read the layer extents of {gpkg_path}: {e}")
+        return {}
+    finally:
+        connection.close()
+
+    return {
+        table_name: tuple(extent) for table_name, *extent in rows if None not in extent
+    }
+
+
+def apply_stored_layer_metadata(qgis_project: QgsProject) -> int:
+    """Give the GeoPackage layers of the project the extents stored in their GeoPackage
+
+    Note:
+        A layer reading a table through a filter, like a heatmap view, is skipped, as the extent of the whole table would be wrong for it. QGIS computes the extent of its filter instead. The extents are written to the project, which then trusts them when it is opened instead of having every layer compute its own.
+
+    Args:
+        qgis_project (QgsProject): project whose layers to update
+
+    Returns:
+        int: number of layers given a stored extent
+    """
+    gpkg_extents: dict[str, dict[str, tuple[float, float, float, float]]] = {}
+    applied_count = 0
+    for layer in qgis_project.mapLayers().values():
+        if (
+            not isinstance(layer, QgsVectorLayer)
+            or layer.providerType() != "ogr"
+            or layer.subsetString()
+        ):
+            continue
+        source_parts = QgsProviderRegistry.instance().decodeUri("ogr", layer.source())
+        gpkg_path = source_parts.get("path", "")
+        if not gpkg_path.lower().endswith(".gpkg"):
+            continue
+        if gpkg_path not in gpkg_extents:
+            gpkg_extents[gpkg_path] = read_gpkg_layer_extents(Path(gpkg_path))
+        extent = gpkg_extents[gpkg_path].get(source_parts.get("layerName"))
+        if extent is None:
+            continue
+        layer.setExtent(QgsRectangle(*extent))
+        applied_count += 1
+    return applied_count
+
+
+def write_project(qgis_project: QgsProject, output_project: Path) -> bool:
+    """Save the project so that it opens without QGIS checking every layer
+
+    Note:
+        The extents of the unfiltered GeoPackage layers come from their GeoPackage, and the project is flagged to trust the extents and geometry types stored in it. The project must be saved again whenever the layers change, which the project stage does on every build.
+
+    Args:
+        qgis_project (QgsProject): project to save
+        output_project (Path): .qgz file to write
+
+    Returns:
+        bool: whether the project was saved
+    """
+    with measure_stage("layer metadata") as metrics:
+        metrics["items"] += apply_stored_layer_metadata(qgis_project)
+    qgis_project.setFlag(Qgis.ProjectFlag.TrustStoredLayerStatistics, True)
+    output_project.parent.mkdir(parents=True, exist_ok=True)
+    if not qgis_project.write(str(output_project)):
+        logging.error(f"Could not save {output_project}: {qgis_project.error()}")
+        return False
+    logging.info(f"Saved {output_project}")
+    return True
+
+
+def run_pipeline(
+    stages: typing.Iterable[str],
+    all_metros_directory: Path = METRO_DIRECTORY,
+    census_directory: Path = CENSUS_DIRECTORY,
+    project_file: typing.Optional[Path] = None,
+    output_project: Path = PROJECT_OUTPUT_PATH,
+    wide_tables: bool = False,
+    heatmap_views: bool = False,
+    processes: int = 1,
+    report_path: Path = STAGE_REPORT_PATH,
+    spatial_order: bool = False,
+    heatmap_rasters: bool = False,
+    export_formats: typing.Iterable[str] = DEFAULT_EXPORT_FORMATS,
+    census_levels: bool = False,
+):
+    """Run stages of the build
+
+    Note:
+        A stage also brings the outputs it reads up to date: heatmaps need the locations layer, and the project needs every layer. Outputs whose inputs are unchanged are reused from the build manifest, so this is cheap once they have been built. QGIS is only started when a stage needs it.
+
+    Args:
+        stages (typing.Iterable[str]): stages to run, from PIPELINE_STAGES
+        all_metros_directory (Path, optional): directory holding a folder per metro. Defaults to METRO_DIRECTORY.
+        census_directory (Path, optional): census directory. Defaults to CENSUS_DIRECTORY.
+        project_file (typing.Optional[Path], optional): project holding the ZCTA base layer. Defaults to None, which uses the project open in QGIS.
+        output_project (Path, optional): where the project stage saves the project. Defaults to PROJECT_OUTPUT_PATH.
+        wide_tables (bool, optional): store each census table once and style views over it. Defaults to False.
+        heatmap_views (bool, optional): create the heatmaps as filtered views of the locations table. Defaults to False.
+        processes (int, optional): number of worker processes to build the census layers in. Defaults to 1.
+        report_path (Path, optional): where to write the timings of every stage. Defaults to STAGE_REPORT_PATH.
+        spatial_order (bool, optional): write the features of every GeoPackage layer along a Hilbert curve, so map panning and zooming read fewer pages. Defaults to False.
+        heatmap_rasters (bool, optional): create the heatmaps as precomputed density rasters, which draw much faster than the live heatmap renderer. Defaults to False.
+        export_formats (typing.Iterable[str], optional): formats the export stage writes, from EXPORT_FORMAT_WRITERS. Defaults to DEFAULT_EXPORT_FORMATS.
+        census_levels (bool, optional): also write every census layer with the simplified polygons of SIMPLIFIED_CENSUS_GEOMETRY_LEVELS, drawn when zoomed out. Defaults to False.
+    """
+    global SPATIAL_ORDER_FEATURES, CENSUS_GEOMETRY_LEVELS
+    SPATIAL_ORDER_FEATURES = spatial_order
+    CENSUS_GEOMETRY_LEVELS = SIMPLIFIED_CENSUS_GEOMETRY_LEVELS if census_levels else ()
+    stages = set(stages)
+    reset_stage_metrics()
+    build_manifest = load_build_manifest()
+
+    if "ingest" in stages:
+        with measure_stage("ingest"):
+            ingest_inputs(all_metros_directory, census_directory)
+    if stages.issubset(QGIS_FREE_STAGES):
+        save_build_manifest(build_manifest)
+        write_stage_report(report_path)
+        return
+    with measure_stage("qgis startup"):
+        qgis_project = get_project(project_file)
+
+    location_layer = None
+    heatmap_layers: list[QgsMapLayer] = []
+    demo_groups: list[tuple[str, list[QgsVectorLayer]]] = []
+    if stages & {"locations", "heatmaps", "listings", "tiles", "export", "project"}:
+        with measure_stage("locations"):
+            location_layer, csv_attributes = build_locations_layer(
+                all_metros_directory, build_manifest
+            )
+    if stages & {"heatmaps", "project"}:
+        with measure_stage("heatmaps"):
+            heatmap_layers = build_heatmap_layers(
+                location_layer,
+                csv_attributes,
+                build_manifest,
+                heatmap_views,
+                heatmap_rasters,
+            )
+    if stages & {"census", "tiles", "export", "project"}:
+        with measure_stage("census"):
+            demo_groups = read_demographic_data(
+                census_directory, wide_tables, build_manifest, processes
+            )
+    listings_layer = None
+    if stages & {"listings", "export", "project"}:
+        with measure_stage("listings"):
+            listings_layer = build_listing_aggregate_layer(
+                location_layer, csv_attributes, build_manifest
+            )
+    if "tiles" in stages:
+        with measure_stage("tiles"):
+            build_vector_tiles(
+                location_layer, csv_attributes, demo_groups, build_manifest
+            )
+    if "export" in stages:
+        with measure_stage("export"):
+            build_exports(
+                location_layer,
+                demo_groups,
+                listings_layer,
+                export_formats,
+                build_manifest,
+            )
+    save_build_manifest(build_manifest)
+
+    if "project" in stages:
+        with measure_stage("project"):
+            add_layers_to_project(
+                qgis_project,
+                location_layer,
+                heatmap_layers,
+                demo_groups,
+                listings_layer,
+            )
+            write_project(qgis_project, output_project)
+    write_stage_report(report_path)
+
+
+def main(argv: typing.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Build the location, heatmap and census GeoPackages and the QGIS project"
+    )
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        choices=PIPELINE_STAGES,
+        help=f"stages to run, from {', '.join(PIPELINE_STAGES)}. defaults to all but tiles and export",
+    )
+    parser.add_argument(
+        "--project",
+        type=Path,
+        help="QGIS project holding the ZCTA base layer. needed by the census, listings and project stages",
+    )
+    parser.add_argument(
+        "--output-project",
+        type=Path,
+        default=PROJECT_OUTPUT_PATH,
+        help="where the project stage saves the project",
+    )
+    parser.add_argument("--metro-directory", type=Path, default=METRO_DIRECTORY)
+    parser.add_argument("--census-directory", type=Path, default=CENSUS_DIRECTORY)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="worker processes to build the census layers in",
+    )
+    parser.add_argument(
+        "--wide-tables",
+        action="store_true",
+        help="store each census table once and style views over it",
+    )
+    parser.add_argument(
+        "--heatmap-views",
+        action="store_true",
+        help="create the heatmaps as filtered views of the locations table",
+    )
+    parser.add_argument(
+        "--heatmap-rasters",
+        action="store_true",
+        help="create the heatmaps as precomputed density rasters, which draw much faster",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=STAGE_REPORT_PATH,
+        help="where to write the timings of every stage as JSON",
+    )
+    parser.add_argument(
+        "--spatial-order",
+        action="store_true",
+        help="write features along a Hilbert curve so nearby features are stored together",
+    )
+    parser.add_argument(
+        "--census-levels",
+        action="store_true",
+        help="also write simplified census polygons, drawn instead of the full ones when zoomed out",
+    )
+    parser.add_argument(
+        "--export-format",
+        action="append",
+        choices=list(EXPORT_FORMAT_WRITERS),
+        help="format the export stage writes, repeat for several. defaults to all of them",
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    try:
+        run_pipeline(
+            args.stages or DEFAULT_PIPELINE_STAGES,
+            args.metro_directory,
+            args.census_directory,
+            args.project,
+            args.output_project,
+            args.wide_tables,
+            args.heatmap_views,
+            args.processes,
+            args.report,
+            args.spatial_order,
+            args.heatmap_rasters,
+            args.export_format or DEFAULT_EXPORT_FORMATS,
+            args.census_levels,
+        )
+    finally:
+        exit_qgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+if __name__ == "__console__":
+    configure_logging()
+    qgis_project = get_project()
+    build_manifest = load_build_manifest()
+    location_layer, heatmap_layers = build_location_heatmap_layers(
+        METRO_DIRECTORY, build_manifest
+    )
+    demo_groups = read_demographic_data(CENSUS_DIRECTORY, manifest=build_manifest)
+    save_build_manifest(build_manifest)
+
+    add_layers_to_project(qgis_project, location_layer, heatmap_layers, demo_groups)
+    write_stage_report()
     logging.debug("Last one")
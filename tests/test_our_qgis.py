@@ -0,0 +1,406 @@
+"""Tests of the helpers of our_qgis.py that do not need a running QGIS
+
+Run with the python that comes with QGIS, from the repository root:
+
+    python -m pytest tests
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# our_qgis imports numpy and qgis.core at the top, so it can only be tested where both are installed
+np = pytest.importorskip("numpy")
+pytest.importorskip("qgis.core")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import our_qgis as script  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("True", True),
+        (" yes ", True),
+        ("1", True),
+        ("False", False),
+        ("no", False),
+        ("", None),
+        ("   ", None),
+    ],
+)
+def test_parse_csv_bool(value, expected):
+    assert script.parse_csv_bool(value) is expected
+
+
+def test_parse_csv_double():
+    assert script.parse_csv_double("-71.25") == -71.25
+    assert script.parse_csv_double("") is None
+    assert script.parse_csv_double("N/A") is None
+
+
+def get_in_order_row_plan() -> script.LocationRowPlan:
+    """Plan of LATITUDE, LONGITUDE, IS_ELECTRIC columns that are also the field order"""
+    return script.LocationRowPlan(
+        longitude_field=1,
+        latitude_field=0,
+        field_count=3,
+        columns=[
+            (0, 0, script.parse_csv_double),
+            (1, 1, script.parse_csv_double),
+            (2, 2, script.parse_csv_bool),
+        ],
+        in_field_order=True,
+    )
+
+
+def get_remapped_row_plan() -> script.LocationRowPlan:
+    """Plan of IS_ELECTRIC, LONGITUDE, LATITUDE columns going to fields in another order"""
+    return script.LocationRowPlan(
+        longitude_field=1,
+        latitude_field=0,
+        field_count=3,
+        columns=[
+            (0, 2, script.parse_csv_bool),
+            (1, 1, script.parse_csv_double),
+            (2, 0, script.parse_csv_double),
+        ],
+        in_field_order=False,
+    )
+
+
+def test_convert_location_row_in_field_order():
+    row_plan = get_in_order_row_plan()
+    assert script.convert_location_row(row_plan, ["42.1", "-71.2", "True"]) == [
+        42.1,
+        -71.2,
+        True,
+    ]
+
+
+def test_convert_location_row_remapped():
+    row_plan = get_remapped_row_plan()
+    assert script.convert_location_row(row_plan, ["no", "-71.2", "42.1"]) == [
+        42.1,
+        -71.2,
+        False,
+    ]
+
+
+@pytest.mark.parametrize("row_plan", [get_in_order_row_plan(), get_remapped_row_plan()])
+def test_convert_location_row_pads_short_rows(row_plan):
+    attributes = script.convert_location_row(row_plan, ["1"])
+    assert len(attributes) == row_plan.field_count
+    assert attributes.count(None) == row_plan.field_count - 1
+    assert script.convert_location_row(row_plan, []) == [None] * row_plan.field_count
+
+
+def test_fids_to_ranges():
+    assert script.fids_to_ranges([8, 1, 2, 3, 5, 7]) == [[1, 3], [5, 5], [7, 8]]
+    assert script.fids_to_ranges(iter([4])) == [[4, 4]]
+    assert script.fids_to_ranges([]) == []
+
+
+def test_compute_quantile_breaks():
+    values = np.array([[1.0, 10.0], [2.0, np.nan], [3.0, 30.0], [4.0, 40.0]])
+    np.testing.assert_allclose(
+        script.compute_quantile_breaks(values, 2), [[2.5, 30.0], [4.0, 40.0]]
+    )
+
+
+def test_compute_equal_interval_breaks():
+    values = np.array([[0.0, -5.0], [10.0, np.nan], [4.0, 5.0]])
+    np.testing.assert_allclose(
+        script.compute_equal_interval_breaks(values, 2), [[5.0, 0.0], [10.0, 5.0]]
+    )
+
+
+def test_compute_jenks_breaks():
+    column = np.array([22.0, 1.0, 11.0, np.nan, 2.0, 21.0, 3.0, 10.0, 12.0, 20.0])
+    np.testing.assert_array_equal(
+        script.compute_jenks_breaks(column, 3), [3.0, 12.0, 22.0]
+    )
+    # fewer values than classes gives every value as a break
+    np.testing.assert_array_equal(
+        script.compute_jenks_breaks(np.array([5.0, np.nan, 1.0]), 3), [1.0, 5.0]
+    )
+
+
+def test_compute_class_breaks_skips_columns_without_values():
+    values = np.array([[1.0, np.nan], [2.0, np.nan], [3.0, np.nan], [4.0, np.nan]])
+    for mode in ("quantile", "jenks", "equal_interval"):
+        column_breaks = script.compute_class_breaks(values, mode, 2)
+        assert column_breaks[1] is None
+        assert column_breaks[0][-1] == 4.0
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("02134", 2134),
+        ("2134", 2134),
+        (" 2134.0 ", 2134),
+        ("8600000US02134", 2134),
+        ("ZCTA5 02134", 2134),
+        (2134, 2134),
+        (2134.0, 2134),
+        ("2134.5", -1),
+        ("-1", -1),
+        ("2134.", -1),
+        ("123456", -1),
+        ("02134-1234", -1),
+        ("abc", -1),
+        ("", -1),
+        (None, -1),
+        (2134.5, -1),
+        (-1, -1),
+        (float("nan"), -1),
+        (True, -1),
+    ],
+)
+def test_normalize_zcta(value, expected):
+    assert script.normalize_zcta(value) == expected
+
+
+def test_build_zcta_index():
+    zctas = np.array(["02134", "2134.5", "02139", "-1", "2134", "junk"], dtype=object)
+    zcta_index = script.build_zcta_index(zctas)
+    assert zcta_index.shape == (script.ZCTA_INDEX_SIZE,)
+    # the last row of a repeated ZCTA wins
+    assert zcta_index[2134] == 4
+    assert zcta_index[2139] == 2
+    assert np.count_nonzero(zcta_index >= 0) == 2
+
+
+def test_get_listing_key_normalizes_addresses_and_coordinates():
+    key_indices = [0, 1, 2]
+    key = script.get_listing_key(["12 Main St.", "42.123451", "-71"], key_indices)
+    assert len(key) == 8
+    assert key == script.get_listing_key(
+        ["12  MAIN ST", "42.123454", "-71.00000"], key_indices
+    )
+    assert key != script.get_listing_key(["12 Main St", "42.12346", "-71"], key_indices)
+    assert key != script.get_listing_key(
+        ["14 Main St", "42.123451", "-71"], key_indices
+    )
+    # a missing column counts as empty instead of failing
+    assert script.get_listing_key(
+        ["12 Main St"], key_indices
+    ) == script.get_listing_key(["12 Main St", "", ""], key_indices)
+
+
+def test_iter_unique_housing_csv_files_drops_repeats_of_the_same_zip_code():
+    headers = ["ADDRESS", "LATITUDE", "LONGITUDE", "PRICE"]
+    listing = ["1 Main St", "42.36", "-71.06", "500000"]
+    csv_file_rows = [
+        (Path("boston/02134.csv"), [listing, listing]),
+        (
+            Path("cambridge/02134.csv"),
+            [
+                ["1 main st.", "42.360001", "-71.06", "510000"],
+                ["2 Main St", "42.36", "-71.06", "1"],
+            ],
+        ),
+        (Path("cambridge/02139.csv"), [listing]),
+    ]
+    unique_files = list(script.iter_unique_housing_csv_files(csv_file_rows, headers))
+    assert [csv_file for csv_file, _ in unique_files] == [
+        Path("boston/02134.csv"),
+        Path("cambridge/02134.csv"),
+        Path("cambridge/02139.csv"),
+    ]
+    assert [rows for _, rows in unique_files] == [
+        [listing],
+        [["2 Main St", "42.36", "-71.06", "1"]],
+        [listing],
+    ]
+
+
+def test_iter_unique_housing_csv_files_without_key_columns():
+    csv_file_rows = [(Path("boston/02134.csv"), [["1"], ["1"]])]
+    assert list(script.iter_unique_housing_csv_files(csv_file_rows, ["PRICE"])) == (
+        csv_file_rows
+    )
+
+
+def test_get_hilbert_keys_visits_the_corners_in_curve_order():
+    x = np.array([0.0, 0.0, 1.0, 1.0, np.nan])
+    y = np.array([0.0, 1.0, 1.0, 0.0, 1.0])
+    keys = script.get_hilbert_keys(x, y)
+    assert keys.dtype == np.uint64
+    assert list(np.argsort(keys)) == [0, 1, 2, 3, 4]
+    assert keys[4] == np.iinfo(np.uint64).max
+
+
+def test_get_hilbert_keys_is_a_continuous_curve(monkeypatch):
+    monkeypatch.setattr(script, "SPATIAL_ORDER_CURVE_BITS", 3)
+    grid_x, grid_y = np.meshgrid(np.arange(8.0), np.arange(8.0))
+    x, y = grid_x.ravel(), grid_y.ravel()
+    keys = script.get_hilbert_keys(x, y)
+    assert sorted(keys.tolist()) == list(range(64))
+    order = np.argsort(keys)
+    # consecutive cells along the curve are neighbors
+    steps = np.abs(np.diff(x[order])) + np.abs(np.diff(y[order]))
+    assert (steps == 1).all()
+
+
+def test_get_hilbert_keys_without_valid_points():
+    keys = script.get_hilbert_keys(np.array([np.nan]), np.array([0.0]))
+    assert keys.tolist() == [np.iinfo(np.uint64).max]
+
+
+def get_direct_density(
+    x: np.ndarray,
+    y: np.ndarray,
+    origin: tuple[float, float],
+    pixel_size: float,
+    raster_size: tuple[int, int],
+    radius: int,
+) -> np.ndarray:
+    """Kernel density of a whole raster by adding the kernel at every point"""
+    width, height = raster_size
+    kernel = script.get_quartic_kernel(radius)
+    density = np.zeros((height + 2 * radius, width + 2 * radius))
+    for point_x, point_y in zip(x, y):
+        column = int(np.floor((point_x - origin[0]) / pixel_size))
+        row = int(np.floor((origin[1] - point_y) / pixel_size))
+        if 0 <= column < width and 0 <= row < height:
+            density[
+                row : row + 2 * radius + 1, column : column + 2 * radius + 1
+            ] += kernel
+    return density[radius:-radius, radius:-radius] / (pixel_size / 1000) ** 2
+
+
+def test_compute_density_tiles_matches_direct_density(monkeypatch):
+    monkeypatch.setattr(script, "HEATMAP_RASTER_TILE_SIZE", 8)
+    rng = np.random.default_rng(0)
+    origin, pixel_size, raster_size, radius = (0.0, 2000.0), 100.0, (20, 13), 3
+    # points clustered around a tile corner, a lone point and one outside the raster
+    x = np.concatenate((rng.uniform(500, 1100, 40), [1850.0, -50.0]))
+    y = np.concatenate((rng.uniform(900, 1500, 40), [150.0, 1000.0]))
+
+    density = np.zeros((raster_size[1], raster_size[0]), dtype=np.float32)
+    for column_offset, row_offset, tile in script.compute_density_tiles(
+        x, y, origin, pixel_size, raster_size, radius
+    ):
+        assert tile.dtype == np.float32
+        tile_height, tile_width = tile.shape
+        density[
+            row_offset : row_offset + tile_height,
+            column_offset : column_offset + tile_width,
+        ] = tile
+
+    np.testing.assert_allclose(
+        density,
+        get_direct_density(x, y, origin, pixel_size, raster_size, radius),
+        rtol=1e-4,
+        atol=1e-3,
+    )
+
+
+def test_compute_density_tiles_without_points():
+    tiles = script.compute_density_tiles(
+        np.array([]), np.array([]), (0.0, 0.0), 100.0, (20, 20), 3
+    )
+    assert list(tiles) == []
+
+
+def test_compute_group_medians():
+    groups = np.array([0, 0, 0, 1, 1, 1, 1, 2, -1, 0])
+    values = np.array([3.0, 1.0, 2.0, 4.0, 1.0, 3.0, 2.0, np.nan, 100.0, np.nan])
+    np.testing.assert_array_equal(
+        script.compute_group_medians(groups, values, 4), [2.0, 2.5, np.nan, np.nan]
+    )
+
+
+def test_layer_writers_store_every_layer_somewhere(tmp_path):
+    with pytest.raises(TypeError):
+        script.LayerWriter(tmp_path)
+    assert script.GeoPackageWriter(tmp_path / "census.gpkg").get_layer_path(
+        "2020 Income"
+    ) == (tmp_path / "census.gpkg")
+    for writer_class in script.EXPORT_FORMAT_WRITERS.values():
+        layer_path = writer_class(tmp_path).get_layer_path("2020 Income")
+        assert layer_path.parent == tmp_path
+        assert layer_path.suffix == f".{writer_class.extension}"
+
+
+def test_layer_writer_options_can_not_be_changed_in_place():
+    for writer_class in (
+        script.GeoPackageWriter,
+        *script.EXPORT_FORMAT_WRITERS.values(),
+    ):
+        assert isinstance(writer_class.layer_creation_options, tuple)
+        with pytest.raises(TypeError):
+            writer_class.config_options["OGR_SQLITE_CACHE"] = "1"
+
+
+def test_read_gpkg_layer_extents(tmp_path):
+    gpkg_path = tmp_path / "layers.gpkg"
+    connection = sqlite3.connect(gpkg_path)
+    connection.execute(
+        "CREATE TABLE gpkg_contents (table_name TEXT, min_x REAL, min_y REAL, max_x REAL, max_y REAL)"
+    )
+    connection.executemany(
+        "INSERT INTO gpkg_contents VALUES (?, ?, ?, ?, ?)",
+        [
+            ("Locations", -80.0, 38.0, -76.0, 40.0),
+            ("layer_styles", None, None, None, None),
+        ],
+    )
+    connection.commit()
+    connection.close()
+    assert script.read_gpkg_layer_extents(gpkg_path) == {
+        "Locations": (-80.0, 38.0, -76.0, 40.0)
+    }
+    assert script.read_gpkg_layer_extents(tmp_path / "missing.gpkg") == {}
+
+
+@pytest.mark.parametrize(
+    "file_headers, rows",
+    [
+        ("ADDRESS,LATITUDE,LONGITUDE", ["1 Main St,42.36,-71.06", "2 Main St,42.37"]),
+        ("LONGITUDE,ADDRESS,LATITUDE", ["-71.06,1 Main St,42.36", "-71.07,2 Main St"]),
+    ],
+)
+def test_read_housing_csv_file_pads_short_rows(tmp_path, file_headers, rows):
+    csv_file = tmp_path / "02134.csv"
+    csv_file.write_text("\n".join([file_headers, *rows]) + "\n", encoding="utf-8")
+    rows, error = script.read_housing_csv_file(
+        csv_file, ["ADDRESS", "LATITUDE", "LONGITUDE"]
+    )
+    assert error is None
+    assert rows[0] == ["1 Main St", "42.36", "-71.06"]
+    assert len(rows) == 2 and len(rows[1]) == 3
+    assert rows[1][0] == "2 Main St"
+
+
+def test_read_housing_csv_file_rejects_missing_columns(tmp_path):
+    csv_file = tmp_path / "02134.csv"
+    csv_file.write_text("ADDRESS,LATITUDE\n1 Main St,42.36\n", encoding="utf-8")
+    rows, error = script.read_housing_csv_file(
+        csv_file, ["ADDRESS", "LATITUDE", "LONGITUDE"]
+    )
+    assert rows == []
+    assert "LONGITUDE" in error
+
+
+def test_get_stale_census_tables_only_deletes_recorded_tables():
+    levels = [["generalized", 250.0, 1500000]]
+    previous_census = {
+        "DP05": {"wide_table": True, "geometry_levels": levels},
+        "S1501": {"wide_table": False, "layers": ["Income", "Poverty"]},
+        "S1901": {"wide_table": False, "layers": ["Age"]},
+    }
+    census = {
+        "DP05": {"wide_table": True, "geometry_levels": []},
+        "S1501": {"wide_table": False, "layers": ["Income"]},
+    }
+    assert script.get_stale_census_tables(previous_census, census) == {
+        "DP05 (generalized)",
+        "Poverty",
+        "Age",
+    }
+    assert script.get_stale_census_tables({}, census) == set()